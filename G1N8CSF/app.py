@@ -1,128 +1,460 @@
 
-from flask import Flask, render_template_string, jsonify, request, send_file
+from flask import Flask, Blueprint, Response, render_template, jsonify, request, send_file, redirect
+from jinja2 import DictLoader
+import click
 import os
-import requests
 from io import BytesIO
 from datetime import datetime
-from PIL import Image
-from PIL.ExifTags import TAGS
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
-import base64
-import json
+from search_index import TEXT_FIELDS, RANGE_FIELDS
+from instrumentation import Metrics, PROMETHEUS_CONTENT_TYPE
+from profiling import SamplingProfiler
+from reconciler import Reconciler
+from partitions import Partitions, ALBUM_RE
+from storage import ImgBBProvider, LocalProvider, S3Provider, guess_type
+from blob_cache import BlobCache
+from enrichment import Enricher
+from similarity import dhash, MAX_DISTANCE
+from transcode import transcode, variant_record, choose_variant
+from rate_limit import UploadLimiter, MemoryBackend, SQLiteBackend
+import hashlib
+import hmac
+import shutil
+import tempfile
+import threading
 
 load_dotenv()
 
-app = Flask(__name__)
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
-
 IMGBB_API_KEY = os.getenv('IMGBB_API_KEY', '') 
-METADATA_FILE = 'photos_metadata.json'
+IMGBB_UPLOAD_URL = os.getenv('IMGBB_UPLOAD_URL', 'https://api.imgbb.com/1/upload')
+METADATA_FILE = os.getenv('METADATA_FILE', 'photos_metadata.json')
+ALBUMS_DIR = os.getenv('ALBUMS_DIR', 'albums')
+TOMBSTONE_FILE = os.getenv('TOMBSTONE_FILE', 'photos_tombstones.json')
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'imgbb')
+LOCAL_STORAGE_DIR = os.getenv('LOCAL_STORAGE_DIR', 'uploads')
+S3_ENDPOINT = os.getenv('S3_ENDPOINT', '')
+S3_BUCKET = os.getenv('S3_BUCKET', '')
+S3_ACCESS_KEY = os.getenv('S3_ACCESS_KEY', '')
+S3_SECRET_KEY = os.getenv('S3_SECRET_KEY', '')
+S3_REGION = os.getenv('S3_REGION', 'us-east-1')
+S3_PUBLIC_URL = os.getenv('S3_PUBLIC_URL', '')
+RECONCILE_RATE = float(os.getenv('RECONCILE_RATE', 2))
+RECONCILE_BATCH_SIZE = int(os.getenv('RECONCILE_BATCH_SIZE', 20))
+RECONCILE_MAX_ATTEMPTS = int(os.getenv('RECONCILE_MAX_ATTEMPTS', 5))
+RECONCILE_MAX_FAILED = int(os.getenv('RECONCILE_MAX_FAILED', 1000))
+RECONCILE_SWEEP_INTERVAL = int(os.getenv('RECONCILE_SWEEP_INTERVAL', 24 * 60 * 60))
+RECONCILE_SWEEP_RATE = float(os.getenv('RECONCILE_SWEEP_RATE', RECONCILE_RATE))
+DOWNLOAD_CACHE_DIR = os.getenv('DOWNLOAD_CACHE_DIR', 'download_cache')
+DOWNLOAD_CACHE_BYTES = int(os.getenv('DOWNLOAD_CACHE_BYTES', 512 * 1024 * 1024))
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 16))
+ENRICH_BATCH_SIZE = int(os.getenv('ENRICH_BATCH_SIZE', 20))
+ENRICH_RATE = float(os.getenv('ENRICH_RATE', 0))
+TRANSCODE_ENABLED = os.getenv('TRANSCODE_ENABLED', '').lower() in ('1', 'true', 'yes')
+TRANSCODE_WIDTHS = [int(w) for w in os.getenv('TRANSCODE_WIDTHS', '480,1600').split(',') if w.strip()]
+UPLOAD_LIMIT_ENABLED = os.getenv('UPLOAD_LIMIT_ENABLED', '1').lower() in ('1', 'true', 'yes')
+UPLOAD_RATE_MB = float(os.getenv('UPLOAD_RATE_MB', 2))
+UPLOAD_BURST_MB = float(os.getenv('UPLOAD_BURST_MB', 64))
+UPLOAD_MAX_CONCURRENT = int(os.getenv('UPLOAD_MAX_CONCURRENT', 2))
+UPLOAD_MAX_INFLIGHT = int(os.getenv('UPLOAD_MAX_INFLIGHT', 8))
+RATE_LIMIT_DB = os.getenv('RATE_LIMIT_DB', '')
+# How many reverse proxies append to X-Forwarded-For in front of the app; 'true' or 'yes' mean one
+TRUST_PROXY = os.getenv('TRUST_PROXY', '').strip().lower()
+TRUST_PROXY = 1 if TRUST_PROXY in ('true', 'yes') else int(TRUST_PROXY) if TRUST_PROXY.isdigit() else 0
+WARM_UP = os.getenv('WARM_UP', '1').lower() in ('1', 'true', 'yes')
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes')
+
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.005))
+
+def admin_authorized():
+    """True when the request carries ADMIN_TOKEN in X-Admin-Token or ?token="""
+    if not ADMIN_TOKEN:
+        return False
+    token = request.headers.get('X-Admin-Token') or request.args.get('token') or ''
+    return hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8'))
+
+metrics = Metrics(enabled=METRICS_ENABLED)
+
+profiler = SamplingProfiler(
+    sample_rate=PROFILE_SAMPLE_RATE,
+    interval=PROFILE_INTERVAL,
+    authorize=admin_authorized if ADMIN_TOKEN else None
+)
+
+# Limits live in memory unless RATE_LIMIT_DB names a SQLite file that every worker process shares
+upload_limiter = UploadLimiter(
+    SQLiteBackend(RATE_LIMIT_DB) if RATE_LIMIT_DB else MemoryBackend(),
+    rate=UPLOAD_RATE_MB,
+    burst=UPLOAD_BURST_MB,
+    max_concurrent=UPLOAD_MAX_CONCURRENT,
+    max_inflight=UPLOAD_MAX_INFLIGHT,
+    enabled=UPLOAD_LIMIT_ENABLED,
+    trust_proxy=TRUST_PROXY
+)
+
+def upload_limiter_metrics():
+    for outcome, count in upload_limiter.status().items():
+        yield f'upload_{outcome}_total', 'counter', count
+
+metrics.add_collector(upload_limiter_metrics)
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'bmp'}
 
+# Originals fetched without a cache entry roll over from memory to a temp file past this size
+SPOOL_MAX_MEMORY = int(os.getenv('SPOOL_MAX_MEMORY', 1024 * 1024))
+CHUNK_SIZE = 64 * 1024
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def load_metadata():
-    if os.path.exists(METADATA_FILE):
-        with open(METADATA_FILE, 'r') as f:
-            return json.load(f)
-    return []
+def open_album(partition):
+    # Picks up the album's records left pending by a previous run
+    enricher.backfill(records=partition.store.all())
 
-def save_metadata(metadata_list):
-    with open(METADATA_FILE, 'w') as f:
-        json.dump(metadata_list, f, indent=2)
+partitions = Partitions(METADATA_FILE, ALBUMS_DIR, on_open=open_album)
 
-def get_image_metadata_from_bytes(image_bytes, filename):
-  
-    try:
-        metadata = {
-            'filename': filename,
-            'size': len(image_bytes),
-            'size_mb': round(len(image_bytes) / (1024 * 1024), 2),
-            'size_kb': round(len(image_bytes) / 1024, 2),
-            'timestamp': int(datetime.now().timestamp())
-        }
-        
-        now = datetime.now()
-        metadata['created'] = now.strftime('%Y-%m-%d %H:%M:%S')
-        metadata['year'] = now.year
-        metadata['month'] = now.month
-        metadata['day'] = now.day
-        metadata['date_str'] = now.strftime('%B %d, %Y')
-        metadata['time_str'] = now.strftime('%I:%M %p')
-        
-        with Image.open(BytesIO(image_bytes)) as img:
-            metadata['width'] = img.width
-            metadata['height'] = img.height
-            metadata['format'] = img.format
-            metadata['mode'] = img.mode
-           
-            exif_data = img._getexif()
-            if exif_data:
-                for tag_id, value in exif_data.items():
-                    tag = TAGS.get(tag_id, tag_id)
-                    if tag == 'DateTime':
-                        try:
-                            dt = datetime.strptime(str(value), '%Y:%m:%d %H:%M:%S')
-                            metadata['created'] = dt.strftime('%Y-%m-%d %H:%M:%S')
-                            metadata['year'] = dt.year
-                            metadata['month'] = dt.month
-                            metadata['date_str'] = dt.strftime('%B %d, %Y')
-                            metadata['time_str'] = dt.strftime('%I:%M %p')
-                        except:
-                            pass
-                    elif tag == 'Make':
-                        metadata['camera_make'] = str(value).strip()
-                    elif tag == 'Model':
-                        metadata['camera_model'] = str(value).strip()
-                    elif tag == 'LensModel':
-                        metadata['lens'] = str(value).strip()
-                    elif tag == 'FNumber':
-                        metadata['aperture'] = f"f/{float(value)}"
-                    elif tag == 'ExposureTime':
-                        metadata['shutter_speed'] = str(value)
-                    elif tag == 'ISOSpeedRatings':
-                        metadata['iso'] = str(value)
-        
-        return metadata
-    except Exception as e:
-        print(f"Error extracting metadata: {str(e)}")
-        return None
+# The default partition, which the routes outside /albums/ use
+store = partitions.default.store
+search_index = partitions.default.search_index
+similarity_index = partitions.default.similarity_index
+columnar_stats = partitions.default.columnar_stats
 
-def upload_to_imgbb(image_bytes, filename):
-    """Upload image to ImgBB (Free hosting)"""
+def load_metadata():
+    return store.all()
+
+def all_records():
+    """Records from every partition; opens every album, so only background work and admin commands use it"""
+    return [record for partition in partitions.all() for record in partition.store.all()]
+
+def sync_search_index(partition=None):
+    partition = partition or partitions.default
+    partition.store.refresh()
+    return partition.search_index
+
+def photo_ref(record):
+    """Queue key for a photo: its id, as 'album:id' outside the default partition"""
+    album = record.get('album')
+    return f"{album}:{record.get('id')}" if album else record.get('id')
+
+def ref_location(ref):
+    """The partition and photo id a photo_ref points at; the partition is None if the album is gone"""
+    album, _, photo_id = ref.rpartition(':')
+    return partitions.get(album or None), photo_id
+
+def ref_record(ref):
+    partition, photo_id = ref_location(ref)
+    return partition.store.get(photo_id) if partition else None
+
+def hash_upload(file):
+    """Size and sha256 of an uploaded file, read in chunks from the stream werkzeug already spooled it to"""
+    stream = file.stream
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+        size += len(chunk)
+    stream.seek(0)
+    return stream, size, digest.hexdigest()
+
+def basic_metadata(filename, size):
+    """The fields an upload can save without opening the image"""
+    now = datetime.now()
+    return {
+        'filename': filename,
+        'size': size,
+        'size_mb': round(size / (1024 * 1024), 2),
+        'size_kb': round(size / 1024, 2),
+        'timestamp': int(now.timestamp()),
+        'created': now.strftime('%Y-%m-%d %H:%M:%S'),
+        'year': now.year,
+        'month': now.month,
+        'day': now.day,
+        'date_str': now.strftime('%B %d, %Y'),
+        'time_str': now.strftime('%I:%M %p')
+    }
+
+EXIF_IFD = 0x8769
+
+def extract_image_metadata(stream):
+    """Dimensions, format and EXIF fields; raises if PIL can't read the image"""
+    from PIL import Image, UnidentifiedImageError
+    from PIL.ExifTags import TAGS
+
+    metadata = {}
     try:
-        if not IMGBB_API_KEY:
-            return None, "ImgBB API key not configured"
-        
-        image_base64 = base64.b64encode(image_bytes).decode('utf-8')
+        img = Image.open(stream)
+    except UnidentifiedImageError:
+        raise ValueError('Not a recognised image format') from None
+    with img:
+        metadata['width'] = img.width
+        metadata['height'] = img.height
+        metadata['format'] = img.format
+        metadata['mode'] = img.mode
         
-        url = "https://api.imgbb.com/1/upload"
-        payload = {
-            "key": IMGBB_API_KEY,
-            "image": image_base64,
-            "name": filename
-        }
+        # getexif() works for every format (GIF and BMP have no _getexif); lens,
+        # exposure and ISO sit in the Exif sub-IFD, which it keeps separate
+        exif = img.getexif()
+        exif_data = dict(exif)
+        exif_data.update(exif.get_ifd(EXIF_IFD))
+        for tag_id, value in exif_data.items():
+            tag = TAGS.get(tag_id, tag_id)
+            if tag == 'DateTime':
+                try:
+                    dt = datetime.strptime(str(value), '%Y:%m:%d %H:%M:%S')
+                    metadata['created'] = dt.strftime('%Y-%m-%d %H:%M:%S')
+                    metadata['year'] = dt.year
+                    metadata['month'] = dt.month
+                    metadata['date_str'] = dt.strftime('%B %d, %Y')
+                    metadata['time_str'] = dt.strftime('%I:%M %p')
+                except:
+                    pass
+            elif tag == 'Make':
+                metadata['camera_make'] = str(value).strip()
+            elif tag == 'Model':
+                metadata['camera_model'] = str(value).strip()
+            elif tag == 'LensModel':
+                metadata['lens'] = str(value).strip()
+            elif tag == 'FNumber':
+                metadata['aperture'] = f"f/{float(value)}"
+            elif tag == 'ExposureTime':
+                metadata['shutter_speed'] = str(value)
+            elif tag == 'ISOSpeedRatings':
+                metadata['iso'] = str(value)
         
-        response = requests.post(url, data=payload, timeout=30)
-        result = response.json()
-        
-        if result.get('success'):
-            data = result['data']
-            return {
-                'url': data['url'],
-                'display_url': data['display_url'],
-                'delete_url': data['delete_url'],
-                'thumb_url': data.get('thumb', {}).get('url', data['url']),
-                'id': data['id']
-            }, None
-        else:
-            return None, result.get('error', {}).get('message', 'Upload failed')
-            
-    except Exception as e:
-        return None, str(e)
+        try:
+            metadata['phash'] = dhash(img)
+        except Exception as e:
+            print(f"Error hashing image: {str(e)}")
+    return metadata
+
+# One pooled session for every upstream call, so downloads reuse keep-alive connections.
+# Built on first use, so a worker that only serves reads never imports requests.
+http = None
+http_lock = threading.Lock()
+
+def get_http():
+    global http
+    with http_lock:
+        if http is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            http = session
+    return http
+
+blob_cache = BlobCache(DOWNLOAD_CACHE_DIR, DOWNLOAD_CACHE_BYTES)
+
+def cache_key(record):
+    """Blob cache key: the content hash, so duplicate uploads share an entry; old records fall back to id"""
+    return record.get('sha256') or record.get('id')
+
+def blob_cache_metrics():
+    stats = blob_cache.stats()
+    for name in ('hits', 'misses', 'coalesced', 'hit_bytes', 'fetched_bytes', 'evictions', 'evicted_bytes'):
+        yield f'blob_cache_{name}_total', 'counter', stats[name]
+    yield 'blob_cache_hit_ratio', 'gauge', stats['hit_ratio']
+    yield 'blob_cache_entries', 'gauge', stats['entries']
+    yield 'blob_cache_bytes', 'gauge', stats['bytes']
+    yield 'blob_cache_max_bytes', 'gauge', stats['max_bytes']
+
+metrics.add_collector(blob_cache_metrics)
+
+storage_providers = {}
+
+def build_storage(name):
+    if name == 'local':
+        return LocalProvider(LOCAL_STORAGE_DIR)
+    if name == 's3':
+        return S3Provider(
+            S3_ENDPOINT, S3_BUCKET, S3_ACCESS_KEY, S3_SECRET_KEY, get_http(),
+            region=S3_REGION, public_url=S3_PUBLIC_URL or None
+        )
+    if name == 'imgbb':
+        return ImgBBProvider(IMGBB_API_KEY, IMGBB_UPLOAD_URL, get_http(), stage=metrics.stage)
+    raise ValueError(f"Unknown storage backend {name}")
+
+def get_storage(name=None):
+    """Provider by name, defaulting to STORAGE_BACKEND; records without 'storage' predate it and are ImgBB"""
+    name = name or STORAGE_BACKEND
+    if name not in storage_providers:
+        storage_providers[name] = build_storage(name)
+    return storage_providers[name]
+
+def record_storage(record):
+    return get_storage(record.get('storage') or 'imgbb')
+
+def still_referenced(field, value):
+    """True if a live record or one of its variants, in any album, still points at the same stored bytes"""
+    return partitions.references.count(field, value) > 0
+
+def delete_stored(tombstone):
+    with partitions.references.locked():
+        # The counts cover loaded partitions only: open every album, and reload any another process wrote to.
+        # sync waits out open transactions, as deletes write their tombstone before they commit
+        for partition in partitions.all():
+            partition.store.sync()
+        if any(tombstone.get(field) and still_referenced(field, tombstone[field]) for field in ('storage_key', 'url')):
+            # Content-addressed, so another photo shares the bytes, or the delete that tombstoned it was rolled back
+            return True, None
+        if not (tombstone.get('sha256') and still_referenced('sha256', tombstone['sha256'])):
+            blob_cache.discard(cache_key(tombstone))
+        return record_storage(tombstone).delete(tombstone)
+
+def stored_missing(record):
+    """True if a content-addressed object is known to be gone.
+
+    Putting bytes that are already stored is a no-op, and a tombstone for
+    an earlier photo with the same content can delete them again before the
+    new record is saved. Check under ``partitions.references.locked()``,
+    and save in the same critical section.
+    """
+    return bool(record.get('storage_key')) and record_storage(record).exists(record) is False
+
+def variant_objects(photo_id, variants):
+    """Transcoded variants shaped like records, each with an id of its own, for the reconciler"""
+    for variant in variants or ():
+        yield {**variant, 'id': f"{photo_id}/{variant['label']}.{variant['format']}"}
+
+def stored_objects(records):
+    """Each record plus its transcoded variants, shaped alike so the reconciler deletes them all"""
+    for record in records:
+        yield record
+        yield from variant_objects(record.get('id'), record.get('variants'))
+
+def stored_exists(record):
+    return record_storage(record).exists(record)
+
+def mark_out_of_sync(refs):
+    photo_ids = {}
+    for ref in refs:
+        partition, photo_id = ref_location(ref)
+        if partition:
+            photo_ids.setdefault(partition, []).append(photo_id)
+    for partition, ids in photo_ids.items():
+        with partition.store.transaction():
+            for photo_id in ids:
+                partition.store.update(photo_id, {'remote_missing': True})
+
+def open_original(record):
+    """Seekable file of a photo's original: local storage, the blob cache, or a spooled fetch"""
+    storage = record_storage(record)
+    path = storage.local_path(record)
+    if not (path and os.path.exists(path)):
+        path = blob_cache.fetch(cache_key(record), lambda: storage.open(record))
+    if path:
+        return open(path, 'rb')
+    stream = storage.open(record)
+    if stream is None:
+        return None
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    with stream:
+        shutil.copyfileobj(stream, spool, CHUNK_SIZE)
+    spool.seek(0)
+    return spool
+
+def store_variants(stream, record, fields):
+    """Transcode smaller renditions and upload them to the provider holding the original"""
+    storage = record_storage(record)
+    stem = (record.get('filename') or record.get('id')).rsplit('.', 1)[0]
+    with metrics.stage('transcode'):
+        renditions = transcode(stream, fields.get('format'), record.get('size') or 0, TRANSCODE_WIDTHS)
+    variants = []
+    for label, fmt, width, height, data in renditions:
+        variant = variant_record(label, fmt, width, height, data)
+        filename = f"{stem}.{label}.{'jpg' if fmt == 'jpeg' else fmt}"
+        with metrics.stage('variant_upload'):
+            try:
+                upload_result, error = storage.put(BytesIO(data), len(data), filename, variant['sha256'])
+            except Exception as e:
+                upload_result, error = None, str(e)
+        if not upload_result:
+            print(f"Failed to upload variant {filename}: {error}")
+            continue
+        variant['url'] = upload_result['url']
+        variant['delete_url'] = upload_result['delete_url']
+        variant['storage'] = storage.name
+        if upload_result.get('storage_key'):
+            variant['storage_key'] = upload_result['storage_key']
+        variants.append(variant)
+        metrics.count('variants_total', format=fmt)
+    return variants
+
+def enrich_original(stream, record):
+    fields = extract_image_metadata(stream)
+    if TRANSCODE_ENABLED and not record.get('variants'):
+        try:
+            stream.seek(0)
+            fields['variants'] = store_variants(stream, record, fields)
+        except Exception as e:
+            print(f"Transcode error for {record.get('id')}: {str(e)}")
+    return fields
+
+def apply_enrichment(ref, fields):
+    partition, photo_id = ref_location(ref)
+    updated = None
+    if partition:
+        with partitions.references.locked():
+            if fields.get('variants'):
+                # The rendition bytes are gone; a variant that lost its object would only 404
+                fields['variants'] = [variant for variant in fields['variants'] if not stored_missing(variant)]
+            updated = partition.store.update(photo_id, fields)
+    if updated is None and fields.get('variants'):
+        # Deleted while it was transcoding: nothing will ever point at the new variants
+        reconciler.enqueue(list(variant_objects(photo_id, fields['variants'])))
+
+enricher = Enricher(
+    open_original,
+    extract=enrich_original,
+    load_records=all_records,
+    get_record=ref_record,
+    apply=apply_enrichment,
+    batch_size=ENRICH_BATCH_SIZE,
+    rate=ENRICH_RATE,
+    key=photo_ref
+)
+
+def enricher_metrics():
+    status = enricher.status()
+    for outcome in ('enriched', 'unreadable', 'unavailable'):
+        yield f'enrich_{outcome}_total', 'counter', status[outcome]
+    yield 'enrich_queued', 'gauge', status['queued']
+
+metrics.add_collector(enricher_metrics)
+
+def partition_metrics():
+    yield 'albums_open', 'gauge', len(partitions.albums)
+
+metrics.add_collector(partition_metrics)
+
+reconciler = Reconciler(
+    TOMBSTONE_FILE,
+    delete_remote=delete_stored,
+    check_remote=stored_exists,
+    load_records=all_records,
+    mark_out_of_sync=mark_out_of_sync,
+    batch_size=RECONCILE_BATCH_SIZE,
+    rate=RECONCILE_RATE,
+    max_attempts=RECONCILE_MAX_ATTEMPTS,
+    max_failed=RECONCILE_MAX_FAILED,
+    sweep_interval=RECONCILE_SWEEP_INTERVAL,
+    sweep_rate=RECONCILE_SWEEP_RATE,
+    key=photo_ref
+)
+
+bp = Blueprint('gallery', __name__, cli_group=None)
+
+@bp.before_app_request
+def start_workers():
+    if reconciler.thread is None:
+        reconciler.start()
+    if enricher.thread is None:
+        # Picks up records left pending by a previous run; albums do the same as they open
+        enricher.backfill(records=load_metadata())
 
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -597,7 +929,7 @@ HTML_TEMPLATE = """
 <body>
     <div class="header">
         <h1><i class="fas fa-cloud"></i> G1N8CSF GALLERY PRO</h1>
-        <p>CLOUD PHOTO MANAGEMENT</p>
+        <p>{% if album %}ALBUM: {{ album|upper }}{% else %}CLOUD PHOTO MANAGEMENT{% endif %}</p>
     </div>
 
     <div class="setup-notice" id="setupNotice">
@@ -660,6 +992,7 @@ HTML_TEMPLATE = """
     </div>
 
     <script>
+        const API_BASE = {{ api_base|tojson }};
         let photos = [];
         let currentIndex = 0;
         let currentView = 'masonry';
@@ -675,7 +1008,7 @@ HTML_TEMPLATE = """
             document.getElementById('loading').style.display = 'block';
 
             try {
-                const res = await fetch('/upload', { method: 'POST', body: formData });
+                const res = await fetch(API_BASE + '/upload', { method: 'POST', body: formData });
                 const data = await res.json();
                 
                 if (data.success) {
@@ -695,8 +1028,9 @@ HTML_TEMPLATE = """
         async function loadPhotos() {
             document.getElementById('loading').style.display = 'block';
             try {
-                const res = await fetch('/photos');
-                photos = await res.json();
+                const res = await fetch(API_BASE + '/photos');
+                // A new album has no photos until its first upload
+                photos = res.ok ? await res.json() : [];
                 if (photos.length > 0) {
                     document.getElementById('setupNotice').style.display = 'none';
                 }
@@ -774,13 +1108,13 @@ HTML_TEMPLATE = """
                 const idx = photos.indexOf(p);
                 return `
                     <div class="gallery-item" onclick="openLightbox(${idx})" style="animation-delay: ${i * 0.05}s">
-                        <img src="${p.url}" alt="${p.filename}" loading="lazy">
+                        <img src="${p.variants ? `${API_BASE}/photos/${p.id}/image?w=480` : p.url}" alt="${p.filename}" loading="lazy">
                         <div class="item-overlay">
                             <div class="item-info">
                                 <strong>${p.filename}</strong>
                                 <div><i class="fas fa-calendar"></i> ${p.date_str}</div>
                                 <div><i class="fas fa-clock"></i> ${p.time_str}</div>
-                                <div><i class="fas fa-ruler-combined"></i> ${p.width}×${p.height}</div>
+                                ${p.width ? `<div><i class="fas fa-ruler-combined"></i> ${p.width}×${p.height}</div>` : ''}
                                 <div><i class="fas fa-cloud"></i> ${p.size_mb} MB</div>
                             </div>
                         </div>
@@ -795,7 +1129,7 @@ HTML_TEMPLATE = """
         function openLightbox(idx) {
             currentIndex = idx;
             const p = photos[idx];
-            document.getElementById('lightboxImg').src = p.url;
+            document.getElementById('lightboxImg').src = p.variants ? `${API_BASE}/photos/${p.id}/image?w=1600` : p.url;
             
             let cameraInfo = '';
             if (p.camera_make || p.camera_model) {
@@ -826,7 +1160,7 @@ HTML_TEMPLATE = """
                     <div class="info-title"><i class="fas fa-info-circle"></i> Details</div>
                     <div class="info-row"><span class="info-label">Filename</span><span class="info-value">${p.filename}</span></div>
                     <div class="info-row"><span class="info-label">Format</span><span class="info-value">${p.format || 'N/A'}</span></div>
-                    <div class="info-row"><span class="info-label">Size</span><span class="info-value">${p.width} × ${p.height} px</span></div>
+                    <div class="info-row"><span class="info-label">Size</span><span class="info-value">${p.width ? `${p.width} × ${p.height} px` : 'Processing'}</span></div>
                     <div class="info-row"><span class="info-label">File Size</span><span class="info-value">${p.size_mb} MB</span></div>
                 </div>
 
@@ -847,7 +1181,7 @@ HTML_TEMPLATE = """
                 ${exifInfo}
 
                 <div class="action-btns">
-                    <button class="action-btn" onclick="downloadPhoto('${p.url}', '${p.filename}')">
+                    <button class="action-btn" onclick="downloadPhoto('${API_BASE}/download/${p.id}', '${p.filename}')">
                         <i class="fas fa-download"></i> Download
                     </button>
                     <button class="action-btn danger" onclick="deletePhoto('${p.id}')">
@@ -885,7 +1219,7 @@ HTML_TEMPLATE = """
 
         function downloadCurrentPhoto() {
             const p = photos[currentIndex];
-            downloadPhoto(p.url, p.filename);
+            downloadPhoto(`${API_BASE}/download/${p.id}`, p.filename);
         }
 
         async function deletePhoto(id) {
@@ -894,7 +1228,7 @@ HTML_TEMPLATE = """
             document.getElementById('loading').style.display = 'block';
 
             try {
-                const res = await fetch('/delete/' + id, { 
+                const res = await fetch(API_BASE + '/delete/' + id, { 
                     method: 'DELETE',
                     headers: { 'Content-Type': 'application/json' }
                 });
@@ -957,28 +1291,170 @@ HTML_TEMPLATE = """
 </html>
 """
 
-@app.route('/')
-def index():
-    return render_template_string(HTML_TEMPLATE)
-
-@app.route('/photos')
-def get_photos():
-
+def album_not_found():
+    return jsonify({'success': False, 'message': 'Album not found'}), 404
+
+@bp.route('/')
+@bp.route('/albums/<album>/')
+def index(album=None):
+    if album is not None and not ALBUM_RE.match(album):
+        return album_not_found()
+    return render_template('index.html', album=album, api_base=f'/albums/{album}' if album else '')
+
+@bp.route('/albums')
+def list_albums():
+    """Album names, read from the albums directory without loading any of them"""
+    return jsonify({'success': True, 'albums': partitions.names()})
+
+@bp.route('/photos')
+@bp.route('/albums/<album>/photos')
+def get_photos(album=None):
+    partition = partitions.get(album)
+    if partition is None:
+        return album_not_found()
     try:
-        photos = load_metadata()
-        photos.sort(key=lambda x: x.get('timestamp', 0), reverse=True)
-        return jsonify(photos)
+        with metrics.stage('load'):
+            photos = partition.store.all()
+        with metrics.stage('sort'):
+            photos.sort(key=lambda x: x.get('timestamp', 0), reverse=True)
+        with metrics.stage('serialize'):
+            return jsonify(photos)
     except Exception as e:
         print(f"Error: {str(e)}")
         return jsonify([])
 
-@app.route('/upload', methods=['POST'])
-def upload_files():
+def parse_number(value):
+    if value in (None, ''):
+        return None
+    number = float(value)
+    return int(number) if number.is_integer() else number
+
+@bp.route('/photos/<photo_id>/image')
+@bp.route('/albums/<album>/photos/<photo_id>/image')
+def photo_image(photo_id, album=None):
+    """Redirect to the smallest rendition the client accepts (AVIF, WebP, progressive JPEG) at ?w=, else the original"""
+    partition = partitions.get(album)
+    if partition is None:
+        return album_not_found()
+    record = partition.store.get(photo_id)
+    if record is None:
+        return jsonify({'success': False, 'message': 'Photo not found'}), 404
+    try:
+        width = int(request.args.get('w') or 0)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'w must be a width in pixels'}), 400
+    
+    variant = choose_variant(record.get('variants') or [], request.accept_mimetypes, width)
+    metrics.count('images_served_total', rendition=variant['format'] if variant else 'original')
+    response = redirect(variant['url'] if variant else record['url'], 302)
+    response.vary.add('Accept')
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
+    return response
+
+@bp.route('/photos/<photo_id>/similar')
+@bp.route('/albums/<album>/photos/<photo_id>/similar')
+def similar_photos(photo_id, album=None):
+    """Photos in the same album whose perceptual hash is within ?distance= bits of this one, closest first"""
+    partition = partitions.get(album)
+    if partition is None:
+        return album_not_found()
+    try:
+        distance = min(max(int(request.args.get('distance', 10)), 0), MAX_DISTANCE)
+        limit = min(max(int(request.args.get('limit', 20)), 1), 200)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Invalid parameter: {e}'}), 400
+    
+    record = partition.store.get(photo_id)
+    if record is None:
+        return jsonify({'success': False, 'message': 'Photo not found'}), 404
+    if not record.get('phash'):
+        return jsonify({'success': False, 'message': 'Photo has no perceptual hash yet'}), 409
+    
+    with metrics.stage('similar'):
+        matches = partition.similarity_index.search(record['phash'], distance, limit, exclude=photo_id)
+    results = []
+    for match_distance, match_id in matches:
+        match = partition.store.get(match_id)
+        if match:
+            results.append({**match, 'distance': match_distance})
+    return jsonify({'success': True, 'phash': record['phash'], 'distance': distance, 'results': results})
+
+@bp.route('/search')
+@bp.route('/albums/<album>/search')
+def search_photos(album=None):
+    """Search by ?q= across text fields, per-field ?camera_make= etc, and ?iso_min=/?iso_max= style ranges"""
+    partition = partitions.get(album)
+    if partition is None:
+        return album_not_found()
+    try:
+        fields = {field: request.args[field] for field in TEXT_FIELDS if request.args.get(field)}
+        ranges = {}
+        for field in RANGE_FIELDS:
+            low = parse_number(request.args.get(f'{field}_min'))
+            high = parse_number(request.args.get(f'{field}_max'))
+            if low is not None or high is not None:
+                ranges[field] = (low, high)
+        limit = min(max(int(request.args.get('limit', 50)), 1), 1000)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Invalid search parameter: {e}'}), 400
+    
+    try:
+        with metrics.stage('index'):
+            index = sync_search_index(partition)
+        with metrics.stage('query'):
+            total, results = index.search(
+                text=request.args.get('q'), fields=fields, ranges=ranges, limit=limit, offset=offset
+            )
+        return jsonify({'success': True, 'total': total, 'results': results})
+    except Exception as e:
+        print(f"Search error: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+STATS_FILTER_FIELDS = {'year': int, 'month': int, 'camera_make': str, 'camera_model': str, 'format': str}
+
+@bp.route('/stats')
+@bp.route('/albums/<album>/stats')
+def library_stats(album=None):
+    """Totals and breakdowns by year, month, camera and format; narrow with ?year=2024&camera_make=Canon etc"""
+    partition = partitions.get(album)
+    if partition is None:
+        return album_not_found()
+    if partition.columnar_stats is None:
+        return jsonify({'success': False, 'message': 'Statistics need NumPy. Run pip install numpy'}), 404
+    try:
+        filters = {
+            field: cast(request.args[field]) for field, cast in STATS_FILTER_FIELDS.items() if request.args.get(field)
+        }
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Invalid stats parameter: {e}'}), 400
+    
+    try:
+        with metrics.stage('aggregate'):
+            stats = partition.columnar_stats.query(filters)
+        return jsonify({'success': True, 'filters': filters, **stats})
+    except Exception as e:
+        print(f"Stats error: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.route('/upload', methods=['POST'])
+@bp.route('/albums/<album>/upload', methods=['POST'])
+@upload_limiter.limit
+def upload_files(album=None):
+    # The album itself is only created once there are records to save in it
+    if album is not None and not ALBUM_RE.match(album):
+        return jsonify({
+            'success': False,
+            'message': 'Album names are up to 64 lowercase letters, digits, - and _'
+        }), 400
     try:
-        if not IMGBB_API_KEY:
+        storage = get_storage()
+        config_error = storage.config_error()
+        if config_error:
             return jsonify({
                 'success': False, 
-                'message': 'ImgBB API key not configured. Please add IMGBB_API_KEY to .env file'
+                'message': config_error
             }), 400
         
         if 'files' not in request.files:
@@ -986,18 +1462,28 @@ def upload_files():
         
         files = request.files.getlist('files')
         uploaded_files = []
-        metadata_list = load_metadata()
+        new_records = []
+        # Kept open until the records are saved, in case the bytes have to be put again
+        streams = {}
         
         for file in files:
             if file and allowed_file(file.filename):
                 filename = secure_filename(file.filename)
-                image_bytes = file.read()
+                with metrics.stage('read'):
+                    stream, size, sha256 = hash_upload(file)
+                metrics.count('upload_bytes_total', size)
                 
-                metadata = get_image_metadata_from_bytes(image_bytes, filename)
-                if not metadata:
-                    continue
+                metadata = basic_metadata(filename, size)
+                metadata['sha256'] = sha256
+                metadata['enriched'] = False
+                if album:
+                    metadata['album'] = album
                 
-                upload_result, error = upload_to_imgbb(image_bytes, filename)
+                with metrics.stage('remote_upload'):
+                    try:
+                        upload_result, error = storage.put(stream, size, filename, sha256)
+                    except Exception as e:
+                        upload_result, error = None, str(e)
                 
                 if upload_result:
                     metadata['url'] = upload_result['url']
@@ -1005,15 +1491,48 @@ def upload_files():
                     metadata['delete_url'] = upload_result['delete_url']
                     metadata['thumb_url'] = upload_result['thumb_url']
                     metadata['id'] = upload_result['id']
+                    metadata['storage'] = storage.name
+                    if upload_result.get('storage_key'):
+                        metadata['storage_key'] = upload_result['storage_key']
                     
-                    metadata_list.append(metadata)
+                    new_records.append(metadata)
                     uploaded_files.append(filename)
+                    streams[metadata['id']] = stream
                     
-                    print(f"Uploaded {filename} to ImgBB")
+                    metrics.count('uploads_total', result='ok')
+                    print(f"Uploaded {filename} to {storage.name}")
                 else:
+                    stream.close()
+                    metrics.count('uploads_total', result='failed')
                     print(f"Failed to upload {filename}: {error}")
         
-        save_metadata(metadata_list)
+        try:
+            with metrics.stage('save_metadata'), partitions.references.locked():
+                for record in list(new_records):
+                    if stored_missing(record):
+                        # A tombstone for the same content deleted the bytes since they were put
+                        upload_result, error = storage.put(streams[record['id']], record['size'], record['filename'], record['sha256'])
+                        if not upload_result:
+                            print(f"Failed to upload {record['filename']}: {error}")
+                            new_records.remove(record)
+                            uploaded_files.remove(record['filename'])
+                if new_records:
+                    partitions.get(album, create=True).store.put(new_records)
+            
+            for record in new_records:
+                if storage.local_path(record) is None and blob_cache.fits(record['size']):
+                    # The enricher reads the original next; keep a copy instead of fetching it back
+                    with metrics.stage('cache_seed'):
+                        try:
+                            stream = streams[record['id']]
+                            stream.seek(0)
+                            blob_cache.fill(record['sha256'], stream, CHUNK_SIZE)
+                        except OSError as e:
+                            print(f"Could not cache {record['filename']}: {str(e)}")
+        finally:
+            for stream in streams.values():
+                stream.close()
+        enricher.enqueue([photo_ref(record) for record in new_records])
         
         if uploaded_files:
             return jsonify({
@@ -1031,29 +1550,138 @@ def upload_files():
         print(f"Upload error: {str(e)}")
         return jsonify({'success': False, 'message': str(e)}), 500
 
-@app.route('/download/<path:url>')
-def download_file(url):
+@bp.route('/metrics')
+def get_metrics():
+    if not metrics.enabled:
+        return jsonify({'success': False, 'message': 'Metrics are disabled. Set METRICS_ENABLED=1 in .env'}), 404
+    return Response(metrics.render(), mimetype=PROMETHEUS_CONTENT_TYPE)
+
+@bp.route('/admin/profile', methods=['GET', 'DELETE'])
+def admin_profile():
+    """Collapsed stacks from profiled requests, ready for flamegraph.pl or speedscope"""
+    if not admin_authorized():
+        return jsonify({'success': False, 'message': 'Admin token required'}), 403
+    if request.method == 'DELETE':
+        profiler.reset()
+        return jsonify({'success': True, 'message': 'Profile samples cleared'})
+    if request.args.get('format') == 'json':
+        return jsonify({'success': True, **profiler.summary()})
+    return Response(profiler.collapsed(), mimetype='text/plain')
+
+@bp.route('/admin/reconcile', methods=['GET', 'POST'])
+def admin_reconcile():
+    """Tombstone queue status; POST starts a sweep of stored URLs in the background"""
+    if not admin_authorized():
+        return jsonify({'success': False, 'message': 'Admin token required'}), 403
+    if request.method == 'POST':
+        if not reconciler.start_sweep():
+            return jsonify({'success': False, 'message': 'A sweep is already running'}), 409
+        return jsonify({'success': True, 'message': 'Sweep started'}), 202
+    return jsonify({'success': True, **reconciler.status()})
+
+@bp.route('/admin/enrich', methods=['GET', 'POST'])
+def admin_enrich():
+    """Enrichment queue status; POST queues a backfill of records missing metadata (?all=1 for every
+    record, ?missing=phash for records missing a given field)"""
+    if not admin_authorized():
+        return jsonify({'success': False, 'message': 'Admin token required'}), 403
+    if request.method == 'POST':
+        queued = enricher.backfill(
+            force=request.args.get('all') == '1', fields=request.args.getlist('missing') or None
+        )
+        return jsonify({'success': True, 'message': f'{queued} records queued for enrichment'}), 202
+    return jsonify({'success': True, **enricher.status()})
+
+@bp.route('/admin/cache')
+def admin_cache():
+    """Blob cache hit ratio and byte counters"""
+    if not admin_authorized():
+        return jsonify({'success': False, 'message': 'Admin token required'}), 403
+    return jsonify({'success': True, **blob_cache.stats()})
+
+@bp.route('/files/<path:key>')
+def serve_local_file(key):
+    """Originals held by the local provider; content-addressed, so cacheable forever"""
+    path = get_storage('local').path_for(key)
+    if path is None or not os.path.exists(path):
+        return jsonify({'success': False, 'message': 'File not found'}), 404
+    response = send_file(path, conditional=True, etag=key.rsplit('/', 1)[-1].split('.')[0], max_age=31536000)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+def send_original(path, record, etag):
+    return send_file(
+        path, mimetype=guess_type(record.get('filename', '')), as_attachment=True,
+        download_name=record.get('filename'), conditional=True, etag=etag, max_age=86400
+    )
+
+@bp.route('/download/<photo_id>')
+@bp.route('/albums/<album>/download/<photo_id>')
+def download_file(photo_id, album=None):
+    """Original bytes, from local storage or the blob cache, filling the cache from upstream on a miss"""
+    partition = partitions.get(album)
+    if partition is None:
+        return album_not_found()
+    record = partition.store.get(photo_id)
+    if record is None:
+        return jsonify({'success': False, 'message': 'Photo not found'}), 404
+    etag = record.get('sha256') or photo_id
+    storage = record_storage(record)
+    
     try:
-        return jsonify({'success': True, 'url': url})
+        path = storage.local_path(record)
+        if path and os.path.exists(path):
+            metrics.count('downloads_total', source='local')
+            return send_original(path, record, etag)
+        
+        if etag in request.if_none_match:
+            return Response(status=304, headers={'ETag': f'"{etag}"'})
+        
+        size = record.get('size')
+        if size is None or blob_cache.fits(size):
+            with metrics.stage('blob_cache'):
+                path = blob_cache.fetch(cache_key(record), lambda: storage.open(record))
+            if path:
+                metrics.count('downloads_total', source='cache')
+                return send_original(path, record, etag)
+        
+        # Over the cache budget (or the fill failed): pass the bytes straight through
+        stream = storage.open(record)
+        if stream is None:
+            return jsonify({'success': False, 'message': 'Original not available from storage'}), 502
+        metrics.count('downloads_total', source='upstream')
+        response = Response(
+            iter(lambda: stream.read(CHUNK_SIZE), b''),
+            mimetype=guess_type(record.get('filename', '')), direct_passthrough=True
+        )
+        response.call_on_close(stream.close)
+        response.headers['Content-Disposition'] = f'attachment; filename="{record.get("filename") or photo_id}"'
+        response.set_etag(etag)
+        response.cache_control.max_age = 86400
+        return response
     except Exception as e:
-        return jsonify({'success': False, 'message': str(e)}), 500
-
-@app.route('/delete/<photo_id>', methods=['DELETE'])
-def delete_file(photo_id):
+        print(f"Download error: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 502
+
+@bp.route('/delete/<photo_id>', methods=['DELETE'])
+@bp.route('/albums/<album>/delete/<photo_id>', methods=['DELETE'])
+def delete_file(photo_id, album=None):
+    partition = partitions.get(album)
+    if partition is None:
+        return album_not_found()
     try:
         print(f"Deleting photo: {photo_id}")
         
-        metadata_list = load_metadata()
-        
-        original_count = len(metadata_list)
-        metadata_list = [p for p in metadata_list if p.get('id') != photo_id]
+        with partition.store.transaction():
+            removed = partition.store.remove([photo_id])
+            # Tombstoned before the commit: if this fails the record stays, never the other way round
+            reconciler.enqueue(list(stored_objects(removed)))
         
-        if len(metadata_list) < original_count:
-            save_metadata(metadata_list)
+        if removed:
             print(f"Successfully removed photo {photo_id} from metadata")
             return jsonify({
                 'success': True, 
-                'message': 'Photo removed from gallery (ImgBB file still exists)'
+                'message': 'Photo removed from gallery, storage deletion queued'
             }), 200
         else:
             return jsonify({'success': False, 'message': 'Photo not found'}), 404
@@ -1062,6 +1690,121 @@ def delete_file(photo_id):
         print(f"Delete error: {str(e)}")
         return jsonify({'success': False, 'message': str(e)}), 500
 
+BATCH_FILTER_FIELDS = {'year': int, 'month': int, 'camera_make': str, 'camera_model': str, 'lens': str}
+
+def matching_photo_ids(filters, partition=None):
+    """Ids whose fields equal every filter value, narrowed through the search index first"""
+    ranges = {field: (value, value) for field, value in filters.items() if BATCH_FILTER_FIELDS[field] is int}
+    fields = {field: value for field, value in filters.items() if BATCH_FILTER_FIELDS[field] is str}
+    index = sync_search_index(partition)
+    matched = []
+    for photo_id in list(index.match(fields=fields, ranges=ranges)):
+        record = index.records.get(photo_id)
+        if record and all(str(record.get(field, '')).strip().lower() == value.strip().lower()
+                          for field, value in fields.items()):
+            matched.append(photo_id)
+    return matched
+
+@bp.route('/delete/batch', methods=['POST'])
+@bp.route('/albums/<album>/delete/batch', methods=['POST'])
+def delete_batch(album=None):
+    """Remove many photos in one store transaction, by {"ids": [...]} or {"filter": {"year": 2024, ...}}"""
+    partition = partitions.get(album)
+    if partition is None:
+        return album_not_found()
+    payload = request.get_json(silent=True) or {}
+    ids = payload.get('ids')
+    filters = payload.get('filter')
+    
+    if (ids is None) == (filters is None):
+        return jsonify({'success': False, 'message': 'Provide exactly one of ids or filter'}), 400
+    if ids is not None and (not isinstance(ids, list) or not all(isinstance(i, str) for i in ids)):
+        return jsonify({'success': False, 'message': 'ids must be a list of photo id strings'}), 400
+    if filters is not None:
+        if not isinstance(filters, dict) or not filters:
+            return jsonify({'success': False, 'message': 'filter must name at least one field'}), 400
+        unknown = set(filters) - set(BATCH_FILTER_FIELDS)
+        if unknown:
+            return jsonify({
+                'success': False,
+                'message': f"Unsupported filter fields: {', '.join(sorted(unknown))}. Use {', '.join(BATCH_FILTER_FIELDS)}"
+            }), 400
+        try:
+            filters = {field: BATCH_FILTER_FIELDS[field](value) for field, value in filters.items()}
+        except (TypeError, ValueError) as e:
+            return jsonify({'success': False, 'message': f'Invalid filter value: {e}'}), 400
+    
+    try:
+        with partition.store.transaction():
+            if filters is not None:
+                ids = matching_photo_ids(filters, partition)
+            removed = partition.store.remove(ids)
+            reconciler.enqueue(list(stored_objects(removed)))
+        
+        removed_ids = {p.get('id') for p in removed}
+        results = {photo_id: 'deleted' if photo_id in removed_ids else 'not_found' for photo_id in ids}
+        print(f"Batch removed {len(removed)} photos from metadata")
+        return jsonify({
+            'success': True,
+            'message': f'{len(removed)} photos removed from gallery, storage deletion queued',
+            'deleted': len(removed),
+            'not_found': len(results) - len(removed),
+            'results': results
+        }), 200
+    except Exception as e:
+        print(f"Batch delete error: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.cli.command('backfill-metadata')
+@click.option('--all', 'force', is_flag=True, help='Re-extract every record, not only incomplete ones')
+@click.option('--missing', multiple=True, help='Re-extract records missing this field, e.g. --missing phash')
+@click.option('--limit', type=int, default=None, help='Stop after this many records')
+def backfill_metadata(force, missing, limit):
+    """Extract dimensions and EXIF for records that are pending or missing them"""
+    queued = enricher.backfill(force=force, limit=limit, fields=missing or None)
+    print(f"Enriching {queued} records...")
+    enricher.drain()
+    status = enricher.status()
+    print(f"Done: {status['enriched']} enriched, {status['unreadable']} unreadable, {status['unavailable']} unavailable")
+
+def warm_up(app):
+    """Load the metadata and build its indexes, and compile the page template, ahead of the first request"""
+    try:
+        store.refresh()
+        with app.app_context():
+            app.jinja_env.get_template('index.html')
+    except Exception as e:
+        print(f"Warm-up error: {str(e)}")
+
+def create_app():
+    """The Flask app serving the gallery; WSGI servers can call this per worker (app:create_app())"""
+    app = Flask(__name__)
+    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+    # Compiled once and cached by Jinja, instead of re-parsed by every render_template_string call
+    app.jinja_loader = DictLoader({'index.html': HTML_TEMPLATE})
+    metrics.init_app(app)
+    profiler.init_app(app)
+    app.register_blueprint(bp)
+    if WARM_UP:
+        threading.Thread(target=warm_up, args=(app,), name='warm-up', daemon=True).start()
+    return app
+
+app_lock = threading.Lock()
+
+def __getattr__(name):
+    """Build the module-level ``app`` on first use (flask run, app:app) rather than on import.
+
+    Importing the module alone, as gunicorn 'app:create_app()' and the
+    bench do, then builds no extra app and starts no extra warm-up thread.
+    """
+    global app
+    if name != 'app':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with app_lock:
+        if 'app' not in globals():
+            app = create_app()
+    return app
+
 if __name__ == '__main__':
     print("=" * 70)
     print("🎉 G1N8CSF GALLERY PRO -  CLOUD EDITION")
@@ -1069,4 +1812,4 @@ if __name__ == '__main__':
     print(f"✨ Server running at: http://localhost:5000")
 
     print("\n🚀 Starting server...\n")  
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    create_app().run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,6 @@
+"""Benchmarks for the gallery server.
+
+Runs the Flask app in-process against a local ImgBB stand-in so nothing
+touches the real API. Start with ``python -m bench --help`` from the
+G1N8CSF directory.
+"""
@@ -0,0 +1,125 @@
+"""Synthetic photo libraries and sample images for benchmarks"""
+import json
+import random
+import string
+from datetime import datetime, timedelta
+from io import BytesIO
+
+from PIL import Image
+
+LIBRARY_SIZES = {'1k': 1000, '10k': 10000, '100k': 100000}
+
+CAMERAS = [
+    ('Canon', 'Canon EOS R5', 'RF24-105mm F4 L IS USM'),
+    ('NIKON CORPORATION', 'NIKON Z 6_2', 'NIKKOR Z 24-70mm f/4 S'),
+    ('SONY', 'ILCE-7M4', 'FE 28-70mm F3.5-5.6 OSS'),
+    ('FUJIFILM', 'X-T4', 'XF16-80mmF4 R OIS WR'),
+    ('Apple', 'iPhone 14 Pro', 'iPhone 14 Pro back triple camera 6.86mm f/1.78'),
+    ('samsung', 'SM-S918B', None),
+    (None, None, None),
+]
+DIMENSIONS = [(474, 269), (1280, 720), (1916, 1076), (4000, 3000), (6000, 4000), (3024, 4032)]
+FORMATS = {'png': 'PNG', 'jpg': 'JPEG', 'jpeg': 'JPEG', 'gif': 'GIF', 'webp': 'WEBP', 'bmp': 'BMP'}
+ISO_VALUES = [100, 200, 400, 800, 1600, 3200, 6400]
+APERTURES = [1.8, 2.8, 4.0, 5.6, 8.0]
+SHUTTERS = ['1/4000', '1/1000', '1/250', '1/60', '1/15']
+
+
+def synthetic_records(count, seed=0, base_url=None):
+    """Metadata records shaped like the ones app.upload_files stores.
+
+    With ``base_url`` the image and delete URLs point at a FakeImgBB instead
+    of ImgBB, so background deletes and sweeps never leave the machine.
+    """
+    rng = random.Random(seed)
+    # Separate stream so adding hashes left every other field as it was
+    hash_rng = random.Random(seed + 1)
+    burst_hash = 0
+    start = datetime(2015, 1, 1)
+    span = int((datetime(2025, 12, 31) - start).total_seconds())
+    image_base = f'{base_url}/i' if base_url else 'https://i.ibb.co'
+    delete_base = base_url or 'https://ibb.co'
+    records = []
+    for i in range(count):
+        ext = rng.choice(list(FORMATS))
+        taken = start + timedelta(seconds=rng.randrange(span))
+        width, height = rng.choice(DIMENSIONS)
+        size = rng.randint(50 * 1024, 15 * 1024 * 1024)
+        photo_id = ''.join(rng.choice(string.ascii_letters + string.digits) for _ in range(8))
+        image_url = f'{image_base}/{photo_id}/{ext}.{ext}'
+        record = {
+            'filename': f'IMG_{taken:%Y%m%d_%H%M%S}_{i}.{ext}',
+            'size': size,
+            'size_mb': round(size / (1024 * 1024), 2),
+            'size_kb': round(size / 1024, 2),
+            'timestamp': int(taken.timestamp()),
+            'created': taken.strftime('%Y-%m-%d %H:%M:%S'),
+            'year': taken.year,
+            'month': taken.month,
+            'day': taken.day,
+            'date_str': taken.strftime('%B %d, %Y'),
+            'time_str': taken.strftime('%I:%M %p'),
+            'width': width,
+            'height': height,
+            'format': FORMATS[ext],
+            'mode': 'RGBA' if ext == 'png' else 'RGB',
+            'url': image_url,
+            'display_url': image_url,
+            'delete_url': f'{delete_base}/{photo_id}/{rng.getrandbits(128):032x}',
+            'thumb_url': image_url,
+            'id': photo_id,
+        }
+        make, model, lens = rng.choice(CAMERAS)
+        if make:
+            record['camera_make'] = make
+            record['camera_model'] = model
+            record['iso'] = str(rng.choice(ISO_VALUES))
+            record['aperture'] = f'f/{rng.choice(APERTURES)}'
+            record['shutter_speed'] = rng.choice(SHUTTERS)
+        if lens:
+            record['lens'] = lens
+        # Roughly one photo in four starts a new burst; the rest are near-duplicates of it
+        if i == 0 or hash_rng.random() < 0.25:
+            burst_hash = hash_rng.getrandbits(64)
+        record['phash'] = f'{burst_hash ^ sum(1 << hash_rng.randrange(64) for _ in range(hash_rng.randrange(5))):016x}'
+        records.append(record)
+    return records
+
+
+def write_library(path, count, seed=0, base_url=None):
+    records = synthetic_records(count, seed, base_url)
+    with open(path, 'w') as f:
+        json.dump(records, f, indent=2)
+    return records
+
+
+def generate_image(ext, width=1280, height=720):
+    """Encode a noisy test image in the format for ``ext``, with EXIF on JPEG and WebP"""
+    img = Image.effect_noise((width, height), 64).convert('RGB')
+    fmt = FORMATS[ext]
+    if fmt == 'PNG':
+        img = img.convert('RGBA')
+    elif fmt == 'GIF':
+        img = img.convert('P')
+
+    kwargs = {}
+    if fmt in ('JPEG', 'WEBP'):
+        exif = Image.Exif()
+        exif[0x010F] = 'Canon'
+        exif[0x0110] = 'Canon EOS R5'
+        exif[0x0132] = '2024:06:01 12:30:00'
+        exif_ifd = exif.get_ifd(0x8769)
+        exif_ifd[0x8827] = 400
+        exif_ifd[0x829D] = 4.0
+        exif_ifd[0xA434] = 'RF24-105mm F4 L IS USM'
+        kwargs['exif'] = exif
+    if fmt == 'JPEG':
+        kwargs['quality'] = 90
+
+    buf = BytesIO()
+    img.save(buf, fmt, **kwargs)
+    return buf.getvalue()
+
+
+def generate_images(width=1280, height=720, extensions=FORMATS):
+    return {ext: generate_image(ext, width, height) for ext in extensions}
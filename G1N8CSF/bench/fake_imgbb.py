@@ -0,0 +1,288 @@
+"""Local stand-in for the ImgBB upload API with configurable latency and errors"""
+import argparse
+import json
+import random
+import secrets
+import string
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ID_ALPHABET = string.ascii_letters + string.digits
+
+
+def parse_multipart(body, content_type):
+    """Split a multipart/form-data body into ``{name: (filename, bytes)}``"""
+    boundary = None
+    for param in content_type.split(';')[1:]:
+        key, _, value = param.strip().partition('=')
+        if key == 'boundary':
+            boundary = value.strip('"')
+    if not boundary:
+        return {}
+
+    fields = {}
+    delimiter = b'--' + boundary.encode('latin-1')
+    for part in body.split(delimiter)[1:]:
+        if part.startswith(b'--'):
+            break
+        head, _, data = part.partition(b'\r\n\r\n')
+        name = filename = None
+        for line in head.decode('utf-8', 'replace').split('\r\n'):
+            if not line.lower().startswith('content-disposition'):
+                continue
+            for param in line.split(';')[1:]:
+                key, _, value = param.strip().partition('=')
+                if key == 'name':
+                    name = value.strip('"')
+                elif key == 'filename':
+                    filename = value.strip('"')
+        if name:
+            fields[name] = (filename, data[:-2] if data.endswith(b'\r\n') else data)
+    return fields
+
+
+class FakeImgBB:
+    """Threaded HTTP server speaking enough of the ImgBB API for the gallery.
+
+    ``latency`` (+ up to ``jitter``) seconds is slept before every upload
+    and delete response, and ``error_rate`` of them fail with a 429 or 500
+    shaped like ImgBB's own errors. Stored images are served back from
+    ``/i/``. Deleting works like the real site: GET the delete_url for a
+    page holding an ``auth_token`` and a session cookie, then POST both
+    to ``/json`` with the id and delete hash. Anything else is refused.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.images = {}
+        self.delete_hashes = {}
+        self.sessions = {}
+        self.stats = {'uploads': 0, 'errors': 0, 'downloads': 0, 'deletes': 0, 'bytes_received': 0}
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def upload_url(self):
+        return f'{self.base_url}/1/upload'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def _delay(self):
+        with self.lock:
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+            fail = self.random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        return fail
+
+    def _store(self, filename, data):
+        photo_id = ''.join(secrets.choice(ID_ALPHABET) for _ in range(8))
+        delete_hash = secrets.token_hex(16)
+        name = (filename or 'image').replace('.', '-')
+        with self.lock:
+            self.images[photo_id] = data
+            self.delete_hashes[photo_id] = delete_hash
+            self.stats['uploads'] += 1
+            self.stats['bytes_received'] += len(data)
+        image_url = f'{self.base_url}/i/{photo_id}/{name}'
+        return {
+            'id': photo_id,
+            'url': image_url,
+            'display_url': image_url,
+            'delete_url': f'{self.base_url}/{photo_id}/{delete_hash}',
+            'thumb': {'url': image_url},
+            'size': len(data),
+        }
+
+    def _open_session(self):
+        session_id, token = secrets.token_hex(16), secrets.token_hex(20)
+        with self.lock:
+            self.sessions[session_id] = token
+        return session_id, token
+
+    def _delete(self, photo_id, delete_hash):
+        with self.lock:
+            if photo_id not in self.images:
+                return 404
+            if self.delete_hashes.get(photo_id) != delete_hash:
+                return 403
+            del self.images[photo_id]
+            del self.delete_hashes[photo_id]
+            self.stats['deletes'] += 1
+            return 200
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, payload):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read_body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return self.rfile.read(length) if length else b''
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                body = self._read_body()
+                if path == '/json':
+                    self._handle_delete(body)
+                    return
+                if path != '/1/upload':
+                    self._send_json(404, {'success': False, 'error': {'message': 'Not found'}})
+                    return
+
+                if fake._delay():
+                    with fake.lock:
+                        fake.stats['errors'] += 1
+                    status = fake.random.choice((429, 500))
+                    self._send_json(status, {
+                        'success': False,
+                        'status_code': status,
+                        'error': {'message': 'Rate limit reached' if status == 429 else 'Internal error'}
+                    })
+                    return
+
+                fields = parse_multipart(body, self.headers.get('Content-Type', ''))
+                if 'image' not in fields:
+                    self._send_json(400, {'success': False, 'error': {'message': 'Empty upload source'}})
+                    return
+                filename, data = fields['image']
+                name = fields.get('name', (None, b''))[1].decode('utf-8') or filename
+                self._send_json(200, {'success': True, 'status': 200, 'data': fake._store(name, data)})
+
+            def _session_token(self):
+                for cookie in (self.headers.get('Cookie') or '').split(';'):
+                    name, _, value = cookie.strip().partition('=')
+                    if name == 'PHPSESSID':
+                        with fake.lock:
+                            return fake.sessions.get(value)
+                return None
+
+            def _handle_delete(self, body):
+                form = parse_qs(body.decode('utf-8'))
+                if form.get('action') != ['delete']:
+                    self._send_json(400, {'status_code': 400, 'error': {'message': 'Invalid action'}})
+                    return
+                token = self._session_token()
+                if token is None or form.get('auth_token') != [token]:
+                    self._send_json(400, {'status_code': 400, 'error': {'message': 'Request denied'}})
+                    return
+                if fake._delay():
+                    with fake.lock:
+                        fake.stats['errors'] += 1
+                    self._send_json(500, {'status_code': 500, 'error': {'message': 'Internal error'}})
+                    return
+                status = fake._delete(form.get('deleting[id]', [''])[0], form.get('deleting[hash]', [''])[0])
+                if status == 200:
+                    self._send_json(200, {'status_code': 200, 'success': {'message': 'Image deleted'}})
+                else:
+                    self._send_json(status, {'status_code': status, 'error': {'message': 'Delete refused'}})
+
+            def _serve_image(self, head_only):
+                parts = urlparse(self.path).path.strip('/').split('/')
+                data = fake.images.get(parts[1]) if len(parts) >= 2 and parts[0] == 'i' else None
+                if data is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                with fake.lock:
+                    fake.stats['downloads'] += 1
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                if not head_only:
+                    self.wfile.write(data)
+
+            def _serve_delete_page(self, photo_id, delete_hash):
+                with fake.lock:
+                    known = fake.delete_hashes.get(photo_id) == delete_hash
+                if not known:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                session_id, token = fake._open_session()
+                body = (
+                    '<html><head><script>PF.obj.config.auth_token="%s";</script></head>'
+                    '<body><form><input type="hidden" name="auth_token" value="%s"></form></body></html>'
+                    % (token, token)
+                ).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=UTF-8')
+                self.send_header('Set-Cookie', f'PHPSESSID={session_id}; path=/; HttpOnly')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                parts = urlparse(self.path).path.strip('/').split('/')
+                if len(parts) == 2 and parts[0] != 'i':
+                    self._serve_delete_page(*parts)
+                    return
+                self._serve_image(head_only=False)
+
+            def do_HEAD(self):
+                self._serve_image(head_only=True)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local ImgBB stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every upload')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random seconds per upload')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of uploads that fail')
+    args = parser.parse_args()
+
+    fake = FakeImgBB(args.host, args.port, args.latency, args.jitter, args.error_rate)
+    print(f"Fake ImgBB listening on {fake.base_url}")
+    print(f"Set IMGBB_UPLOAD_URL={fake.upload_url} to point the gallery at it")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == '__main__':
+    main()
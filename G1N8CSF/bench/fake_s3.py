@@ -0,0 +1,169 @@
+"""Local S3-compatible stand-in (path-style, SigV4-checked) in the spirit of MinIO"""
+import argparse
+import hashlib
+import hmac
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+
+class FakeS3:
+    """Threaded HTTP server holding objects in memory under ``/<bucket>/<key>``.
+
+    Requests must carry a valid AWS Signature Version 4 for ``access_key`` /
+    ``secret_key``; anything else gets a 403 like a real object store would.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, access_key='bench', secret_key='bench-secret', region='us-east-1'):
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.lock = threading.Lock()
+        self.objects = {}
+        self.stats = {'puts': 0, 'gets': 0, 'deletes': 0, 'rejected': 0}
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def verify(self, method, path, headers):
+        """Recompute the SigV4 signature from the request and compare"""
+        authorization = headers.get('Authorization', '')
+        if not authorization.startswith('AWS4-HMAC-SHA256 '):
+            return False
+        fields = dict(part.strip().split('=', 1) for part in authorization[len('AWS4-HMAC-SHA256 '):].split(','))
+        access_key, datestamp, region, service, _ = fields['Credential'].split('/')
+        if access_key != self.access_key:
+            return False
+        signed = fields['SignedHeaders'].split(';')
+        canonical_request = '\n'.join([
+            method,
+            path,
+            '',
+            ''.join(f'{name}:{(headers.get(name) or "").strip()}\n' for name in signed),
+            fields['SignedHeaders'],
+            headers.get('x-amz-content-sha256', '')
+        ])
+        scope = f'{datestamp}/{region}/{service}/aws4_request'
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256', headers.get('x-amz-date', ''), scope,
+            hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+        ])
+        key = ('AWS4' + self.secret_key).encode('utf-8')
+        for part in (datestamp, region, service, 'aws4_request'):
+            key = hmac.new(key, part.encode('utf-8'), hashlib.sha256).digest()
+        expected = hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected, fields['Signature'])
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body=b'', content_type='application/xml', head_only=False):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if body and not head_only:
+                    self.wfile.write(body)
+
+            def _authorized(self):
+                path = urlparse(self.path).path
+                if fake.verify(self.command, path, self.headers):
+                    return path
+                with fake.lock:
+                    fake.stats['rejected'] += 1
+                self._reply(403, b'<Error><Code>SignatureDoesNotMatch</Code></Error>')
+                return None
+
+            def do_PUT(self):
+                path = self._authorized()
+                if path is None:
+                    return
+                length = int(self.headers.get('Content-Length') or 0)
+                data = self.rfile.read(length) if length else b''
+                with fake.lock:
+                    fake.objects[path] = (data, self.headers.get('Content-Type', 'application/octet-stream'))
+                    fake.stats['puts'] += 1
+                self.send_response(200)
+                self.send_header('ETag', f'"{hashlib.md5(data).hexdigest()}"')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def _get(self, head_only):
+                path = self._authorized()
+                if path is None:
+                    return
+                with fake.lock:
+                    entry = fake.objects.get(path)
+                    if entry and not head_only:
+                        fake.stats['gets'] += 1
+                if entry is None:
+                    self._reply(404, b'<Error><Code>NoSuchKey</Code></Error>', head_only=head_only)
+                    return
+                data, content_type = entry
+                self._reply(200, data, content_type, head_only=head_only)
+
+            def do_GET(self):
+                self._get(head_only=False)
+
+            def do_HEAD(self):
+                self._get(head_only=True)
+
+            def do_DELETE(self):
+                path = self._authorized()
+                if path is None:
+                    return
+                with fake.lock:
+                    fake.objects.pop(path, None)
+                    fake.stats['deletes'] += 1
+                self._reply(204)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local S3-compatible stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--access-key', default='bench')
+    parser.add_argument('--secret-key', default='bench-secret')
+    args = parser.parse_args()
+
+    fake = FakeS3(args.host, args.port, args.access_key, args.secret_key)
+    print(f"Fake S3 listening on {fake.endpoint}")
+    print(f"Set STORAGE_BACKEND=s3 S3_ENDPOINT={fake.endpoint} S3_BUCKET=gallery "
+          f"S3_ACCESS_KEY={args.access_key} S3_SECRET_KEY={args.secret_key}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+"""Benchmark scenarios for app.py, run in-process against FakeImgBB"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from io import BytesIO
+
+from bench.datasets import LIBRARY_SIZES, generate_images, write_library
+from bench.fake_imgbb import FakeImgBB
+from bench.fake_s3 import FakeS3
+
+STORAGE_BACKENDS = ('imgbb', 'local', 's3')
+SCENARIOS = ('startup', 'photos', 'search', 'stats', 'similar', 'metadata', 'upload', 'batch_upload', 'delete', 'batch_delete', 'reconcile', 'album')
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter under -X importtime; prints its own wall-clock timings as JSON
+STARTUP_PROBE = '''
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.app.test_client().get('/photos')
+print(json.dumps({'import': imported - start, 'first_request': time.perf_counter() - start}))
+'''
+
+
+def summarize(scenario, library, variant, timings, errors=0):
+    timings = sorted(timings)
+    total = sum(timings)
+    return {
+        'scenario': scenario,
+        'library': library,
+        'variant': variant,
+        'iterations': len(timings),
+        'errors': errors,
+        'mean_ms': round(total / len(timings) * 1000, 3) if timings else None,
+        'p50_ms': round(statistics.median(timings) * 1000, 3) if timings else None,
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000, 3) if timings else None,
+        'min_ms': round(timings[0] * 1000, 3) if timings else None,
+        'max_ms': round(timings[-1] * 1000, 3) if timings else None,
+        'ops_per_sec': round(len(timings) / total, 2) if total else None,
+    }
+
+
+def timed(fn, iterations):
+    timings = []
+    errors = 0
+    for _ in range(iterations):
+        start = time.perf_counter()
+        ok = fn()
+        timings.append(time.perf_counter() - start)
+        if ok is False:
+            errors += 1
+    return timings, errors
+
+
+class Bench:
+    def __init__(self, gallery, fake, fake_s3, workdir, iterations, batch_size):
+        self.gallery = gallery
+        self.client = gallery.app.test_client()
+        self.fake = fake
+        self.fake_s3 = fake_s3
+        self.workdir = workdir
+        self.iterations = iterations
+        self.batch_size = batch_size
+        self.images = generate_images()
+        self.rng = random.Random(0)
+
+    def use_library(self, label, count):
+        path = os.path.join(self.workdir, f'library_{label}.json')
+        records = write_library(path, count, base_url=self.fake.base_url)
+        if os.path.exists(f'{path}.journal'):
+            os.remove(f'{path}.journal')
+        self.gallery.store.path = path
+        self.gallery.store.invalidate()
+        self.gallery.store.refresh()
+        return records
+
+    def startup(self, label):
+        """Cold start in fresh interpreters: time to import app, and to answer the first /photos on this library"""
+        env = dict(
+            os.environ,
+            METADATA_FILE=self.gallery.store.path,
+            TOMBSTONE_FILE=os.path.join(self.workdir, 'startup_tombstones.json'),
+            DOWNLOAD_CACHE_DIR=os.path.join(self.workdir, 'cache'),
+            RECONCILE_SWEEP_INTERVAL='0',
+        )
+        timings = {'import': [], 'first_request': []}
+        modules = {}
+        errors = 0
+        for _ in range(max(1, min(self.iterations, 10))):
+            run = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', STARTUP_PROBE],
+                cwd=APP_DIR, env=env, capture_output=True, text=True
+            )
+            try:
+                probe = json.loads(run.stdout.strip().splitlines()[-1])
+            except (IndexError, ValueError):
+                errors += 1
+                continue
+            for variant in timings:
+                timings[variant].append(probe[variant])
+            # Lines read "import time: self | cumulative | name", children before their parent and
+            # indented two more spaces, so app's direct imports are the depth-1 lines just before it
+            children = []
+            for line in run.stderr.splitlines():
+                parts = line.split('|')
+                if len(parts) != 3:
+                    continue
+                depth = (len(parts[2]) - len(parts[2].lstrip()) - 1) // 2
+                if depth == 1:
+                    children.append((parts[2].strip(), int(parts[1])))
+                elif depth == 0:
+                    if parts[2].strip() == 'app':
+                        for name, us in children:
+                            modules.setdefault(name, []).append(us)
+                    children = []
+
+        results = [summarize('startup', label, variant, times, errors) for variant, times in timings.items()]
+        slowest = sorted(((statistics.median(us), name) for name, us in modules.items()), reverse=True)[:10]
+        results[0]['slowest_imports_ms'] = {name: round(us / 1000, 2) for us, name in slowest}
+        return results
+
+    def photos(self, label):
+        def run():
+            return self.client.get('/photos').status_code == 200
+        return [summarize('photos', label, 'list', *timed(run, self.iterations))]
+
+    def search(self, label):
+        queries = {
+            'text': '/search?q=canon',
+            'field': '/search?camera_model=ilce',
+            'range': '/search?iso_min=400&iso_max=1600&width_min=1920',
+            'combined': '/search?q=img&camera_make=sony&size_max=5000000',
+        }
+        self.client.get('/search')
+        results = []
+        for variant, url in queries.items():
+            def run(url=url):
+                return self.client.get(url).status_code == 200
+            results.append(summarize('search', label, variant, *timed(run, self.iterations)))
+        return results
+
+    def stats(self, label):
+        queries = {
+            'all': '/stats',
+            'filtered': '/stats?year=2022&camera_make=canon',
+        }
+        if self.client.get('/stats').status_code != 200:
+            print("  skipped: /stats needs NumPy")
+            return []
+        results = []
+        for variant, url in queries.items():
+            def run(url=url):
+                return self.client.get(url).status_code == 200
+            results.append(summarize('stats', label, variant, *timed(run, self.iterations)))
+        return results
+
+    def similar(self, label, records):
+        ids = [record['id'] for record in records]
+        self.rng.shuffle(ids)
+        probes = iter(ids * (self.iterations // len(ids) + 1))
+        self.client.get(f'/photos/{ids[0]}/similar')
+        results = []
+        for distance in (4, 10, 12):
+            def run(distance=distance):
+                return self.client.get(f'/photos/{next(probes)}/similar?distance={distance}').status_code == 200
+            results.append(summarize('similar', label, f'distance_{distance}', *timed(run, self.iterations)))
+        return results
+
+    def metadata(self, label):
+        results = []
+        for ext, data in self.images.items():
+            def run(ext=ext, data=data):
+                return bool(self.gallery.extract_image_metadata(BytesIO(data)))
+            results.append(summarize('metadata', label, ext, *timed(run, self.iterations)))
+        return results
+
+    def _post(self, files):
+        data = {'files': [(BytesIO(content), name) for name, content in files]}
+        response = self.client.post('/upload', data=data, content_type='multipart/form-data')
+        return response.status_code == 200
+
+    def upload(self, label):
+        results = []
+        for ext, content in self.images.items():
+            def run(ext=ext, content=content):
+                return self._post([(f'bench.{ext}', content)])
+            results.append(summarize('upload', label, ext, *timed(run, self.iterations)))
+        return results
+
+    def batch_upload(self, label):
+        exts = list(self.images)
+        def run():
+            files = [(f'batch_{i}.{exts[i % len(exts)]}', self.images[exts[i % len(exts)]]) for i in range(self.batch_size)]
+            return self._post(files)
+        return [summarize('batch_upload', label, f'{self.batch_size}_files', *timed(run, max(1, self.iterations // 4)))]
+
+    def delete(self, label, records):
+        ids = [record['id'] for record in records]
+        self.rng.shuffle(ids)
+        victims = iter(ids)
+        def run():
+            return self.client.delete(f'/delete/{next(victims)}').status_code == 200
+        return [summarize('delete', label, 'single', *timed(run, min(self.iterations, len(ids))))]
+
+    def batch_delete(self, label, records):
+        ids = [record['id'] for record in records]
+        self.rng.shuffle(ids)
+        size = min(self.batch_size * 10, len(ids) // (self.iterations + 1) or 1)
+        batches = iter([ids[i:i + size] for i in range(0, len(ids), size)])
+        def run():
+            response = self.client.post('/delete/batch', json={'ids': next(batches)})
+            return response.status_code == 200
+        return [summarize('batch_delete', label, f'{size}_ids', *timed(run, self.iterations))]
+
+    def album(self, label):
+        """/photos and /search in a 1k album next to the default gallery's library, to show they don't grow with it"""
+        partitions = self.gallery.partitions
+        if not partitions.exists('bench'):
+            os.makedirs(partitions.albums_dir, exist_ok=True)
+            write_library(partitions.path_for('bench'), 1000, seed=1, base_url=self.fake.base_url)
+        queries = {'list': '/albums/bench/photos', 'search': '/albums/bench/search?q=canon'}
+        results = []
+        for variant, url in queries.items():
+            self.client.get(url)
+            def run(url=url):
+                return self.client.get(url).status_code == 200
+            results.append(summarize('album', label, variant, *timed(run, self.iterations)))
+        return results
+
+    def reconcile(self, label):
+        """Upload to the configured storage, delete through the API, then time draining the tombstones"""
+        exts = list(self.images)
+        files = [(f'reconcile_{i}.{exts[i % len(exts)]}', self.images[exts[i % len(exts)]]) for i in range(self.batch_size)]
+        self._post(files)
+        uploaded = [r for r in self.gallery.load_metadata() if r['filename'].startswith('reconcile_')]
+        for record in uploaded:
+            self.client.delete(f"/delete/{record['id']}")
+
+        start = time.perf_counter()
+        self.gallery.reconciler.drain()
+        elapsed = time.perf_counter() - start
+        leftover = sum(1 for record in uploaded if self.gallery.stored_exists(record))
+        result = summarize('reconcile', label, f'{len(uploaded)}_deletes', [elapsed], errors=leftover)
+        result['remote_deletes_per_sec'] = round(len(uploaded) / elapsed, 2) if elapsed else None
+        return [result]
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(r['scenario'], r['library'], r['variant']): r for r in baseline.get('results', [])}
+    if baseline.get('config', {}).get('storage') != current['config'].get('storage'):
+        print(f"Note: baseline used {baseline.get('config', {}).get('storage', 'imgbb')} storage, "
+              f"this run used {current['config'].get('storage')}")
+    print(f"\n{'scenario':<14}{'library':<8}{'variant':<14}{'p50 before':>12}{'p50 now':>12}{'change':>10}")
+    for result in current['results']:
+        key = (result['scenario'], result['library'], result['variant'])
+        before = previous.get(key, {}).get('p50_ms')
+        now = result['p50_ms']
+        change = f'{(now - before) / before * 100:+.1f}%' if before and now is not None else 'new'
+        print(f"{key[0]:<14}{key[1]:<8}{key[2]:<14}{before if before is not None else '-':>12}{now:>12}{change:>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the gallery server against local storage stand-ins')
+    parser.add_argument('--sizes', nargs='+', default=['1k', '10k'], choices=list(LIBRARY_SIZES))
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the fake ImgBB adds per upload')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--storage', default='imgbb', choices=STORAGE_BACKENDS,
+                        help='storage provider uploads go to; s3 runs against bench.fake_s3')
+    parser.add_argument('--reconcile-rate', type=float, default=0.0, help='remote deletes per second, 0 for unpaced')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', metavar='BASELINE_JSON', help='print p50 changes against an earlier run')
+    args = parser.parse_args(argv)
+
+    import app as gallery
+
+    report = {
+        'meta': {
+            'started': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+        },
+        'config': vars(args),
+        'results': [],
+    }
+
+    with tempfile.TemporaryDirectory() as workdir, \
+            FakeImgBB(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, seed=0) as fake, \
+            FakeS3() as fake_s3:
+        gallery.STORAGE_BACKEND = args.storage
+        gallery.IMGBB_API_KEY = 'bench'
+        gallery.IMGBB_UPLOAD_URL = fake.upload_url
+        gallery.LOCAL_STORAGE_DIR = os.path.join(workdir, 'uploads')
+        gallery.S3_ENDPOINT = fake_s3.endpoint
+        gallery.S3_BUCKET = 'gallery'
+        gallery.S3_ACCESS_KEY = fake_s3.access_key
+        gallery.S3_SECRET_KEY = fake_s3.secret_key
+        gallery.storage_providers.clear()
+        gallery.blob_cache.root = os.path.join(workdir, 'cache')
+        gallery.blob_cache.entries = None
+        gallery.reconciler.path = os.path.join(workdir, 'tombstones.json')
+        gallery.partitions.albums_dir = os.path.join(workdir, 'albums')
+        gallery.reconciler.rate = args.reconcile_rate
+        # Back-to-back uploads from one client would otherwise measure the rate limiter
+        gallery.upload_limiter.enabled = False
+        # The bench loads its own libraries; a warm-up thread would only race with that
+        gallery.WARM_UP = False
+        bench = Bench(gallery, fake, fake_s3, workdir, args.iterations, args.batch_size)
+
+        for label in args.sizes:
+            for scenario in args.scenarios:
+                records = bench.use_library(label, LIBRARY_SIZES[label])
+                print(f"Running {scenario} on {label} library...")
+                if scenario in ('delete', 'batch_delete', 'similar'):
+                    results = getattr(bench, scenario)(label, records)
+                else:
+                    results = getattr(bench, scenario)(label)
+                for result in results:
+                    print(f"  {result['variant']:<14} p50 {result['p50_ms']} ms  p95 {result['p95_ms']} ms  errors {result['errors']}")
+                report['results'].extend(results)
+        report['fake_imgbb'] = dict(fake.stats)
+        report['fake_s3'] = dict(fake_s3.stats)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.output}")
+
+    if args.compare:
+        compare(report, args.compare)
+    return report
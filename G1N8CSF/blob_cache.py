@@ -0,0 +1,223 @@
+import os
+import re
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+SAFE_KEY_RE = re.compile(r'^[A-Za-z0-9_-]{1,128}$')
+
+
+class BlobCache:
+    """Bounded on-disk LRU cache of original image bytes.
+
+    Each entry lives at ``<root>/<ab>/<key>``, where the key is the photo's
+    content hash (or its id when there is no hash), so identical uploads
+    share one entry. Blobs are written to a temp file beside the entry and
+    renamed into place, so readers never see a partial blob. The in-memory
+    order is mirrored to file mtimes, which keeps the LRU order across
+    restarts. When the total passes ``max_bytes`` the least recently used
+    entries are deleted. A file that is already open for sending stays
+    readable until it is closed.
+
+    ``fetch`` coalesces concurrent misses: the first caller fills the
+    entry from upstream and the others wait for that fill, so one miss
+    costs one upstream request. ``stats`` reports hit ratio and byte
+    counters.
+    """
+
+    def __init__(self, root, max_bytes, fetch_timeout=60):
+        # Absolute, since send_file resolves a relative path against the app's root_path, not the cwd
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.fetch_timeout = fetch_timeout
+        self.lock = threading.Lock()
+        self.entries = None
+        self.total = 0
+        self.inflight = {}
+        self.counters = dict.fromkeys(
+            ('hits', 'misses', 'coalesced', 'hit_bytes', 'fetched_bytes', 'evictions', 'evicted_bytes'), 0
+        )
+
+    def _name(self, key):
+        key = str(key)
+        return key if SAFE_KEY_RE.match(key) else hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _path(self, name):
+        return os.path.join(self.root, name[:2], name)
+
+    def path_for(self, key):
+        return self._path(self._name(key))
+
+    def _ensure_loaded(self):
+        if self.entries is not None:
+            return
+        found = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if filename.startswith('.'):
+                    # Temp file left by a fill that died mid-write
+                    os.remove(path)
+                    continue
+                st = os.stat(path)
+                found.append((st.st_mtime, filename, st.st_size))
+        found.sort()
+        self.entries = OrderedDict((name, size) for _, name, size in found)
+        self.total = sum(self.entries.values())
+
+    def fits(self, size):
+        return size is not None and size <= self.max_bytes
+
+    def _hit(self, name):
+        """Mark an entry most recently used and count the hit; caller holds the lock"""
+        self.entries.move_to_end(name)
+        self.counters['hits'] += 1
+        self.counters['hit_bytes'] += self.entries[name]
+        return self._path(name)
+
+    def _touch(self, name, path):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self.lock:
+                self._forget(name)
+            return None
+        return path
+
+    def get(self, key):
+        """Path of a cached blob, marked most recently used, or None on a miss"""
+        name = self._name(key)
+        with self.lock:
+            self._ensure_loaded()
+            if name not in self.entries:
+                return None
+            path = self._hit(name)
+        return self._touch(name, path)
+
+    def fetch(self, key, opener):
+        """Path of the cached blob, filling it from ``opener()`` on a miss.
+
+        ``opener`` returns a readable stream or None. Callers that miss
+        while another fill of the same key is running wait for it instead
+        of opening their own stream. Returns None when upstream has nothing,
+        the blob is over budget, or the wait times out.
+        """
+        name = self._name(key)
+        with self.lock:
+            self._ensure_loaded()
+            if name in self.entries:
+                path = self._hit(name)
+                event = None
+            else:
+                path = None
+                event = self.inflight.get(name)
+                leader = event is None
+                if leader:
+                    event = self.inflight[name] = threading.Event()
+                    self.counters['misses'] += 1
+                else:
+                    self.counters['coalesced'] += 1
+        if path:
+            return self._touch(name, path)
+
+        if not leader:
+            event.wait(self.fetch_timeout)
+            return self.get(key)
+
+        try:
+            stream = opener()
+            if stream is None:
+                return None
+            return self.fill(key, stream)
+        finally:
+            with self.lock:
+                self.inflight.pop(name, None)
+            event.set()
+
+    def discard(self, key):
+        name = self._name(key)
+        with self.lock:
+            self._ensure_loaded()
+            self._forget(name)
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+    def _forget(self, name):
+        size = self.entries.pop(name, None)
+        if size is not None:
+            self.total -= size
+
+    def _open_temp(self, key):
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.fill-')
+        return os.fdopen(fd, 'wb'), tmp_path
+
+    def _discard_temp(self, f, tmp_path):
+        f.close()
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+
+    def _commit(self, key, f, tmp_path):
+        f.close()
+        name = self._name(key)
+        path = self._path(name)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        evicted = []
+        with self.lock:
+            self._ensure_loaded()
+            self._forget(name)
+            self.entries[name] = size
+            self.total += size
+            while self.total > self.max_bytes and len(self.entries) > 1:
+                oldest, oldest_size = self.entries.popitem(last=False)
+                self.total -= oldest_size
+                self.counters['evictions'] += 1
+                self.counters['evicted_bytes'] += oldest_size
+                evicted.append(oldest)
+        for oldest in evicted:
+            try:
+                os.remove(self._path(oldest))
+            except FileNotFoundError:
+                pass
+        return path
+
+    def fill(self, key, stream, chunk_size=64 * 1024):
+        """Copy ``stream`` into the cache and return the entry's path, or None if it's over budget"""
+        f, tmp_path = self._open_temp(key)
+        written = 0
+        try:
+            for chunk in iter(lambda: stream.read(chunk_size), b''):
+                written += len(chunk)
+                if written > self.max_bytes:
+                    self._discard_temp(f, tmp_path)
+                    return None
+                f.write(chunk)
+        except BaseException:
+            self._discard_temp(f, tmp_path)
+            raise
+        finally:
+            stream.close()
+            with self.lock:
+                self.counters['fetched_bytes'] += written
+        return self._commit(key, f, tmp_path)
+
+    def stats(self):
+        with self.lock:
+            self._ensure_loaded()
+            counters = dict(self.counters)
+            lookups = counters['hits'] + counters['misses']
+            return {
+                **counters,
+                'hit_ratio': round(counters['hits'] / lookups, 4) if lookups else None,
+                'entries': len(self.entries),
+                'bytes': self.total,
+                'max_bytes': self.max_bytes,
+                'fetching': len(self.inflight),
+            }
@@ -0,0 +1,388 @@
+import os
+import json
+import tempfile
+import threading
+from contextlib import contextmanager
+from importlib.util import find_spec
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from search_index import numeric_value
+
+NUMERIC_COLUMNS = ('timestamp', 'size', 'width', 'height', 'iso', 'year', 'month')
+STRING_COLUMNS = ('camera_make', 'camera_model', 'format')
+MISSING = -1
+
+# Imported by the first query rather than with the module, which keeps NumPy off the startup path
+np = None
+
+
+def numpy_available():
+    return find_spec('numpy') is not None
+
+
+def load_numpy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+
+class ColumnarStats:
+    """Columnar copy of the photo records for whole-library aggregates.
+
+    Numeric fields are stored as int64 arrays, with -1 marking a missing
+    value. ``camera_make``, ``camera_model`` and ``format`` are dictionary
+    encoded as int32 codes into a list of distinct strings. The arrays live
+    under ``<snapshot>.columns/`` as ``.npy`` files and are memory-mapped,
+    so aggregates read straight from the page cache.
+
+    Attach it to a ``MetadataStore`` like the search index. ``build`` only
+    marks the columns stale; they are written on the first query, or
+    mapped as they are if the manifest was written at the store's current
+    disk signature. Commits after that don't touch the files. A put masks
+    the old row and queues the new record, a delete masks its row, and
+    queries read the mapped rows that are still live plus the queued ones.
+    Once the queued and masked rows outgrow ``flush_min_rows`` (or an
+    eighth of the table), the next query writes a fresh generation.
+    Each generation is a new set of files, and the manifest is replaced
+    last, so a crash mid-write leaves the previous generation intact.
+
+    Writing a generation reads the records under the store's lock, but
+    encodes and writes them outside it, so commits don't wait on the disk.
+    Rows committed meanwhile are masked and queued once the new generation
+    is mapped. Processes sharing the files take turns through an ``flock``
+    on ``<snapshot>.columns.lock`` to pick generation numbers, write and
+    map.
+    """
+
+    def __init__(self, store, flush_min_rows=1024):
+        self.store = store
+        self.flush_min_rows = flush_min_rows
+        self.lock = threading.RLock()
+        self.write_lock = threading.Lock()
+        self.generation = 0
+        self.builds = 0
+        self.touched = None
+        self.build(())
+
+    @property
+    def directory(self):
+        return f'{self.store.path}.columns'
+
+    def build(self, records):
+        with self.lock:
+            self.builds += 1
+            self.stale = True
+            self.columns = {}
+            self.dictionaries = {name: [] for name in STRING_COLUMNS}
+            self.lookup = {name: {} for name in STRING_COLUMNS}
+            self.row_of = {}
+            self.live = None
+            self.dead = 0
+            self.pending = {}
+
+    def add(self, record):
+        with self.lock:
+            if self.touched is not None:
+                self.touched.add(record.get('id'))
+            if self.stale:
+                return
+            self._mask(record.get('id'))
+            self.pending[record.get('id')] = record
+
+    def remove(self, photo_id):
+        with self.lock:
+            if self.touched is not None:
+                self.touched.add(photo_id)
+            if self.stale:
+                return
+            self._mask(photo_id)
+            self.pending.pop(photo_id, None)
+
+    def _mask(self, photo_id):
+        row = self.row_of.pop(photo_id, None)
+        if row is not None:
+            self.live[row] = False
+            self.dead += 1
+
+    def _code(self, name, value, dictionaries, lookup):
+        if value is None or value == '':
+            return MISSING
+        value = str(value).strip()
+        code = lookup[name].get(value)
+        if code is None:
+            code = lookup[name][value] = len(dictionaries[name])
+            dictionaries[name].append(value)
+        return code
+
+    def _numbers(self, values):
+        # Most values are plain ints; anything else ('400', 2.8, None) is parsed once per distinct value
+        parsed = {}
+        def convert(value):
+            if value not in parsed:
+                number = numeric_value(value)
+                parsed[value] = MISSING if number is None else int(number)
+            return parsed[value]
+        return np.fromiter((v if type(v) is int else convert(v) for v in values), dtype=np.int64, count=len(values))
+
+    def _codes(self, name, values, dictionaries, lookup):
+        def code(value):
+            if value in lookup[name]:
+                return lookup[name][value]
+            return self._code(name, value, dictionaries, lookup)
+        return np.fromiter((code(v) for v in values), dtype=np.int32, count=len(values))
+
+    def _arrays(self, records, dictionaries=None, lookup=None):
+        """Encode records as columns, adding new strings to ``dictionaries`` (our own by default)"""
+        if dictionaries is None:
+            dictionaries, lookup = self.dictionaries, self.lookup
+        arrays = {}
+        for name in NUMERIC_COLUMNS:
+            arrays[name] = self._numbers([r.get(name) for r in records])
+        for name in STRING_COLUMNS:
+            arrays[name] = self._codes(name, [r.get(name) for r in records], dictionaries, lookup)
+        return arrays
+
+    def _file(self, name, generation):
+        return os.path.join(self.directory, f'{name}.{generation}.npy')
+
+    def _signature(self):
+        # Tuples become lists in JSON; compare in that form
+        return json.loads(json.dumps(self.store.signature))
+
+    @contextmanager
+    def _file_lock(self):
+        """Other processes can't write or map a generation while held"""
+        if fcntl is None:
+            yield
+            return
+        with open(f'{self.store.path}.columns.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.directory, 'manifest.json')) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Even a stale manifest says which generation number is taken
+        self.generation = max(self.generation, manifest.get('generation', 0))
+        return manifest
+
+    def _open_existing(self):
+        """Map the files on disk if the manifest matches the store's current state"""
+        with self._file_lock():
+            manifest = self._read_manifest()
+            if manifest is None or manifest.get('signature') != self._signature():
+                return False
+            try:
+                generation = manifest['generation']
+                with open(os.path.join(self.directory, f'ids.{generation}.json')) as f:
+                    ids = json.load(f)
+                columns = {
+                    name: self._map(self._file(name, generation), manifest['rows'])
+                    for name in NUMERIC_COLUMNS + STRING_COLUMNS
+                }
+            except (OSError, ValueError, KeyError):
+                return False
+        self.generation = generation
+        self.columns = columns
+        self.dictionaries = manifest['dictionaries']
+        self.lookup = {name: {v: i for i, v in enumerate(values)} for name, values in self.dictionaries.items()}
+        self.row_of = {photo_id: row for row, photo_id in enumerate(ids)}
+        self.live = np.ones(len(ids), dtype=bool)
+        return True
+
+    def _map(self, path, rows):
+        # An empty file can't be mmapped
+        return np.load(path, mmap_mode='r' if rows else None)
+
+    def _replace(self, path, write):
+        """Write through a temp file of our own, then move it into place"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.columns-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _write(self, records, signature, dictionaries):
+        """Write ``records`` as a new generation and map it; returns its ids and columns"""
+        lookup = {name: {v: i for i, v in enumerate(values)} for name, values in dictionaries.items()}
+        arrays = self._arrays(records, dictionaries, lookup)
+        ids = [r.get('id') for r in records]
+        os.makedirs(self.directory, exist_ok=True)
+        with self._file_lock():
+            self._read_manifest()
+            generation = self.generation + 1
+            for name, array in arrays.items():
+                self._replace(self._file(name, generation), lambda f: np.save(f, array))
+            self._replace(os.path.join(self.directory, f'ids.{generation}.json'),
+                          lambda f: f.write(json.dumps(ids).encode('utf-8')))
+            manifest = {
+                'generation': generation,
+                'rows': len(records),
+                'signature': signature,
+                'dictionaries': dictionaries,
+            }
+            self._replace(os.path.join(self.directory, 'manifest.json'),
+                          lambda f: f.write(json.dumps(manifest).encode('utf-8')))
+
+            # Every process maps under this lock, and a mapped file outlives its name
+            for filename in os.listdir(self.directory):
+                parts = filename.split('.')
+                if len(parts) == 3 and parts[1].isdigit() and int(parts[1]) != generation:
+                    os.remove(os.path.join(self.directory, filename))
+            self.generation = generation
+            columns = {name: self._map(self._file(name, generation), len(records)) for name in arrays}
+        return ids, columns
+
+    def _install(self, ids, columns, dictionaries):
+        """Switch to a freshly written generation, then mask and queue what was committed since"""
+        self.columns = columns
+        self.dictionaries = dictionaries
+        self.lookup = {name: {v: i for i, v in enumerate(values)} for name, values in dictionaries.items()}
+        self.row_of = {photo_id: row for row, photo_id in enumerate(ids)}
+        self.live = np.ones(len(ids), dtype=bool)
+        self.dead = 0
+        self.pending = {}
+        self.stale = False
+        for photo_id in self.touched:
+            self._mask(photo_id)
+            record = self.store.records.get(photo_id)
+            if record is not None:
+                self.pending[photo_id] = record
+
+    def _ensure_current(self):
+        """Map or write a generation when the columns are stale or too much is queued"""
+        with self.write_lock:
+            with self.store.lock, self.lock:
+                self.store.refresh()
+                if self.stale:
+                    if self._open_existing():
+                        self.stale = False
+                        return
+                elif len(self.pending) + self.dead <= max(self.flush_min_rows, len(self.live) // 8):
+                    return
+                records = list(self.store.records.values())
+                signature = self._signature()
+                # Codes already handed out stay valid; strings new to this generation are appended
+                dictionaries = {name: list(values) for name, values in self.dictionaries.items()}
+                builds = self.builds
+                self.touched = set()
+            try:
+                ids, columns = self._write(records, signature, dictionaries)
+                with self.store.lock, self.lock:
+                    # A reload since the snapshot means the store moved on without us; stay stale
+                    if self.builds == builds and self.store.records is not None:
+                        self._install(ids, columns, dictionaries)
+            finally:
+                with self.lock:
+                    self.touched = None
+
+    def _view(self):
+        """Arrays of the live rows: mapped rows not masked out, then queued records"""
+        if not self.pending and not self.dead:
+            return self.columns
+        extra = self._arrays(list(self.pending.values()))
+        return {
+            name: np.concatenate((column[self.live] if self.dead else column, extra[name]))
+            for name, column in self.columns.items()
+        }
+
+    def _filter_mask(self, view, dictionaries, filters):
+        mask = np.ones(len(view['timestamp']), dtype=bool)
+        for field, value in filters.items():
+            if field in STRING_COLUMNS:
+                wanted = str(value).strip().lower()
+                codes = [i for i, v in enumerate(dictionaries[field]) if v.lower() == wanted]
+                mask &= np.isin(view[field], codes)
+            else:
+                mask &= view[field] == int(value)
+        return mask
+
+    def _group(self, keys, sizes):
+        groups, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        totals = np.bincount(inverse, weights=sizes, minlength=len(groups))
+        return groups, counts, totals
+
+    def query(self, filters=None):
+        """Totals, size percentiles and breakdowns by year, month, camera and format"""
+        load_numpy()
+        self._ensure_current()
+        with self.store.lock, self.lock:
+            self.store.refresh()
+            if self.stale:
+                # Reloaded since _ensure_current; read the records as they are
+                view = self._arrays(list(self.store.records.values()))
+            else:
+                view = self._view()
+            # A copy, as later queries may append to the dictionaries while this one aggregates
+            dictionaries = {name: list(values) for name, values in self.dictionaries.items()}
+        if filters:
+            mask = self._filter_mask(view, dictionaries, filters)
+            view = {name: column[mask] for name, column in view.items()}
+        return self._aggregate(view, dictionaries)
+
+    def _aggregate(self, view, dictionaries):
+        def label(name, code):
+            return dictionaries[name][code] if code >= 0 else None
+
+        sizes = np.clip(view['size'], 0, None).astype(np.float64)
+        known_sizes = view['size'][view['size'] >= 0]
+        result = {
+            'photos': int(len(sizes)),
+            'bytes': int(sizes.sum()),
+            'size': {
+                'mean': round(float(known_sizes.mean()), 1) if len(known_sizes) else None,
+                'p50': int(np.percentile(known_sizes, 50)) if len(known_sizes) else None,
+                'p95': int(np.percentile(known_sizes, 95)) if len(known_sizes) else None,
+                'max': int(known_sizes.max()) if len(known_sizes) else None,
+            },
+        }
+
+        dated = (view['year'] > 0) & (view['month'] >= 1) & (view['month'] <= 12)
+        groups, counts, totals = self._group(view['year'][dated], sizes[dated])
+        result['by_year'] = [
+            {'year': int(year), 'photos': int(count), 'bytes': int(total)}
+            for year, count, total in zip(groups, counts, totals)
+        ]
+        groups, counts, totals = self._group(view['year'][dated] * 12 + view['month'][dated] - 1, sizes[dated])
+        result['by_month'] = [
+            {'year': int(key // 12), 'month': int(key % 12 + 1), 'photos': int(count), 'bytes': int(total)}
+            for key, count, total in zip(groups, counts, totals)
+        ]
+
+        models = len(dictionaries['camera_model']) + 1
+        keys = (view['camera_make'].astype(np.int64) + 1) * models + view['camera_model'] + 1
+        groups, counts, totals = self._group(keys, sizes)
+        cameras = [
+            {
+                'camera_make': label('camera_make', int(key // models) - 1),
+                'camera_model': label('camera_model', int(key % models) - 1),
+                'photos': int(count),
+                'bytes': int(total),
+            }
+            for key, count, total in zip(groups, counts, totals)
+        ]
+        result['by_camera'] = sorted(cameras, key=lambda c: c['photos'], reverse=True)
+
+        groups, counts, totals = self._group(view['format'], sizes)
+        formats = [
+            {'format': label('format', int(code)), 'photos': int(count), 'bytes': int(total)}
+            for code, count, total in zip(groups, counts, totals)
+        ]
+        result['by_format'] = sorted(formats, key=lambda f: f['photos'], reverse=True)
+        return result
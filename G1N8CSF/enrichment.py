@@ -0,0 +1,111 @@
+from collections import OrderedDict
+
+from worker import BackgroundWorker
+
+
+class Enricher(BackgroundWorker):
+    """Background stage that fills in dimensions and EXIF after upload.
+
+    Uploads save a minimal record marked ``enriched: False`` and hand its key
+    to ``enqueue``. The worker thread opens each original with
+    ``open_original(record)``, parses it with ``extract(stream, record)`` and
+    stores the result through ``apply(key, fields)``. Queue entries are
+    ``key(record)``, the photo id by default, and ``get_record(key)`` looks
+    them up again.
+
+    A file that can't be parsed is marked enriched with ``enrich_error``
+    set, so it isn't retried forever. A file that can't be fetched stays
+    pending; ``backfill`` picks it up later, along with older records
+    missing any of the ``required`` fields.
+    """
+
+    name = 'enricher'
+
+    def __init__(self, open_original, extract, load_records, get_record, apply,
+                 required=('width', 'height', 'format'), batch_size=20, rate=0,
+                 key=lambda record: record.get('id')):
+        super().__init__(rate)
+        self.open_original = open_original
+        self.extract = extract
+        self.load_records = load_records
+        self.get_record = get_record
+        self.apply = apply
+        self.required = required
+        self.batch_size = batch_size
+        self.key = key
+        self.queue = OrderedDict()
+        self.counters = {'enriched': 0, 'unreadable': 0, 'unavailable': 0}
+        self.last_error = None
+
+    def enqueue(self, keys):
+        with self.lock:
+            for key in keys:
+                self.queue[key] = None
+        self.wake()
+
+    def needs_enrichment(self, record, force=False, fields=None):
+        if force:
+            return True
+        if record.get('enriched') is False:
+            return True
+        if record.get('enrich_error'):
+            return False
+        return any(record.get(field) is None for field in fields or self.required)
+
+    def backfill(self, force=False, limit=None, fields=None, records=None):
+        """Queue records that are pending or missing any of ``fields`` (default ``required``; every
+        record with force), from ``records`` or else ``load_records()``; returns the count"""
+        if records is None:
+            records = self.load_records()
+        ids = [self.key(r) for r in records if r.get('id') and self.needs_enrichment(r, force, fields)]
+        if limit is not None:
+            ids = ids[:limit]
+        self.enqueue(ids)
+        return len(ids)
+
+    def enrich(self, record):
+        """Parse one record's original and apply the fields; returns 'enriched', 'unreadable' or 'unavailable'"""
+        self._pace()
+        try:
+            stream = self.open_original(record)
+        except Exception as e:
+            stream, self.last_error = None, f"{record.get('id')}: {e}"
+        if stream is None:
+            return 'unavailable'
+
+        try:
+            with stream:
+                fields = self.extract(stream, record)
+            fields['enriched'] = True
+            fields['enrich_error'] = None
+            outcome = 'enriched'
+        except Exception as e:
+            self.last_error = f"{record.get('id')}: {e}"
+            fields = {'enriched': True, 'enrich_error': str(e)}
+            outcome = 'unreadable'
+        self.apply(self.key(record), fields)
+        return outcome
+
+    def run_once(self):
+        """Enrich one batch of queued ids; returns how many were taken off the queue"""
+        with self.process_lock:
+            with self.lock:
+                batch = []
+                while self.queue and len(batch) < self.batch_size:
+                    batch.append(self.queue.popitem(last=False)[0])
+            if not batch:
+                return 0
+
+            for key in batch:
+                record = self.get_record(key)
+                if record is None:
+                    # Deleted while it waited
+                    continue
+                outcome = self.enrich(record)
+                with self.lock:
+                    self.counters[outcome] += 1
+            return len(batch)
+
+    def status(self):
+        with self.lock:
+            return {'queued': len(self.queue), **self.counters, 'last_error': self.last_error}
@@ -0,0 +1,167 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import nullcontext
+
+from flask import g, request
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_DISABLED = nullcontext()
+
+
+class Histogram:
+    """Cumulative Prometheus-style histogram for one label set"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Stage:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record_stage(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """Per-stage timers and counters, exported as Server-Timing and Prometheus text.
+
+    When disabled, ``stage()`` hands back a shared no-op context manager and
+    the request hooks return immediately, so instrumented code pays one
+    attribute check per call.
+    """
+
+    def __init__(self, enabled=False, prefix='gallery'):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.collectors = []
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def add_collector(self, collect):
+        """Register a callable returning ``(metric, kind, value)`` tuples, read on every render"""
+        self.collectors.append(collect)
+
+    def stage(self, name):
+        if not self.enabled:
+            return _DISABLED
+        return _Stage(self, name)
+
+    def record_stage(self, name, seconds):
+        self.observe('stage_duration_seconds', seconds, stage=name)
+        try:
+            timings = g.stage_timings
+        except (AttributeError, RuntimeError):
+            return
+        timings[name] = timings.get(name, 0.0) + seconds
+
+    def observe(self, metric, value, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def count(self, metric, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (metric, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def _before_request(self):
+        if not self.enabled:
+            return
+        g.request_start = time.perf_counter()
+        g.stage_timings = {}
+
+    def _after_request(self, response):
+        if not self.enabled or 'request_start' not in g:
+            return response
+        elapsed = time.perf_counter() - g.request_start
+        endpoint = request.endpoint or 'unknown'
+        self.observe('request_duration_seconds', elapsed, endpoint=endpoint)
+        self.count('requests_total', endpoint=endpoint, status=str(response.status_code))
+
+        entries = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in g.stage_timings.items()]
+        entries.append(f'total;dur={elapsed * 1000:.2f}')
+        response.headers['Server-Timing'] = ', '.join(entries)
+        return response
+
+    def render(self):
+        """Prometheus text exposition of every counter and histogram"""
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(
+                (key, list(h.counts), h.sum, h.count, h.buckets)
+                for key, h in self.histograms.items()
+            )
+
+        typed = set()
+        for (metric, labels), value in counters:
+            name = f'{self.prefix}_{metric}'
+            if name not in typed:
+                lines.append(f'# TYPE {name} counter')
+                typed.add(name)
+            lines.append(f'{name}{_labels(labels)} {value}')
+
+        for (metric, labels), counts, total, count, buckets in histograms:
+            name = f'{self.prefix}_{metric}'
+            if name not in typed:
+                lines.append(f'# TYPE {name} histogram')
+                typed.add(name)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{_labels(labels, le=repr(bound))} {cumulative}')
+            lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} {count}')
+            lines.append(f'{name}_sum{_labels(labels)} {total}')
+            lines.append(f'{name}_count{_labels(labels)} {count}')
+
+        for collect in self.collectors:
+            for metric, kind, value in collect():
+                if value is None:
+                    continue
+                name = f'{self.prefix}_{metric}'
+                if name not in typed:
+                    lines.append(f'# TYPE {name} {kind}')
+                    typed.add(name)
+                lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
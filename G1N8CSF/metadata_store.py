@@ -0,0 +1,263 @@
+import os
+import json
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class MetadataStore:
+    """Photo records kept in memory, persisted as a JSON snapshot plus a journal.
+
+    The snapshot is the same list-of-dicts file the gallery has always used.
+    Changes are appended to ``<snapshot>.journal`` as one JSON line per put
+    or delete, so a commit costs time proportional to the records it touches.
+    Once the journal holds more operations than the store has records, it
+    is folded back into the snapshot, which keeps the amortized cost of
+    every write constant.
+
+    If the files change on disk behind the store's back, the next read
+    catches up. When only the journal grew, that means replaying the lines
+    past the offset already read; a replaced snapshot, or a journal that
+    shrank, means reloading both. Indexes registered with ``attach``
+    (anything with ``build``, ``add`` and ``remove``) are kept in step with
+    every commit and replayed line, and rebuilt on a full reload.
+
+    Several processes may share the files. Loading, appending and
+    compacting all hold an ``flock`` on ``<snapshot>.lock``, and a
+    transaction reloads under that lock if another process wrote since, so
+    it never commits over records it hasn't seen. (Without ``fcntl``, on
+    Windows, only one process should write.)
+    """
+
+    def __init__(self, path, compact_min_ops=256):
+        self.path = path
+        self.compact_min_ops = compact_min_ops
+        self.lock = threading.RLock()
+        self.lock_file = None
+        self.lock_depth = 0
+        self.indexes = []
+        self.invalidate()
+
+    @property
+    def journal_path(self):
+        return f'{self.path}.journal'
+
+    @property
+    def lock_path(self):
+        return f'{self.path}.lock'
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock across processes; re-entrant for the thread holding ``self.lock``"""
+        if self.lock_depth == 0 and fcntl is not None:
+            self.lock_file = open(self.lock_path, 'a')
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        self.lock_depth += 1
+        try:
+            yield
+        finally:
+            self.lock_depth -= 1
+            if self.lock_depth == 0 and self.lock_file is not None:
+                fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+                self.lock_file.close()
+                self.lock_file = None
+
+    def invalidate(self):
+        with self.lock:
+            self.records = None
+            self.signature = None
+            self.journal_ops = 0
+            self.journal_offset = 0
+            self.pending = None
+
+    def attach(self, index):
+        with self.lock:
+            self.indexes.append(index)
+            if self.records is not None:
+                index.build(self.records.values())
+
+    def _stat(self, path):
+        try:
+            st = os.stat(path)
+            return st.st_mtime_ns, st.st_size
+        except FileNotFoundError:
+            return None
+
+    def _disk_signature(self):
+        return self._stat(self.path), self._stat(self.journal_path)
+
+    def _replay(self, records, offset, indexes=()):
+        """Apply journal lines from ``offset`` on; returns how many, and the offset after the last intact one"""
+        if not os.path.exists(self.journal_path):
+            return 0, 0
+        ops = 0
+        intact = offset
+        with open(self.journal_path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # A torn final line from a crash mid-append, even if all but the newline made it
+                    break
+                if line.strip():
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    if entry['op'] == 'put':
+                        records[entry['record'].get('id')] = entry['record']
+                        for index in indexes:
+                            index.add(entry['record'])
+                    elif entry['op'] == 'del':
+                        records.pop(entry['id'], None)
+                        for index in indexes:
+                            index.remove(entry['id'])
+                    ops += 1
+                intact += len(line)
+            torn = f.seek(0, os.SEEK_END) > intact
+        if torn:
+            # Cut the torn tail off, or the next append would be glued onto it and lost with it
+            with open(self.journal_path, 'r+b') as f:
+                f.truncate(intact)
+        return ops, intact
+
+    def _load(self):
+        records = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                for record in json.load(f):
+                    records[record.get('id')] = record
+        self.journal_ops, self.journal_offset = self._replay(records, 0)
+        self.records = records
+        self.signature = self._disk_signature()
+        for index in self.indexes:
+            index.build(records.values())
+
+    def _load_tail(self):
+        """Catch up on lines another process appended, or reload everything if the snapshot moved under us"""
+        snapshot, journal = self._disk_signature()
+        if snapshot != self.signature[0] or journal is None or journal[1] < self.journal_offset:
+            self._load()
+            return
+        ops, self.journal_offset = self._replay(self.records, self.journal_offset, self.indexes)
+        self.journal_ops += ops
+        self.signature = self._disk_signature()
+
+    def _ensure_loaded(self):
+        if self.records is None or self._disk_signature() != self.signature:
+            # Under the file lock, so a compaction can't swap the files mid-read
+            with self._file_lock():
+                if self.records is None:
+                    self._load()
+                else:
+                    self._load_tail()
+
+    def refresh(self):
+        """Load, or reload if the files changed on disk, so attached indexes are current"""
+        with self.lock:
+            self._ensure_loaded()
+
+    def sync(self):
+        """Like ``refresh``, but first waits out a transaction another process has open"""
+        with self.lock, self._file_lock():
+            self._ensure_loaded()
+
+    def all(self):
+        with self.lock:
+            self._ensure_loaded()
+            return list(self.records.values())
+
+    def get(self, photo_id):
+        with self.lock:
+            self._ensure_loaded()
+            return self.records.get(photo_id)
+
+    def __len__(self):
+        with self.lock:
+            self._ensure_loaded()
+            return len(self.records)
+
+    @contextmanager
+    def transaction(self):
+        """Group puts and deletes into one journal append and one index update"""
+        with self.lock:
+            if self.pending is not None:
+                yield self
+                return
+            with self._file_lock():
+                # Held to the end: another process's append lands before the check or after the commit
+                self._ensure_loaded()
+                self.pending = []
+                try:
+                    yield self
+                    self._commit(self.pending)
+                except BaseException:
+                    # In-memory state may be half-applied; reread from disk next time
+                    self.invalidate()
+                    raise
+                finally:
+                    self.pending = None
+
+    def put(self, records):
+        with self.transaction():
+            for record in records:
+                self.pending.append({'op': 'put', 'record': record})
+                self.records[record.get('id')] = record
+
+    def remove(self, photo_ids):
+        """Delete records by id and return the ones that existed"""
+        removed = []
+        with self.transaction():
+            for photo_id in photo_ids:
+                record = self.records.pop(photo_id, None)
+                if record is not None:
+                    removed.append(record)
+                    self.pending.append({'op': 'del', 'id': photo_id})
+        return removed
+
+    def update(self, photo_id, fields):
+        with self.transaction():
+            record = self.records.get(photo_id)
+            if record is None:
+                return None
+            record = {**record, **fields}
+            self.put([record])
+            return record
+
+    def _commit(self, ops):
+        if not ops:
+            return
+        with open(self.journal_path, 'a') as f:
+            f.write(''.join(json.dumps(op) + '\n' for op in ops))
+            f.flush()
+            os.fsync(f.fileno())
+            self.journal_offset = f.tell()
+        self.journal_ops += len(ops)
+
+        for op in ops:
+            for index in self.indexes:
+                if op['op'] == 'put':
+                    index.add(op['record'])
+                else:
+                    index.remove(op['id'])
+
+        if self.journal_ops > max(self.compact_min_ops, len(self.records)):
+            self._write_snapshot()
+        else:
+            self.signature = self._disk_signature()
+
+    def _write_snapshot(self):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(list(self.records.values()), f, indent=2)
+        os.replace(tmp_path, self.path)
+        # Replaying a stale journal over the new snapshot is harmless, so a
+        # crash between these two steps loses nothing
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.journal_ops = 0
+        self.journal_offset = 0
+        self.signature = self._disk_signature()
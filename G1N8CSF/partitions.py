@@ -0,0 +1,183 @@
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from metadata_store import MetadataStore
+from search_index import PhotoIndex
+from similarity import SimilarityIndex
+from columnar import ColumnarStats, numpy_available
+
+ALBUM_RE = re.compile(r'^[a-z0-9][a-z0-9_-]{0,63}$')
+
+# Fields that identify stored bytes: a content-addressed key, the URL, and the hash the blob cache is keyed by
+REFERENCE_FIELDS = ('storage_key', 'url', 'sha256')
+
+
+def record_references(record):
+    """``(field, value)`` pairs for a record and each of its variants"""
+    return [
+        (field, item[field])
+        for item in (record, *(record.get('variants') or ()))
+        for field in REFERENCE_FIELDS if item.get(field)
+    ]
+
+
+class References:
+    """How many live records, across every loaded partition, point at each stored object.
+
+    Each partition attaches its own ``PartitionReferences`` to its store,
+    which adds and subtracts that partition's records from the shared
+    counts. A reload rebuilds only the reloading partition's share.
+
+    A count can only be trusted while nothing is put or deleted under it.
+    Deleting an object, and saving records whose objects were just put,
+    both happen inside ``locked()``, which holds an ``flock`` on
+    ``lock_path`` as well so other processes wait too.
+    """
+
+    def __init__(self, lock_path=None):
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.lock_path = lock_path
+        self.objects_lock = threading.Lock()
+
+    @contextmanager
+    def locked(self):
+        """Keep stored objects from being deleted, or newly referenced, by any other thread or process"""
+        with self.objects_lock:
+            if fcntl is None or self.lock_path is None:
+                yield
+                return
+            with open(self.lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _change(self, keys, delta):
+        with self.lock:
+            for key in keys:
+                count = self.counts.get(key, 0) + delta
+                if count > 0:
+                    self.counts[key] = count
+                else:
+                    self.counts.pop(key, None)
+
+    def count(self, field, value):
+        with self.lock:
+            return self.counts.get((field, value), 0)
+
+
+class PartitionReferences:
+    """One partition's share of ``References``, kept current by attaching it to the partition's store"""
+
+    def __init__(self, references):
+        self.references = references
+        self.keys = {}
+
+    def build(self, records):
+        old, self.keys = self.keys, {}
+        for record in records:
+            self.keys[record.get('id')] = record_references(record)
+        self.references._change([key for keys in old.values() for key in keys], -1)
+        self.references._change([key for keys in self.keys.values() for key in keys], 1)
+
+    def add(self, record):
+        self.remove(record.get('id'))
+        self.keys[record.get('id')] = keys = record_references(record)
+        self.references._change(keys, 1)
+
+    def remove(self, photo_id):
+        keys = self.keys.pop(photo_id, None)
+        if keys:
+            self.references._change(keys, -1)
+
+
+class Partition:
+    """One shard of the gallery: a metadata store with its own lock, journal, indexes and stats"""
+
+    def __init__(self, name, path, references=None):
+        self.name = name
+        self.store = MetadataStore(path)
+        if references is not None:
+            self.store.attach(PartitionReferences(references))
+        self.search_index = PhotoIndex()
+        self.store.attach(self.search_index)
+        self.similarity_index = SimilarityIndex()
+        self.store.attach(self.similarity_index)
+        # Analytics over memory-mapped columns; /stats is off when NumPy isn't installed
+        self.columnar_stats = ColumnarStats(self.store) if numpy_available() else None
+        if self.columnar_stats:
+            self.store.attach(self.columnar_stats)
+
+
+class Partitions:
+    """The default gallery plus one partition per album, each opened on first use.
+
+    The default partition is the original metadata file. Album ``name``
+    lives in ``<albums_dir>/<name>.json``, with its own journal and column
+    files next to it. Partitions share only the storage backends and the
+    blob cache. Writes to one album never wait on another album's lock, and
+    an album's indexes and stats cover only its own photos. The exception
+    is ``references``, which counts stored objects across every partition
+    opened so far. ``on_open(partition)`` runs once for each album
+    partition opened.
+    """
+
+    def __init__(self, default_path, albums_dir, on_open=None):
+        self.albums_dir = albums_dir
+        self.on_open = on_open
+        self.lock = threading.Lock()
+        self.references = References(f'{default_path}.refs.lock')
+        self.default = Partition(None, default_path, self.references)
+        self.albums = {}
+
+    def path_for(self, name):
+        return os.path.join(self.albums_dir, f'{name}.json')
+
+    def exists(self, name):
+        path = self.path_for(name)
+        return os.path.exists(path) or os.path.exists(f'{path}.journal')
+
+    def get(self, name=None, create=False):
+        """Partition for album ``name``, or the default for None; None if the album is unknown and not created"""
+        if name is None:
+            return self.default
+        if not ALBUM_RE.match(name):
+            return None
+        with self.lock:
+            partition = self.albums.get(name)
+            if partition is not None:
+                return partition
+            if not create and not self.exists(name):
+                return None
+            os.makedirs(self.albums_dir, exist_ok=True)
+            partition = self.albums[name] = Partition(name, self.path_for(name), self.references)
+        if self.on_open:
+            self.on_open(partition)
+        return partition
+
+    def names(self):
+        """Album names on disk or open, without loading any of them"""
+        names = set(self.albums)
+        try:
+            filenames = os.listdir(self.albums_dir)
+        except FileNotFoundError:
+            filenames = []
+        for filename in filenames:
+            for suffix in ('.json', '.json.journal'):
+                if filename.endswith(suffix) and ALBUM_RE.match(filename[:-len(suffix)]):
+                    names.add(filename[:-len(suffix)])
+        return sorted(names)
+
+    def all(self):
+        """Every partition, opening albums that aren't loaded yet"""
+        albums = (self.get(name) for name in self.names())
+        return [self.default] + [partition for partition in albums if partition is not None]
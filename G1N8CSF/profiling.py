@@ -0,0 +1,111 @@
+import os
+import sys
+import time
+import random
+import threading
+from collections import Counter
+
+from flask import g, request
+
+
+class SamplingProfiler:
+    """Statistical profiler that samples the stacks of opted-in request threads.
+
+    A single daemon thread wakes every ``interval`` seconds while at least one
+    request is being profiled and records that thread's Python stack. Samples
+    from every profiled request are merged into one counter of collapsed
+    stacks (``root;caller;callee count``), the input format flamegraph.pl and
+    speedscope read directly.
+    """
+
+    def __init__(self, sample_rate=0.0, interval=0.005, authorize=None):
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.authorize = authorize
+        self.lock = threading.Lock()
+        self.active = set()
+        self.stacks = Counter()
+        self.requests = 0
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def wants_profile(self):
+        if self.sample_rate and random.random() < self.sample_rate:
+            return True
+        flag = request.headers.get('X-Profile') or request.args.get('profile')
+        return bool(flag) and flag != '0' and self.authorize is not None and self.authorize()
+
+    def _before_request(self):
+        if not self.sample_rate and self.authorize is None:
+            return
+        if self.wants_profile():
+            g.profiled_thread = threading.get_ident()
+            self.begin(g.profiled_thread)
+
+    def _teardown_request(self, exc):
+        thread_id = g.pop('profiled_thread', None)
+        if thread_id is not None:
+            self.end(thread_id)
+
+    def begin(self, thread_id):
+        with self.lock:
+            self.active.add(thread_id)
+            self.requests += 1
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+
+    def end(self, thread_id):
+        with self.lock:
+            self.active.discard(thread_id)
+            if not self.active:
+                self.wakeup.clear()
+
+    def reset(self):
+        with self.lock:
+            self.stacks.clear()
+            self.requests = 0
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            self.wakeup.wait()
+            with self.lock:
+                active = set(self.active)
+            frames = sys._current_frames()
+            samples = [self._collapse(frames[tid]) for tid in active if tid in frames and tid != own]
+            del frames
+            if samples:
+                with self.lock:
+                    self.stacks.update(samples)
+            time.sleep(self.interval)
+
+    @staticmethod
+    def _collapse(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def collapsed(self):
+        """Aggregated samples as collapsed-stack text, hottest first"""
+        with self.lock:
+            stacks = self.stacks.most_common()
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks)
+
+    def summary(self):
+        with self.lock:
+            return {
+                'profiled_requests': self.requests,
+                'samples': sum(self.stacks.values()),
+                'unique_stacks': len(self.stacks),
+                'sample_rate': self.sample_rate,
+                'interval': self.interval,
+            }
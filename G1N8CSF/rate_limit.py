@@ -0,0 +1,251 @@
+import math
+import time
+import uuid
+import sqlite3
+import threading
+from functools import wraps
+
+from flask import jsonify, request
+
+
+def full_at(tokens, now, rate, burst):
+    """When a bucket left with ``tokens`` refills to ``burst``; it can be forgotten from then on"""
+    if tokens >= burst:
+        return now
+    return now + (burst - tokens) / rate if rate > 0 else math.inf
+
+
+class MemoryBackend:
+    """Token buckets and concurrency leases in this process's memory.
+
+    Every ``prune_interval`` seconds, buckets that have refilled and keys
+    whose leases have all lapsed are dropped. A missing bucket starts full,
+    so forgetting one changes nothing, and memory tracks recent clients
+    rather than every address ever seen.
+    """
+
+    def __init__(self, prune_interval=60):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.leases = {}
+        self.prune_interval = prune_interval
+        self.next_prune = time.monotonic() + prune_interval
+
+    def _prune(self, now):
+        if now < self.next_prune:
+            return
+        self.next_prune = now + self.prune_interval
+        self.buckets = {key: bucket for key, bucket in self.buckets.items() if bucket[2] > now}
+        self.leases = {
+            key: held for key, held in self.leases.items()
+            if any(expires > now for expires in held.values())
+        }
+
+    def take(self, key, rate, burst, cost=1.0):
+        """Spend ``cost`` tokens; returns 0 if allowed, else seconds until the bucket could cover it"""
+        now = time.monotonic()
+        with self.lock:
+            self._prune(now)
+            tokens, updated, _ = self.buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate if rate > 0 else math.inf
+            self.buckets[key] = (tokens, now, full_at(tokens, now, rate, burst))
+            return wait
+
+    def acquire(self, key, limit, ttl):
+        """A lease token if fewer than ``limit`` are held for ``key``, else None; leases lapse after ``ttl``"""
+        now = time.monotonic()
+        with self.lock:
+            self._prune(now)
+            held = {token: expires for token, expires in self.leases.get(key, {}).items() if expires > now}
+            if len(held) >= limit:
+                self.leases[key] = held
+                return None
+            token = uuid.uuid4().hex
+            held[token] = now + ttl
+            self.leases[key] = held
+            return token
+
+    def release(self, key, token):
+        with self.lock:
+            held = self.leases.get(key)
+            if held:
+                held.pop(token, None)
+                if not held:
+                    del self.leases[key]
+
+
+class SQLiteBackend:
+    """The same state in a SQLite file, so every worker process on a host shares one set of limits.
+
+    Another store (Redis, memcached) plugs in the same way by providing
+    ``take``, ``acquire`` and ``release``. Refilled buckets and lapsed
+    leases are deleted every ``prune_interval`` seconds, as in memory.
+    """
+
+    def __init__(self, path, prune_interval=60):
+        self.path = path
+        self.local = threading.local()
+        self.prune_interval = prune_interval
+        self.next_prune = time.time() + prune_interval
+        with self._connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL, full_at REAL)')
+            if 'full_at' not in [column[1] for column in db.execute('PRAGMA table_info(buckets)')]:
+                # Files from before pruning; their rows get a full_at on the next take
+                db.execute('ALTER TABLE buckets ADD COLUMN full_at REAL')
+            db.execute('CREATE INDEX IF NOT EXISTS buckets_full_at ON buckets (full_at)')
+            db.execute('CREATE TABLE IF NOT EXISTS leases (key TEXT, token TEXT PRIMARY KEY, expires REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS leases_key ON leases (key, expires)')
+
+    def _connect(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = self.local.db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+        return _Transaction(db)
+
+    def _prune(self, db, now):
+        if now < self.next_prune:
+            return
+        self.next_prune = now + self.prune_interval
+        db.execute('DELETE FROM buckets WHERE full_at <= ?', (now,))
+        db.execute('DELETE FROM leases WHERE expires <= ?', (now,))
+
+    def take(self, key, rate, burst, cost=1.0):
+        now = time.time()
+        with self._connect() as db:
+            self._prune(db, now)
+            row = db.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate if rate > 0 else math.inf
+            db.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)',
+                       (key, tokens, now, full_at(tokens, now, rate, burst)))
+            return wait
+
+    def acquire(self, key, limit, ttl):
+        now = time.time()
+        with self._connect() as db:
+            self._prune(db, now)
+            db.execute('DELETE FROM leases WHERE key = ? AND expires <= ?', (key, now))
+            held = db.execute('SELECT COUNT(*) FROM leases WHERE key = ?', (key,)).fetchone()[0]
+            if held >= limit:
+                return None
+            token = uuid.uuid4().hex
+            db.execute('INSERT INTO leases (key, token, expires) VALUES (?, ?, ?)', (key, token, now + ttl))
+            return token
+
+    def release(self, key, token):
+        with self._connect() as db:
+            db.execute('DELETE FROM leases WHERE token = ?', (token,))
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, so a read-modify-write can't interleave with another process"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, *exc):
+        self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+
+class UploadLimiter:
+    """Admission control for an expensive endpoint, applied with ``@limiter.limit``.
+
+    Before the view runs, a request must pass three checks, in this order:
+    - The client must hold fewer than ``max_concurrent`` requests in flight.
+    - Fewer than ``max_inflight`` requests may be in flight overall.
+    - The client's token bucket (``rate`` tokens a second, up to ``burst``)
+      must cover the request's cost, which by default is its size in MB.
+    A failed check gets a 429 with Retry-After straight away, before the
+    body is read. So one client can't queue up work that delays everyone
+    else, and the limited view's worst-case concurrency stays fixed.
+    Tokens are only spent once both leases are held, so a request turned
+    away as busy costs nothing. A ``rate`` of 0 or less turns the token
+    bucket off and leaves the concurrency limits.
+
+    Clients are told apart by address. Behind ``trust_proxy`` reverse
+    proxies, that is the entry that many places from the right of
+    X-Forwarded-For, as werkzeug's ProxyFix reads it. Entries further left
+    were sent by the client and can say anything.
+    """
+
+    def __init__(self, backend, rate, burst, max_concurrent, max_inflight, lease_ttl=300,
+                 enabled=True, trust_proxy=0):
+        self.backend = backend
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.max_inflight = max_inflight
+        self.lease_ttl = lease_ttl
+        self.enabled = enabled
+        self.trust_proxy = trust_proxy
+        self.lock = threading.Lock()
+        self.counters = {'admitted': 0, 'rate_limited': 0, 'client_busy': 0, 'server_busy': 0}
+
+    def client_key(self):
+        if self.trust_proxy:
+            hops = [hop.strip() for hop in request.headers.get('X-Forwarded-For', '').split(',') if hop.strip()]
+            if len(hops) >= self.trust_proxy:
+                return hops[-self.trust_proxy]
+        return request.remote_addr or 'unknown'
+
+    def request_cost(self):
+        return max(1.0, (request.content_length or 0) / (1024 * 1024))
+
+    def _count(self, outcome):
+        with self.lock:
+            self.counters[outcome] += 1
+
+    def _reject(self, outcome, message, retry_after):
+        self._count(outcome)
+        response = jsonify({'success': False, 'message': message})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
+
+    def limit(self, view):
+        @wraps(view)
+        def limited(*args, **kwargs):
+            if not self.enabled:
+                return view(*args, **kwargs)
+            client = self.client_key()
+            client_lease = self.backend.acquire(f'client:{client}', self.max_concurrent, self.lease_ttl)
+            if client_lease is None:
+                return self._reject('client_busy', 'Too many uploads in progress from this client', 1)
+            try:
+                server_lease = self.backend.acquire('server', self.max_inflight, self.lease_ttl)
+                if server_lease is None:
+                    return self._reject('server_busy', 'Server is busy with other uploads, try again shortly', 1)
+                try:
+                    if self.rate > 0:
+                        # A request bigger than the whole bucket could never pass; charge it a full bucket instead
+                        cost = min(self.request_cost(), self.burst)
+                        wait = self.backend.take(f'rate:{client}', self.rate, self.burst, cost)
+                        if wait:
+                            return self._reject('rate_limited', 'Upload rate limit reached, try again later', wait)
+                    self._count('admitted')
+                    return view(*args, **kwargs)
+                finally:
+                    self.backend.release('server', server_lease)
+            finally:
+                self.backend.release(f'client:{client}', client_lease)
+        return limited
+
+    def status(self):
+        with self.lock:
+            return dict(self.counters)
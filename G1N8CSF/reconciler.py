@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from worker import BackgroundWorker, Pacer
+
+
+class Reconciler(BackgroundWorker):
+    """Background worker that deletes tombstoned photos from remote storage.
+
+    ``enqueue`` records a tombstone and returns straight away; the worker
+    thread later works through due tombstones in batches, paced to at most
+    ``rate`` remote calls per second, retrying failures with exponential
+    backoff until ``max_attempts``. Tombstones that run out of attempts stay
+    in the file as ``failed`` for inspection, but only the newest
+    ``max_failed`` of them, so a storage outage can't grow it without
+    bound. Every ``sweep_interval`` seconds it also
+    checks that the stored URL of each live record still resolves and
+    reports the ones that don't. A sweep runs on its own thread, paced
+    separately at ``sweep_rate`` (``rate`` when not given), so deletes keep
+    going while it does; ``start_sweep`` never runs two at once.
+
+    ``delete_remote(tombstone)`` and ``check_remote(record)`` do the actual
+    network calls and return ``(ok, error)`` / ``True``, ``False`` or
+    ``None`` (unknown), so the worker itself knows nothing about storage.
+    A sweep passes ``mark_out_of_sync`` the ``key(record)`` of each missing
+    record, its id unless the caller needs more to find it again.
+
+    Every worker process runs its own reconciler over the same tombstone
+    file. Read-modify-write cycles hold an ``flock`` on ``<path>.lock``,
+    and each save goes through its own temp file, so concurrent writers
+    neither lose tombstones nor leave a torn file.
+    """
+
+    name = 'reconciler'
+
+    def __init__(self, path, delete_remote, check_remote, load_records, mark_out_of_sync,
+                 batch_size=20, rate=2.0, max_attempts=5, backoff=30, sweep_interval=0,
+                 key=lambda record: record.get('id'), max_failed=1000, sweep_rate=None):
+        super().__init__(rate)
+        self.path = path
+        self.delete_remote = delete_remote
+        self.check_remote = check_remote
+        self.load_records = load_records
+        self.mark_out_of_sync = mark_out_of_sync
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.sweep_interval = sweep_interval
+        self.key = key
+        self.max_failed = max_failed
+        self.dropped = 0
+        self.last_sweep = None
+        self.sweep_pacer = Pacer(rate if sweep_rate is None else sweep_rate)
+        self.sweep_lock = threading.Lock()
+        self.sweep_thread = None
+        self.next_sweep = time.time() + sweep_interval if sweep_interval else None
+
+    def _load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        return []
+
+    @contextmanager
+    def _locked(self):
+        """This thread's and every other process's writes to the tombstone file wait while held"""
+        with self.lock:
+            if fcntl is None:
+                yield
+                return
+            with open(f'{self.path}.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save(self, tombstones):
+        failed = [t for t in tombstones if t['status'] == 'failed']
+        if len(failed) > self.max_failed:
+            # Oldest first in the file; forget the ones past the cap
+            dropped = {id(t) for t in failed[:len(failed) - self.max_failed]}
+            tombstones = [t for t in tombstones if id(t) not in dropped]
+            self.dropped += len(dropped)
+            print(f"Reconciler dropped {len(dropped)} failed tombstones over the limit of {self.max_failed}")
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), prefix='.tombstones-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(tombstones, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def enqueue(self, records):
+        """Tombstone removed records so their remote copies get deleted later"""
+        now = time.time()
+        tombstones = [
+            {
+                'id': record.get('id'),
+                'url': record.get('url'),
+                'delete_url': record.get('delete_url'),
+                'storage': record.get('storage'),
+                'storage_key': record.get('storage_key'),
+                'sha256': record.get('sha256'),
+                'deleted_at': int(now),
+                'attempts': 0,
+                'next_attempt': now,
+                'status': 'pending',
+                'last_error': None,
+            }
+            for record in records
+        ]
+        if not tombstones:
+            return
+        with self._locked():
+            existing = self._load()
+            existing.extend(tombstones)
+            self._save(existing)
+        self.wake()
+
+    def run_once(self):
+        """Process one batch of due tombstones; returns how many were attempted"""
+        with self.process_lock:
+            now = time.time()
+            with self.lock:
+                due = [t for t in self._load() if t['status'] == 'pending' and t['next_attempt'] <= now]
+            batch = due[:self.batch_size]
+            if not batch:
+                return 0
+
+            results = {}
+            for tombstone in batch:
+                self._pace()
+                try:
+                    ok, error = self.delete_remote(tombstone)
+                except Exception as e:
+                    ok, error = False, str(e)
+                results[tombstone['id']] = (ok, error)
+
+            with self._locked():
+                tombstones = self._load()
+                remaining = []
+                for tombstone in tombstones:
+                    result = results.get(tombstone['id'])
+                    if result is None or tombstone['status'] != 'pending':
+                        remaining.append(tombstone)
+                        continue
+                    ok, error = result
+                    if ok:
+                        print(f"Reconciler removed remote copy of {tombstone['id']}")
+                        continue
+                    tombstone['attempts'] += 1
+                    tombstone['last_error'] = error
+                    if tombstone['attempts'] >= self.max_attempts:
+                        tombstone['status'] = 'failed'
+                        print(f"Reconciler gave up on {tombstone['id']}: {error}")
+                    else:
+                        tombstone['next_attempt'] = time.time() + self.backoff * 2 ** (tombstone['attempts'] - 1)
+                    remaining.append(tombstone)
+                self._save(remaining)
+            return len(batch)
+
+    def start_sweep(self):
+        """Sweep on a thread of its own; False if a sweep is already running"""
+        with self.lock:
+            if self.sweep_thread is not None and self.sweep_thread.is_alive():
+                return False
+            self.sweep_thread = threading.Thread(target=self._sweep_in_thread, name=f'{self.name}-sweep', daemon=True)
+            self.sweep_thread.start()
+            return True
+
+    def _sweep_in_thread(self):
+        try:
+            self.sweep()
+        except Exception as e:
+            print(f"Reconciler sweep error: {str(e)}")
+
+    def sweep(self):
+        """Check every stored URL and flag records whose remote copy is gone"""
+        with self.sweep_lock:
+            return self._sweep()
+
+    def _sweep(self):
+        records = self.load_records()
+        missing = []
+        unknown = 0
+        for record in records:
+            self.sweep_pacer.wait()
+            try:
+                exists = self.check_remote(record)
+            except Exception:
+                exists = None
+            if exists is False:
+                missing.append(self.key(record))
+            elif exists is None:
+                unknown += 1
+        if missing:
+            self.mark_out_of_sync(missing)
+        self.last_sweep = {
+            'at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'checked': len(records),
+            'missing': missing,
+            'unknown': unknown,
+        }
+        print(f"Reconciler sweep checked {len(records)} records, {len(missing)} out of sync")
+        return self.last_sweep
+
+    def status(self):
+        with self.lock:
+            tombstones = self._load()
+        counts = {}
+        for tombstone in tombstones:
+            counts[tombstone['status']] = counts.get(tombstone['status'], 0) + 1
+        return {
+            'pending': counts.get('pending', 0),
+            'failed': counts.get('failed', 0),
+            'failed_ids': [t['id'] for t in tombstones if t['status'] == 'failed'],
+            'failed_dropped': self.dropped,
+            'last_sweep': self.last_sweep,
+        }
+
+    def _seconds_until_due(self):
+        with self.lock:
+            pending = [t['next_attempt'] for t in self._load() if t['status'] == 'pending']
+        waits = []
+        if pending:
+            waits.append(min(pending) - time.time())
+        if self.next_sweep:
+            waits.append(self.next_sweep - time.time())
+        return max(0.0, min(waits)) if waits else None
+
+    def _idle(self):
+        if self.next_sweep and time.time() >= self.next_sweep:
+            self.next_sweep = time.time() + self.sweep_interval
+            self.start_sweep()
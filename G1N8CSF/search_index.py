@@ -0,0 +1,285 @@
+import re
+import heapq
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+
+TEXT_FIELDS = ('filename', 'camera_make', 'camera_model', 'lens')
+RANGE_FIELDS = ('iso', 'width', 'height', 'size', 'timestamp', 'year', 'month')
+# Nearly unique per record, so these are indexed as sorted arrays instead of a set per value
+SORTED_FIELDS = ('size', 'timestamp')
+# A later range constraint checks candidates one by one when it is this many times larger, else intersects sets
+FILTER_RATIO = 8
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+NUMBER_RE = re.compile(r'-?\d+(\.\d+)?')
+MAX_CHAR = '\U0010ffff'
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(str(text).lower())
+
+
+def numeric_value(value):
+    """Pull a number out of stored values such as 200, '200' or '(200,)'"""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    match = NUMBER_RE.search(str(value))
+    if not match:
+        return None
+    number = float(match.group())
+    return int(number) if number.is_integer() else number
+
+
+class PhotoIndex:
+    """Inverted index over text fields plus sorted range indexes over numeric fields.
+
+    Text postings are kept both as plain tokens and as ``field:token`` so a
+    query can match anywhere or within one field. Range fields whose
+    values repeat (ISO, dimensions, dates) keep a sorted list of distinct
+    values with a posting set per value. ``size`` and ``timestamp`` are
+    nearly unique per record, where that would mean unioning thousands of
+    one-id sets, so they keep every value in one sorted list with the ids
+    in a parallel list: counting a range is two bisects, its ids one slice.
+
+    Constraints run most selective first. A later range constraint then
+    checks the surviving candidates against ``values`` instead of
+    materialising its own ids.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.records = {}
+            self.record_terms = {}
+            self.postings = defaultdict(set)
+            self.vocabulary = []
+            self.values = {field: {} for field in RANGE_FIELDS}
+            self.range_postings = {field: defaultdict(set) for field in RANGE_FIELDS if field not in SORTED_FIELDS}
+            self.range_keys = {field: [] for field in self.range_postings}
+            self.range_values = {field: [] for field in SORTED_FIELDS}
+            self.range_ids = {field: [] for field in SORTED_FIELDS}
+            self.built = False
+
+    def build(self, records):
+        with self.lock:
+            self.clear()
+            for record in records:
+                photo_id = record.get('id')
+                if not photo_id:
+                    continue
+                self.records[photo_id] = record
+                self.record_terms[photo_id] = terms = self._terms(record)
+                for term in terms:
+                    self.postings[term].add(photo_id)
+                for field in RANGE_FIELDS:
+                    value = numeric_value(record.get(field))
+                    if value is not None:
+                        self.values[field][photo_id] = value
+                        if field in self.range_postings:
+                            self.range_postings[field][value].add(photo_id)
+            # Sorting once is far cheaper than insort per record on a cold build
+            self.vocabulary = sorted(self.postings)
+            for field, postings in self.range_postings.items():
+                self.range_keys[field] = sorted(postings)
+            for field in SORTED_FIELDS:
+                pairs = sorted(self.values[field].items(), key=lambda item: item[1])
+                self.range_values[field] = [value for _, value in pairs]
+                self.range_ids[field] = [photo_id for photo_id, _ in pairs]
+            self.built = True
+
+    def add(self, record):
+        with self.lock:
+            self._add(record)
+
+    def remove(self, photo_id):
+        with self.lock:
+            return self._remove(photo_id)
+
+    def _add(self, record):
+        photo_id = record.get('id')
+        if not photo_id:
+            return
+        if photo_id in self.records:
+            self._remove(photo_id)
+        self.records[photo_id] = record
+        self.record_terms[photo_id] = terms = self._terms(record)
+
+        for term in terms:
+            postings = self.postings[term]
+            if not postings:
+                insort(self.vocabulary, term)
+            postings.add(photo_id)
+
+        for field in RANGE_FIELDS:
+            value = numeric_value(record.get(field))
+            if value is None:
+                continue
+            self.values[field][photo_id] = value
+            if field in SORTED_FIELDS:
+                pos = bisect_right(self.range_values[field], value)
+                self.range_values[field].insert(pos, value)
+                self.range_ids[field].insert(pos, photo_id)
+                continue
+            postings = self.range_postings[field][value]
+            if not postings:
+                insort(self.range_keys[field], value)
+            postings.add(photo_id)
+
+    def _remove(self, photo_id):
+        if self.records.pop(photo_id, None) is None:
+            return False
+
+        for term in self.record_terms.pop(photo_id):
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            postings.discard(photo_id)
+            if not postings:
+                del self.postings[term]
+                self._discard_sorted(self.vocabulary, term)
+
+        for field in RANGE_FIELDS:
+            value = self.values[field].pop(photo_id, None)
+            if value is None:
+                continue
+            if field in SORTED_FIELDS:
+                values, ids = self.range_values[field], self.range_ids[field]
+                # The id sits somewhere in the run of equal values
+                pos = ids.index(photo_id, bisect_left(values, value), bisect_right(values, value))
+                del values[pos]
+                del ids[pos]
+                continue
+            postings = self.range_postings[field].get(value)
+            if postings is None:
+                continue
+            postings.discard(photo_id)
+            if not postings:
+                del self.range_postings[field][value]
+                self._discard_sorted(self.range_keys[field], value)
+        return True
+
+    @staticmethod
+    def _discard_sorted(items, item):
+        pos = bisect_left(items, item)
+        if pos < len(items) and items[pos] == item:
+            del items[pos]
+
+    def _terms(self, record):
+        terms = set()
+        for field in TEXT_FIELDS:
+            value = record.get(field)
+            if not value:
+                continue
+            for token in tokenize(value):
+                terms.add(token)
+                terms.add(f'{field}:{token}')
+        return terms
+
+    def _plan(self, text, fields, ranges):
+        """Turn a query into ``(size, posting sets, span, bounds)`` constraints, smallest first.
+
+        ``bounds`` is ``(field, low, high)`` for a range and None for text. A
+        sorted field has no posting sets; ``span`` is the ``(start, end)``
+        slice of ``range_ids[field]`` it covers instead.
+        """
+        constraints = []
+        prefixes = tokenize(text or '')
+        for field, query in (fields or {}).items():
+            prefixes.extend(f'{field}:{token}' for token in tokenize(query or ''))
+        for prefix in prefixes:
+            start = bisect_left(self.vocabulary, prefix)
+            end = bisect_left(self.vocabulary, prefix + MAX_CHAR, start)
+            sets = [self.postings[term] for term in self.vocabulary[start:end]]
+            constraints.append((sum(map(len, sets)), sets, None, None))
+        for field, (low, high) in (ranges or {}).items():
+            keys = self.range_values[field] if field in SORTED_FIELDS else self.range_keys[field]
+            start = 0 if low is None else bisect_left(keys, low)
+            end = len(keys) if high is None else bisect_right(keys, high)
+            end = max(start, end)
+            if field in SORTED_FIELDS:
+                constraints.append((end - start, None, (start, end), (field, low, high)))
+            else:
+                postings = self.range_postings[field]
+                sets = [postings[key] for key in keys[start:end]]
+                constraints.append((sum(map(len, sets)), sets, None, (field, low, high)))
+        constraints.sort(key=lambda constraint: constraint[0])
+        return constraints
+
+    @staticmethod
+    def _union(sets):
+        """Union of posting sets; a single set is returned as-is and must not be mutated"""
+        if len(sets) == 1:
+            return sets[0]
+        ids = set()
+        for postings in sets:
+            ids |= postings
+        return ids
+
+    def search(self, text=None, fields=None, ranges=None, limit=50, offset=0):
+        """Return ``(total, records)`` newest first.
+
+        ``text`` is matched as prefixes against every text field, ``fields``
+        maps a text field to a query for that field only, and ``ranges`` maps
+        a range field to an inclusive ``(low, high)`` pair where either end
+        may be ``None``. Constraints are applied most selective first.
+        """
+        with self.lock:
+            matches = self.match(text, fields, ranges)
+            return len(matches), self._newest(matches, offset, limit)
+
+    def match(self, text=None, fields=None, ranges=None):
+        """Ids of every record matching the query, in no particular order"""
+        with self.lock:
+            constraints = self._plan(text, fields, ranges)
+            if not constraints:
+                return self.records.keys()
+            matches = self._ids(*constraints[0][1:])
+            for size, sets, span, bounds in constraints[1:]:
+                if not matches:
+                    break
+                if bounds and len(matches) * FILTER_RATIO < size:
+                    # Far fewer candidates than range ids: check each candidate's value instead
+                    field, low, high = bounds
+                    values = self.values[field]
+                    matches = {
+                        photo_id for photo_id in matches
+                        if photo_id in values
+                        and (low is None or values[photo_id] >= low)
+                        and (high is None or values[photo_id] <= high)
+                    }
+                else:
+                    # Comparable sizes: building the range's ids and intersecting in C beats a Python-level filter
+                    matches = matches & self._ids(sets, span, bounds)
+            return matches
+
+    def _ids(self, sets, span, bounds):
+        """Ids covered by one constraint; as with ``_union`` the result must not be mutated"""
+        if span:
+            start, end = span
+            return set(self.range_ids[bounds[0]][start:end])
+        return self._union(sets)
+
+    def _newest(self, matches, offset, limit):
+        records = self.records
+        wanted = offset + limit
+        if len(self.values['timestamp']) == len(records) and wanted * len(records) < len(matches) ** 2:
+            # Dense match: walking the timestamp index from the end finds the
+            # newest page after about wanted * N / M steps, fewer than the M a heap needs
+            newest = []
+            for photo_id in reversed(self.range_ids['timestamp']):
+                if photo_id in matches:
+                    newest.append(photo_id)
+                    if len(newest) >= wanted:
+                        break
+        else:
+            newest = heapq.nlargest(
+                wanted, matches,
+                key=lambda photo_id: records[photo_id].get('timestamp', 0)
+            )
+        return [records[photo_id] for photo_id in newest[offset:wanted]]
@@ -0,0 +1,138 @@
+import threading
+from collections import defaultdict
+from itertools import combinations
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+MAX_DISTANCE = 12
+
+
+def dhash(img, size=8):
+    """64-bit difference hash of an open PIL image, as 16 hex digits.
+
+    The image is shrunk to 9x8 greyscale and each bit records whether a
+    pixel is brighter than its right-hand neighbour, so re-encodes, resizes
+    and small edits change only a few bits.
+    """
+    from PIL import Image
+
+    # JPEG can decode straight to a fraction of its size; other formats ignore this
+    img.draft('L', (size * 8, size * 8))
+    small = img.convert('L').resize((size + 1, size), Image.Resampling.BOX, reducing_gap=2.0)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f'{value:016x}'
+
+
+def hash_value(phash):
+    try:
+        return int(phash, 16)
+    except (TypeError, ValueError):
+        return None
+
+
+def _flips(bits, radius):
+    """Every mask of ``bits`` width with at most ``radius`` bits set"""
+    masks = []
+    for count in range(radius + 1):
+        for positions in combinations(range(bits), count):
+            mask = 0
+            for position in positions:
+                mask |= 1 << position
+            masks.append(mask)
+    return masks
+
+
+class SimilarityIndex:
+    """Multi-index hash table over 64-bit perceptual hashes.
+
+    Each hash is split into four 16-bit chunks, and every chunk position
+    has a table from chunk value to photo ids. Two hashes within Hamming
+    distance ``d`` must agree to within ``d // 4`` bits on at least one
+    chunk (pigeonhole), so a query only probes the chunk values that close
+    to its own and checks the full distance on those candidates. For the
+    default radius of 10 that is at most 548 table lookups, however large
+    the library is.
+
+    Same build/add/remove interface as ``PhotoIndex``, so it attaches to
+    ``MetadataStore``.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flip_masks = {}
+        self.build(())
+
+    def build(self, records):
+        with self.lock:
+            self.hashes = {}
+            self.tables = [defaultdict(set) for _ in range(CHUNKS)]
+            for record in records:
+                self._add(record)
+
+    def add(self, record):
+        with self.lock:
+            self._add(record)
+
+    def remove(self, photo_id):
+        with self.lock:
+            self._remove(photo_id)
+
+    def _chunks(self, value):
+        return [(value >> (i * CHUNK_BITS)) & CHUNK_MASK for i in range(CHUNKS)]
+
+    def _add(self, record):
+        photo_id = record.get('id')
+        if photo_id in self.hashes:
+            self._remove(photo_id)
+        value = hash_value(record.get('phash'))
+        if not photo_id or value is None:
+            return
+        self.hashes[photo_id] = value
+        for table, chunk in zip(self.tables, self._chunks(value)):
+            table[chunk].add(photo_id)
+
+    def _remove(self, photo_id):
+        value = self.hashes.pop(photo_id, None)
+        if value is None:
+            return
+        for table, chunk in zip(self.tables, self._chunks(value)):
+            bucket = table.get(chunk)
+            if bucket is not None:
+                bucket.discard(photo_id)
+                if not bucket:
+                    del table[chunk]
+
+    def _masks(self, radius):
+        if radius not in self.flip_masks:
+            self.flip_masks[radius] = _flips(CHUNK_BITS, radius)
+        return self.flip_masks[radius]
+
+    def search(self, phash, max_distance=10, limit=20, exclude=None):
+        """``(distance, photo_id)`` pairs within ``max_distance`` bits, closest first"""
+        value = hash_value(phash)
+        if value is None:
+            return []
+        max_distance = max(0, min(max_distance, MAX_DISTANCE))
+        masks = self._masks(max_distance // CHUNKS)
+        with self.lock:
+            candidates = set()
+            for table, chunk in zip(self.tables, self._chunks(value)):
+                for mask in masks:
+                    bucket = table.get(chunk ^ mask)
+                    if bucket:
+                        candidates |= bucket
+            candidates.discard(exclude)
+            matches = []
+            for photo_id in candidates:
+                distance = (self.hashes[photo_id] ^ value).bit_count()
+                if distance <= max_distance:
+                    matches.append((distance, photo_id))
+        matches.sort()
+        return matches[:limit]
@@ -0,0 +1,405 @@
+import os
+import re
+import uuid
+import hmac
+import shutil
+import hashlib
+import tempfile
+import mimetypes
+from io import BytesIO
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from urllib.parse import quote, urlparse
+
+LOCAL_KEY_RE = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{64}\.[a-z0-9]+$')
+# The delete page carries its CSRF token in the page config (auth_token="...") and in form inputs
+AUTH_TOKEN_RE = re.compile(r'auth_token["\']?\s*(?:[=:]|value=)\s*["\']([0-9a-fA-F]+)["\']')
+
+# Older Pythons don't map these, and transcoded variants use them. Checked
+# before mimetypes, whose first call reads the system type tables.
+EXTRA_TYPES = {'webp': 'image/webp', 'avif': 'image/avif'}
+
+
+def _no_stage(name):
+    return nullcontext()
+
+
+def content_key(sha256, filename):
+    """Content-addressed object key: ab/abcdef....ext"""
+    ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else 'bin'
+    return f'{sha256[:2]}/{sha256}.{ext}'
+
+
+def guess_type(filename):
+    ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+    return EXTRA_TYPES.get(ext) or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+class SizedStream:
+    """Wrap a file so requests streams it with a Content-Length instead of probing fileno()"""
+
+    def __init__(self, stream, size):
+        self.stream = stream
+        self.len = size
+
+    def __len__(self):
+        return self.len
+
+    def read(self, n=-1):
+        return self.stream.read(n)
+
+
+class MultipartStream:
+    """File-like multipart/form-data body that streams the image part from disk"""
+
+    def __init__(self, fields, file_field, filename, stream, size):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+        head = b''.join(
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8')
+            for name, value in fields.items()
+        )
+        head += (
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n'
+        ).encode('utf-8')
+        tail = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+        self.parts = [BytesIO(head), stream, BytesIO(tail)]
+        self.len = len(head) + size + len(tail)
+
+    def __len__(self):
+        return self.len
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            n = self.len
+        out = b''
+        while self.parts and len(out) < n:
+            chunk = self.parts[0].read(n - len(out))
+            if chunk:
+                out += chunk
+            else:
+                self.parts.pop(0)
+        return out
+
+
+class StorageProvider:
+    """Where image bytes live.
+
+    ``put`` stores a stream and returns the URL fields and id for the
+    metadata record. ``delete`` and ``exists`` take a record (or a tombstone
+    carrying the same fields); ``delete`` returns ``(ok, error)`` and
+    ``exists`` returns True, False or None when it can't tell. ``open``
+    returns a readable stream of the original, or None.
+    """
+
+    name = None
+
+    def config_error(self):
+        """Why this provider can't accept uploads, or None if it can"""
+        return None
+
+    def put(self, stream, size, filename, sha256):
+        raise NotImplementedError
+
+    def delete(self, record):
+        raise NotImplementedError
+
+    def exists(self, record):
+        raise NotImplementedError
+
+    def open(self, record):
+        return None
+
+    def local_path(self, record):
+        return None
+
+
+class ImgBBProvider(StorageProvider):
+    name = 'imgbb'
+
+    def __init__(self, api_key, upload_url, session, stage=_no_stage):
+        self.api_key = api_key
+        self.upload_url = upload_url
+        self.session = session
+        self.stage = stage
+
+    def config_error(self):
+        if not self.api_key:
+            return 'ImgBB API key not configured. Please add IMGBB_API_KEY to .env file'
+        return None
+
+    def put(self, stream, size, filename, sha256):
+        """Upload image to ImgBB (Free hosting)"""
+        if not self.api_key:
+            return None, "ImgBB API key not configured"
+
+        # Sent as a binary multipart part rather than base64 so the body can stream
+        stream.seek(0)
+        with self.stage('encode'):
+            body = MultipartStream({'key': self.api_key, 'name': filename}, 'image', filename, stream, size)
+
+        with self.stage('imgbb_post'):
+            response = self.session.post(
+                self.upload_url, data=body, headers={'Content-Type': body.content_type}, timeout=30
+            )
+            result = response.json()
+
+        if result.get('success'):
+            data = result['data']
+            return {
+                'url': data['url'],
+                'display_url': data['display_url'],
+                'delete_url': data['delete_url'],
+                'thumb_url': data.get('thumb', {}).get('url', data['url']),
+                'id': data['id']
+            }, None
+        return None, result.get('error', {}).get('message', 'Upload failed')
+
+    def delete(self, record):
+        """Delete an ImgBB image the way its delete page does.
+
+        ImgBB has no API call for this. Opening the delete_url starts a
+        session and embeds an ``auth_token`` in the page; the delete is then
+        a POST to ``/json`` carrying that token, the session cookie, and the
+        id/hash pair from the delete_url.
+        """
+        delete_url = record.get('delete_url')
+        if not delete_url:
+            return True, None
+
+        parsed = urlparse(delete_url)
+        parts = parsed.path.strip('/').split('/')
+        if len(parts) != 2:
+            return False, f"Unrecognised delete_url {delete_url}"
+        image_id, image_hash = parts
+
+        page = self.session.get(delete_url, timeout=30)
+        if page.status_code == 404:
+            return True, None
+        if page.status_code != 200:
+            return False, f"Delete page returned HTTP {page.status_code}"
+        match = AUTH_TOKEN_RE.search(page.text)
+        if not match:
+            return False, "No auth_token on the delete page"
+
+        response = self.session.post(f"{parsed.scheme}://{parsed.netloc}/json", data={
+            'auth_token': match.group(1),
+            'action': 'delete',
+            'single': 'true',
+            'delete': 'image',
+            'from': 'resource',
+            'deleting[id]': image_id,
+            'deleting[hash]': image_hash
+        }, cookies=page.cookies, timeout=30)
+        if response.status_code == 404:
+            return True, None
+        if response.status_code != 200:
+            return False, f"HTTP {response.status_code}"
+        result = response.json()
+        if result.get('status_code', 200) == 200:
+            return True, None
+        return False, result.get('error', {}).get('message', 'Delete failed')
+
+    def exists(self, record):
+        url = record.get('url')
+        if not url:
+            return None
+        response = self.session.head(url, timeout=15, allow_redirects=True)
+        if response.status_code == 404:
+            return False
+        if response.status_code < 400:
+            return True
+        return None
+
+    def open(self, record):
+        url = record.get('url')
+        if not url:
+            return None
+        response = self.session.get(url, stream=True, timeout=30)
+        if response.status_code != 200:
+            response.close()
+            return None
+        response.raw.decode_content = True
+        return response.raw
+
+
+class LocalProvider(StorageProvider):
+    """Content-addressed files under ``root``, served by the app at ``url_prefix``"""
+
+    name = 'local'
+
+    def __init__(self, root, url_prefix='/files'):
+        # Absolute, since send_file resolves a relative path against the app's root_path, not the cwd
+        self.root = os.path.abspath(root)
+        self.url_prefix = url_prefix.rstrip('/')
+
+    def path_for(self, key):
+        if not LOCAL_KEY_RE.match(key or ''):
+            return None
+        return os.path.join(self.root, *key.split('/'))
+
+    def local_path(self, record):
+        return self.path_for(record.get('storage_key'))
+
+    def put(self, stream, size, filename, sha256):
+        key = content_key(sha256, filename)
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            stream.seek(0)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.upload-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    shutil.copyfileobj(stream, f, 1024 * 1024)
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        url = f'{self.url_prefix}/{key}'
+        return {
+            'url': url,
+            'display_url': url,
+            'delete_url': None,
+            'thumb_url': url,
+            'id': uuid.uuid4().hex[:12],
+            'storage_key': key
+        }, None
+
+    def delete(self, record):
+        path = self.local_path(record)
+        if path is None:
+            return False, f"Invalid storage key {record.get('storage_key')}"
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return True, None
+
+    def exists(self, record):
+        path = self.local_path(record)
+        return None if path is None else os.path.exists(path)
+
+    def open(self, record):
+        path = self.local_path(record)
+        if path is None or not os.path.exists(path):
+            return None
+        return open(path, 'rb')
+
+
+class S3Provider(StorageProvider):
+    """S3-compatible object store (AWS, MinIO, ...) over path-style URLs with SigV4"""
+
+    name = 's3'
+
+    def __init__(self, endpoint, bucket, access_key, secret_key, session,
+                 region='us-east-1', public_url=None, prefix=''):
+        self.endpoint = endpoint.rstrip('/') if endpoint else ''
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.session = session
+        self.region = region
+        self.public_url = (public_url or f'{self.endpoint}/{bucket}').rstrip('/')
+        self.prefix = prefix
+
+    def config_error(self):
+        missing = [name for name, value in (
+            ('S3_ENDPOINT', self.endpoint), ('S3_BUCKET', self.bucket),
+            ('S3_ACCESS_KEY', self.access_key), ('S3_SECRET_KEY', self.secret_key)
+        ) if not value]
+        if missing:
+            return f"S3 storage not configured. Please add {', '.join(missing)} to .env file"
+        return None
+
+    def _object_url(self, key):
+        return f'{self.endpoint}/{quote(self.bucket)}/{quote(key, safe="/~")}'
+
+    def _signed_headers(self, method, key, headers=None):
+        """AWS Signature Version 4 headers for a path-style request with an unsigned payload"""
+        now = datetime.now(timezone.utc)
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        datestamp = now.strftime('%Y%m%d')
+        headers = {name.lower(): str(value).strip() for name, value in (headers or {}).items()}
+        headers.update({
+            'host': urlparse(self.endpoint).netloc,
+            'x-amz-date': amz_date,
+            'x-amz-content-sha256': 'UNSIGNED-PAYLOAD'
+        })
+        signed = sorted(headers)
+        canonical_request = '\n'.join([
+            method,
+            f'/{quote(self.bucket)}/{quote(key, safe="/~")}',
+            '',
+            ''.join(f'{name}:{headers[name]}\n' for name in signed),
+            ';'.join(signed),
+            'UNSIGNED-PAYLOAD'
+        ])
+        scope = f'{datestamp}/{self.region}/s3/aws4_request'
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256', amz_date, scope,
+            hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+        ])
+        signing_key = ('AWS4' + self.secret_key).encode('utf-8')
+        for part in (datestamp, self.region, 's3', 'aws4_request'):
+            signing_key = hmac.new(signing_key, part.encode('utf-8'), hashlib.sha256).digest()
+        signature = hmac.new(signing_key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+        headers['authorization'] = (
+            f'AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, '
+            f'SignedHeaders={";".join(signed)}, Signature={signature}'
+        )
+        del headers['host']
+        return headers
+
+    def put(self, stream, size, filename, sha256):
+        key = self.prefix + content_key(sha256, filename)
+        stream.seek(0)
+        headers = self._signed_headers('PUT', key, {'Content-Type': guess_type(filename)})
+        response = self.session.put(self._object_url(key), data=SizedStream(stream, size), headers=headers, timeout=60)
+        if response.status_code not in (200, 201):
+            return None, f"S3 upload failed: HTTP {response.status_code}"
+        url = f'{self.public_url}/{quote(key, safe="/~")}'
+        return {
+            'url': url,
+            'display_url': url,
+            'delete_url': None,
+            'thumb_url': url,
+            'id': uuid.uuid4().hex[:12],
+            'storage_key': key
+        }, None
+
+    def delete(self, record):
+        key = record.get('storage_key')
+        if not key:
+            return False, 'Record has no storage_key'
+        response = self.session.delete(
+            self._object_url(key), headers=self._signed_headers('DELETE', key), timeout=30
+        )
+        if response.status_code in (200, 204, 404):
+            return True, None
+        return False, f"HTTP {response.status_code}"
+
+    def exists(self, record):
+        key = record.get('storage_key')
+        if not key:
+            return None
+        response = self.session.head(self._object_url(key), headers=self._signed_headers('HEAD', key), timeout=15)
+        if response.status_code == 404:
+            return False
+        if response.status_code < 400:
+            return True
+        return None
+
+    def open(self, record):
+        key = record.get('storage_key')
+        if not key:
+            return None
+        response = self.session.get(
+            self._object_url(key), headers=self._signed_headers('GET', key), stream=True, timeout=30
+        )
+        if response.status_code != 200:
+            response.close()
+            return None
+        response.raw.decode_content = True
+        return response.raw
@@ -0,0 +1,96 @@
+import os
+import sys
+import tempfile
+from collections import OrderedDict
+from io import BytesIO
+
+import pytest
+
+# The gallery's modules sit beside this directory rather than in an installed package
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+# app.py reads its config on import; keep it away from the real library files
+SCRATCH = tempfile.mkdtemp(prefix='gallery-tests-')
+os.environ.update(
+    METADATA_FILE=os.path.join(SCRATCH, 'photos.json'),
+    ALBUMS_DIR=os.path.join(SCRATCH, 'albums'),
+    TOMBSTONE_FILE=os.path.join(SCRATCH, 'tombstones.json'),
+    DOWNLOAD_CACHE_DIR=os.path.join(SCRATCH, 'cache'),
+    LOCAL_STORAGE_DIR=os.path.join(SCRATCH, 'uploads'),
+    STORAGE_BACKEND='local',
+    WARM_UP='0',
+    RECONCILE_SWEEP_INTERVAL='0',
+)
+
+from bench.fake_imgbb import FakeImgBB  # noqa: E402
+from bench.fake_s3 import FakeS3  # noqa: E402
+
+
+@pytest.fixture
+def fake_imgbb():
+    with FakeImgBB() as fake:
+        yield fake
+
+
+@pytest.fixture
+def fake_s3():
+    with FakeS3() as fake:
+        yield fake
+
+
+@pytest.fixture
+def http():
+    requests = pytest.importorskip('requests')
+    with requests.Session() as session:
+        yield session
+
+
+def png(color='red', size=(64, 48)):
+    """Bytes of a small PNG, distinct per color"""
+    from PIL import Image
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def gallery(tmp_path, monkeypatch):
+    """app.py wired to an empty library, local storage and a blob cache under tmp_path.
+
+    The enricher and reconciler threads never start; tests call ``drain``.
+    """
+    import app as gallery
+    from blob_cache import BlobCache
+    from partitions import Partitions
+    from rate_limit import MemoryBackend
+
+    partitions = Partitions(str(tmp_path / 'photos.json'), str(tmp_path / 'albums'), on_open=gallery.open_album)
+    monkeypatch.setattr(gallery, 'partitions', partitions)
+    monkeypatch.setattr(gallery, 'store', partitions.default.store)
+    monkeypatch.setattr(gallery, 'search_index', partitions.default.search_index)
+    monkeypatch.setattr(gallery, 'similarity_index', partitions.default.similarity_index)
+    monkeypatch.setattr(gallery, 'columnar_stats', partitions.default.columnar_stats)
+    monkeypatch.setattr(gallery, 'STORAGE_BACKEND', 'local')
+    monkeypatch.setattr(gallery, 'LOCAL_STORAGE_DIR', str(tmp_path / 'uploads'))
+    monkeypatch.setattr(gallery, 'storage_providers', {})
+    monkeypatch.setattr(gallery, 'blob_cache', BlobCache(str(tmp_path / 'cache'), 64 * 1024 * 1024))
+    for worker in (gallery.enricher, gallery.reconciler):
+        monkeypatch.setattr(worker, 'start', lambda: None)
+    monkeypatch.setattr(gallery.enricher, 'queue', OrderedDict())
+    monkeypatch.setattr(gallery.reconciler, 'path', str(tmp_path / 'tombstones.json'))
+    monkeypatch.setattr(gallery.upload_limiter, 'backend', MemoryBackend())
+    monkeypatch.setattr(gallery.upload_limiter, 'counters', dict.fromkeys(gallery.upload_limiter.counters, 0))
+    return gallery
+
+
+@pytest.fixture
+def client(gallery):
+    return gallery.create_app().test_client()
+
+
+def upload(client, *files, album=None):
+    """POST ``(name, bytes)`` pairs to /upload, or an album's upload route"""
+    data = {'files': [(BytesIO(content), name) for name, content in files]}
+    url = f'/albums/{album}/upload' if album else '/upload'
+    return client.post(url, data=data, content_type='multipart/form-data')
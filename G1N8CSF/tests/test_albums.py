@@ -0,0 +1,39 @@
+from conftest import png, upload
+
+
+def albums(client):
+    return client.get('/albums').get_json()['albums']
+
+
+def test_album_routes_see_only_their_own_photos(gallery, client):
+    assert upload(client, ('a.png', png('red')), album='trip').status_code == 200
+    upload(client, ('b.png', png('blue')))
+
+    assert albums(client) == ['trip']
+    [photo] = client.get('/albums/trip/photos').get_json()
+    assert (photo['filename'], photo['album']) == ('a.png', 'trip')
+    assert [p['filename'] for p in client.get('/photos').get_json()] == ['b.png']
+
+    assert client.get(f"/albums/trip/download/{photo['id']}").data == png('red')
+    assert client.get(f"/download/{photo['id']}").status_code == 404
+    assert client.delete(f"/albums/trip/delete/{photo['id']}").status_code == 200
+    assert client.get('/albums/trip/photos').get_json() == []
+    assert len(client.get('/photos').get_json()) == 1
+
+
+def test_unknown_or_invalid_albums(client):
+    assert client.get('/albums/nowhere/photos').status_code == 404
+    assert client.get('/albums/nowhere/download/a').status_code == 404
+    assert client.delete('/albums/nowhere/delete/a').status_code == 404
+    assert client.post('/albums/nowhere/delete/batch', json={'ids': ['a']}).status_code == 404
+    assert upload(client, ('a.png', png('red')), album='Not Valid').status_code == 400
+    assert albums(client) == []
+
+
+def test_failed_upload_leaves_no_album_behind(gallery, client, tmp_path):
+    assert upload(client, ('notes.txt', b'text'), album='trip').status_code == 400
+    assert client.post('/albums/empty/upload', data={}, content_type='multipart/form-data').status_code == 400
+
+    assert albums(client) == []
+    assert client.get('/albums/trip/photos').status_code == 404
+    assert not (tmp_path / 'albums').exists() or list((tmp_path / 'albums').iterdir()) == []
@@ -0,0 +1,76 @@
+import os
+import time
+import threading
+from io import BytesIO
+
+from blob_cache import BlobCache
+
+
+def test_concurrent_misses_share_one_upstream_fetch(tmp_path):
+    cache = BlobCache(str(tmp_path), max_bytes=1024)
+    release = threading.Event()
+    opened = []
+
+    def opener():
+        opened.append(1)
+        release.wait(5)
+        return BytesIO(b'x' * 100)
+
+    paths = []
+    threads = [threading.Thread(target=lambda: paths.append(cache.fetch('photo', opener))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    # Let every caller reach the cache before the first fetch finishes
+    deadline = time.time() + 5
+    while cache.stats()['coalesced'] + cache.stats()['misses'] < 5 and time.time() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(opened) == 1
+    assert len(set(paths)) == 1 and paths[0] is not None
+    stats = cache.stats()
+    assert (stats['misses'], stats['coalesced']) == (1, 4)
+    assert cache.fetch('photo', opener) == paths[0]
+    assert len(opened) == 1
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = BlobCache(str(tmp_path), max_bytes=100)
+    for key in ('a', 'b', 'c'):
+        cache.fill(key, BytesIO(b'x' * 40))
+    # c pushed the total to 120, so a went
+    assert cache.get('a') is None
+    assert cache.get('b') is not None
+    cache.fill('d', BytesIO(b'x' * 40))
+
+    assert cache.get('c') is None
+    assert cache.get('b') is not None and cache.get('d') is not None
+    stats = cache.stats()
+    assert (stats['evictions'], stats['bytes']) == (2, 80)
+
+
+def test_blob_over_budget_is_not_cached(tmp_path):
+    cache = BlobCache(str(tmp_path), max_bytes=10)
+    assert cache.fill('big', BytesIO(b'x' * 11)) is None
+    assert cache.get('big') is None
+    assert not any(path.is_file() for path in tmp_path.rglob('*'))
+
+
+def test_lru_order_survives_a_restart(tmp_path):
+    cache = BlobCache(str(tmp_path), max_bytes=100)
+    cache.fill('a', BytesIO(b'x' * 40))
+    cache.fill('b', BytesIO(b'x' * 40))
+    # As if b was last read long ago; file mtimes are what carry the order over
+    os.utime(cache.path_for('b'), (1, 1))
+
+    restarted = BlobCache(str(tmp_path), max_bytes=100)
+    restarted.fill('c', BytesIO(b'x' * 40))
+    assert restarted.get('b') is None
+    assert restarted.get('a') is not None
+
+
+def test_relative_root_is_made_absolute(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert BlobCache('cache', max_bytes=10).root == str(tmp_path / 'cache')
@@ -0,0 +1,89 @@
+import os
+import threading
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from columnar import ColumnarStats  # noqa: E402
+from metadata_store import MetadataStore  # noqa: E402
+
+
+def photo(photo_id, size, year=2024, month=1, make='Sony', model='A7', fmt='JPEG'):
+    return {'id': photo_id, 'size': size, 'year': year, 'month': month,
+            'camera_make': make, 'camera_model': model, 'format': fmt}
+
+
+def stats_for(tmp_path, records=(), **kwargs):
+    store = MetadataStore(str(tmp_path / 'photos.json'))
+    store.put(list(records))
+    stats = ColumnarStats(store, **kwargs)
+    store.attach(stats)
+    return store, stats
+
+
+def test_aggregates_and_filters(tmp_path):
+    store, stats = stats_for(tmp_path, [
+        photo('a', 100),
+        photo('b', 300, month=2, make='Canon', model='R5', fmt='PNG'),
+        photo('c', 200, year=2023, month=12),
+        {'id': 'legacy'},
+    ])
+    result = stats.query()
+    assert (result['photos'], result['bytes']) == (4, 600)
+    assert result['size']['max'] == 300
+    assert result['by_year'] == [{'year': 2023, 'photos': 1, 'bytes': 200}, {'year': 2024, 'photos': 2, 'bytes': 400}]
+    assert result['by_camera'][0] == {'camera_make': 'Sony', 'camera_model': 'A7', 'photos': 2, 'bytes': 300}
+    assert {f['format']: f['photos'] for f in result['by_format']} == {'JPEG': 2, 'PNG': 1, None: 1}
+
+    result = stats.query({'camera_make': 'sony', 'year': 2024})
+    assert (result['photos'], result['bytes']) == (1, 100)
+
+
+def test_commits_are_masked_then_flushed_to_a_new_generation(tmp_path):
+    store, stats = stats_for(tmp_path, [photo(str(i), 10) for i in range(8)], flush_min_rows=2)
+    stats.query()
+    first = stats.generation
+
+    store.update('0', {'size': 1000, 'camera_make': 'Leica'})
+    result = stats.query()
+    assert (result['photos'], result['bytes']) == (8, 1070)
+    assert stats.generation == first
+
+    store.remove(['1'])
+    result = stats.query()
+    assert (result['photos'], result['bytes']) == (7, 1060)
+    assert stats.generation == first + 1
+    assert {c['camera_make'] for c in result['by_camera']} == {'Sony', 'Leica'}
+    # Only the current generation and the manifest are left, and no temp files
+    assert sorted(os.listdir(stats.directory)) == sorted(
+        [f'{name}.{stats.generation}.npy' for name in stats.columns] + [f'ids.{stats.generation}.json', 'manifest.json']
+    )
+
+
+def test_another_reader_maps_the_written_generation(tmp_path):
+    store, stats = stats_for(tmp_path, [photo('a', 100), photo('b', 200)])
+    stats.query()
+
+    reader = ColumnarStats(MetadataStore(store.path))
+    reader.store.attach(reader)
+    reader._write = None  # mapping the manifest's generation must be enough
+    assert reader.query()['bytes'] == 300
+    assert reader.generation == stats.generation
+
+
+def test_commits_do_not_wait_for_a_generation_to_be_written(tmp_path):
+    store, stats = stats_for(tmp_path, [photo('a', 100), photo('b', 200)])
+    write = stats._write
+
+    def write_while_committing(*args):
+        committer = threading.Thread(target=lambda: (store.put([photo('c', 400)]), store.remove(['a'])))
+        committer.start()
+        committer.join(5)
+        assert not committer.is_alive()
+        return write(*args)
+    stats._write = write_while_committing
+
+    result = stats.query()
+    assert (result['photos'], result['bytes']) == (2, 600)
+    assert stats.query()['bytes'] == 600
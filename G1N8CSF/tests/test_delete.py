@@ -0,0 +1,94 @@
+import os
+import threading
+
+from conftest import png, upload
+
+
+def stored_path(gallery, record):
+    return gallery.get_storage('local').local_path(record)
+
+
+def test_delete_removes_the_stored_copy_once_reconciled(gallery, client):
+    upload(client, ('a.png', png('red')))
+    [record] = gallery.store.all()
+
+    assert client.delete(f"/delete/{record['id']}").status_code == 200
+    assert gallery.store.all() == []
+    gallery.reconciler.drain()
+    assert not os.path.exists(stored_path(gallery, record))
+    assert client.delete(f"/delete/{record['id']}").status_code == 404
+
+
+def test_record_stays_if_its_tombstone_cannot_be_written(gallery, client, monkeypatch):
+    upload(client, ('a.png', png('red')))
+    [record] = gallery.store.all()
+
+    def enqueue(records):
+        raise OSError('disk full')
+    monkeypatch.setattr(gallery.reconciler, 'enqueue', enqueue)
+    assert client.delete(f"/delete/{record['id']}").status_code == 500
+    assert gallery.store.get(record['id']) == record
+
+
+def test_tombstone_of_a_rolled_back_delete_keeps_the_bytes(gallery, client):
+    upload(client, ('a.png', png('red')))
+    [record] = gallery.store.all()
+
+    try:
+        with gallery.store.transaction():
+            removed = gallery.store.remove([record['id']])
+            gallery.reconciler.enqueue(list(gallery.stored_objects(removed)))
+            raise RuntimeError('commit failed')
+    except RuntimeError:
+        pass
+    gallery.reconciler.drain()
+
+    assert gallery.store.get(record['id']) == record
+    assert os.path.exists(stored_path(gallery, record))
+    assert gallery.reconciler.status()['pending'] == 0
+
+
+def test_admin_sweep_runs_one_at_a_time(gallery, client, monkeypatch):
+    monkeypatch.setattr(gallery, 'ADMIN_TOKEN', 'secret')
+    release = threading.Event()
+    monkeypatch.setattr(gallery.reconciler, 'check_remote', lambda record: release.wait(5))
+    upload(client, ('a.png', png('red')))
+    headers = {'X-Admin-Token': 'secret'}
+
+    assert client.post('/admin/reconcile', headers=headers).status_code == 202
+    assert client.post('/admin/reconcile', headers=headers).status_code == 409
+    release.set()
+    gallery.reconciler.sweep_thread.join(5)
+    assert client.get('/admin/reconcile', headers=headers).get_json()['last_sweep']['checked'] == 1
+
+
+def test_batch_delete_by_ids_reports_each_one(gallery, client):
+    upload(client, ('a.png', png('red')), ('b.png', png('blue')))
+    first, second = gallery.store.all()
+
+    response = client.post('/delete/batch', json={'ids': [first['id'], 'missing']})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert (body['deleted'], body['not_found']) == (1, 1)
+    assert body['results'] == {first['id']: 'deleted', 'missing': 'not_found'}
+    assert [record['id'] for record in gallery.store.all()] == [second['id']]
+    assert gallery.reconciler.status()['pending'] == 1
+
+
+def test_batch_delete_by_filter(gallery, client):
+    upload(client, ('a.png', png('red')), ('b.png', png('blue')), ('c.png', png('green')))
+    records = gallery.store.all()
+    for record in records[:2]:
+        gallery.store.update(record['id'], {'camera_make': 'Sony'})
+
+    response = client.post('/delete/batch', json={'filter': {'camera_make': 'sony', 'year': str(records[0]['year'])}})
+    assert response.get_json()['deleted'] == 2
+    assert [record['id'] for record in gallery.store.all()] == [records[2]['id']]
+
+
+def test_batch_delete_rejects_bad_requests(client):
+    assert client.post('/delete/batch', json={}).status_code == 400
+    assert client.post('/delete/batch', json={'ids': ['a'], 'filter': {'year': 2024}}).status_code == 400
+    assert client.post('/delete/batch', json={'ids': 'a'}).status_code == 400
+    assert client.post('/delete/batch', json={'filter': {'iso': 100}}).status_code == 400
+    assert client.post('/delete/batch', json={'filter': {'year': 'last'}}).status_code == 400
@@ -0,0 +1,50 @@
+from io import BytesIO
+
+from conftest import png, upload
+
+
+def uploaded(gallery, client, content):
+    upload(client, ('a.png', content))
+    [record] = gallery.store.all()
+    return record
+
+
+def test_download_serves_ranges_and_revalidation(gallery, client):
+    content = png('red')
+    record = uploaded(gallery, client, content)
+
+    response = client.get(f"/download/{record['id']}")
+    assert response.status_code == 200 and response.data == content
+    assert response.headers['Content-Disposition'] == 'attachment; filename=a.png'
+    assert response.headers['ETag'] == f'"{record["sha256"]}"'
+
+    response = client.get(f"/download/{record['id']}", headers={'Range': 'bytes=0-9'})
+    assert response.status_code == 206 and response.data == content[:10]
+    assert response.headers['Content-Range'] == f'bytes 0-9/{len(content)}'
+
+    response = client.get(f"/download/{record['id']}", headers={'If-None-Match': f'"{record["sha256"]}"'})
+    assert response.status_code == 304 and response.data == b''
+    assert client.get('/download/missing').status_code == 404
+
+
+def test_remote_original_is_fetched_once_into_the_cache(gallery, client, monkeypatch):
+    content = png('blue')
+    record = uploaded(gallery, client, content)
+    storage = gallery.get_storage('local')
+    opened = []
+
+    def open_remote(record):
+        opened.append(record['id'])
+        return BytesIO(content)
+    # As if the original lived on a remote provider
+    monkeypatch.setattr(storage, 'local_path', lambda record: None)
+    monkeypatch.setattr(storage, 'open', open_remote)
+
+    assert client.get(f"/download/{record['id']}").data == content
+    response = client.get(f"/download/{record['id']}", headers={'Range': 'bytes=10-'})
+    assert response.status_code == 206 and response.data == content[10:]
+    # Revalidation is answered without touching storage or the cache
+    response = client.get(f"/download/{record['id']}", headers={'If-None-Match': f'"{record["sha256"]}"'})
+    assert response.status_code == 304
+    assert opened == [record['id']]
+    assert gallery.blob_cache.stats()['hits'] == 1
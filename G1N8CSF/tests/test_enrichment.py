@@ -0,0 +1,93 @@
+from io import BytesIO
+
+import pytest
+
+from enrichment import Enricher
+
+
+@pytest.fixture(autouse=True)
+def no_worker_thread(monkeypatch):
+    # The tests drive every batch themselves
+    monkeypatch.setattr(Enricher, 'wake', lambda self: None)
+
+
+class Library:
+    """Records by id, with an original for each id in ``originals``"""
+
+    def __init__(self, records, originals):
+        self.records = {record['id']: record for record in records}
+        self.originals = originals
+
+    def open_original(self, record):
+        content = self.originals.get(record['id'])
+        return None if content is None else BytesIO(content)
+
+    def apply(self, photo_id, fields):
+        self.records[photo_id] = {**self.records[photo_id], **fields}
+
+
+def extract(stream, record):
+    content = stream.read()
+    if not content.startswith(b'IMG'):
+        raise ValueError('Not a recognised image format')
+    return {'width': len(content), 'height': 1, 'format': 'IMG'}
+
+
+def enricher(library, **kwargs):
+    return Enricher(
+        library.open_original,
+        extract=extract,
+        load_records=lambda: list(library.records.values()),
+        get_record=library.records.get,
+        apply=library.apply,
+        **kwargs
+    )
+
+
+def test_outcomes_are_applied_and_counted():
+    library = Library(
+        [{'id': 'ok', 'enriched': False}, {'id': 'bad', 'enriched': False}, {'id': 'gone', 'enriched': False}],
+        {'ok': b'IMG-1234', 'bad': b'text'},
+    )
+    worker = enricher(library, batch_size=2)
+    worker.enqueue(['ok', 'bad', 'gone', 'deleted'])
+    assert worker.run_once() == 2
+    worker.drain()
+
+    assert library.records['ok'] == {'id': 'ok', 'enriched': True, 'enrich_error': None,
+                                     'width': 8, 'height': 1, 'format': 'IMG'}
+    assert library.records['bad'] == {'id': 'bad', 'enriched': True, 'enrich_error': 'Not a recognised image format'}
+    # An original that can't be fetched stays pending for a later backfill
+    assert library.records['gone'] == {'id': 'gone', 'enriched': False}
+    status = worker.status()
+    assert (status['queued'], status['enriched'], status['unreadable'], status['unavailable']) == (0, 1, 1, 1)
+    assert status['last_error'] == 'bad: Not a recognised image format'
+
+
+def test_backfill_picks_pending_and_incomplete_records():
+    library = Library([
+        {'id': 'pending', 'enriched': False},
+        {'id': 'done', 'enriched': True, 'width': 1, 'height': 1, 'format': 'IMG'},
+        {'id': 'legacy', 'width': 1},
+        {'id': 'unreadable', 'enriched': True, 'enrich_error': 'Not a recognised image format'},
+        {'id': 'no-phash', 'enriched': True, 'width': 1, 'height': 1, 'format': 'IMG'},
+    ], {})
+    worker = enricher(library)
+
+    assert worker.backfill() == 2
+    assert list(worker.queue) == ['pending', 'legacy']
+    worker.queue.clear()
+    assert worker.backfill(fields=['phash'], limit=3) == 3
+    assert list(worker.queue) == ['pending', 'done', 'legacy']
+    assert worker.backfill(force=True) == 5
+
+
+def test_queued_key_is_only_enriched_once():
+    library = Library([{'id': 'a', 'enriched': False}], {'a': b'IMG'})
+    opened = []
+    worker = enricher(library)
+    worker.open_original = lambda record: opened.append(record['id']) or BytesIO(b'IMG')
+    worker.enqueue(['a'])
+    worker.enqueue(['a'])
+    worker.drain()
+    assert opened == ['a']
@@ -0,0 +1,139 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import metadata_store
+from metadata_store import MetadataStore
+from search_index import PhotoIndex
+from conftest import APP_DIR
+
+
+def ids(store):
+    return sorted(record['id'] for record in store.all())
+
+
+def test_commits_survive_a_reload(tmp_path):
+    path = str(tmp_path / 'photos.json')
+    store = MetadataStore(path)
+    store.put([{'id': 'a'}, {'id': 'b'}])
+    store.update('a', {'width': 640})
+    assert [r['id'] for r in store.remove(['b', 'missing'])] == ['b']
+
+    reloaded = MetadataStore(path)
+    assert ids(reloaded) == ['a']
+    assert reloaded.get('a')['width'] == 640
+
+
+def test_torn_journal_tail_is_cut_before_the_next_append(tmp_path):
+    path = str(tmp_path / 'photos.json')
+    MetadataStore(path).put([{'id': 'a'}])
+    with open(f'{path}.journal', 'a') as f:
+        f.write('{"op": "put", "record": {"id": "b"')
+
+    store = MetadataStore(path)
+    assert ids(store) == ['a']
+    store.put([{'id': 'c'}])
+    assert ids(MetadataStore(path)) == ['a', 'c']
+
+
+def test_journal_folds_into_the_snapshot(tmp_path):
+    path = str(tmp_path / 'photos.json')
+    store = MetadataStore(path, compact_min_ops=4)
+    store.put([{'id': 'a'}, {'id': 'b'}])
+    for width in range(10):
+        store.update('a', {'width': width})
+
+    with open(path) as f:
+        assert sorted(record['id'] for record in json.load(f)) == ['a', 'b']
+    assert store.journal_ops <= 4
+    assert MetadataStore(path).get('a')['width'] == 9
+
+
+def test_reloads_when_another_store_writes(tmp_path):
+    path = str(tmp_path / 'photos.json')
+    first, second = MetadataStore(path), MetadataStore(path)
+    first.put([{'id': 'a'}])
+    assert ids(second) == ['a']
+    second.put([{'id': 'b'}])
+    first.put([{'id': 'c'}])
+    assert ids(second) == ['a', 'b', 'c']
+
+
+def test_attached_index_follows_commits_and_reloads(tmp_path):
+    path = str(tmp_path / 'photos.json')
+    store = MetadataStore(path)
+    index = PhotoIndex()
+    store.attach(index)
+    store.put([{'id': 'a', 'camera_make': 'Sony', 'iso': 200}, {'id': 'b', 'camera_make': 'Canon', 'iso': 800}])
+    assert set(index.match(text='sony')) == {'a'}
+
+    store.remove(['a'])
+    assert set(index.match(ranges={'iso': (100, 1000)})) == {'b'}
+
+    MetadataStore(path).put([{'id': 'c', 'camera_make': 'Sony'}])
+    store.refresh()
+    assert set(index.match(text='sony')) == {'c'}
+
+
+class CountingIndex:
+    def __init__(self):
+        self.builds = 0
+        self.ids = set()
+
+    def build(self, records):
+        self.builds += 1
+        self.ids = {record['id'] for record in records}
+
+    def add(self, record):
+        self.ids.add(record['id'])
+
+    def remove(self, photo_id):
+        self.ids.discard(photo_id)
+
+
+def test_another_stores_appends_are_replayed_without_a_rebuild(tmp_path):
+    path = str(tmp_path / 'photos.json')
+    store, other = MetadataStore(path), MetadataStore(path)
+    index = CountingIndex()
+    store.attach(index)
+    store.put([{'id': 'a'}, {'id': 'b'}])
+    assert index.builds == 1
+
+    other.put([{'id': 'c'}])
+    other.remove(['a'])
+    store.refresh()
+    assert index.ids == {'b', 'c'} and ids(store) == ['b', 'c']
+    assert index.builds == 1
+
+    # A new snapshot can't be replayed onto the old one
+    other.compact_min_ops = 0
+    other.put([{'id': 'd'}])
+    store.refresh()
+    assert index.ids == {'b', 'c', 'd'}
+    assert index.builds == 2
+
+
+WRITER = '''
+import sys
+from metadata_store import MetadataStore
+store = MetadataStore(sys.argv[1], compact_min_ops=16)
+for i in range(int(sys.argv[3])):
+    store.put([{"id": f"{sys.argv[2]}-{i}"}])
+'''
+
+
+@pytest.mark.skipif(metadata_store.fcntl is None, reason='needs fcntl')
+def test_processes_writing_at_once_lose_nothing(tmp_path):
+    path = str(tmp_path / 'photos.json')
+    writers = [
+        subprocess.Popen([sys.executable, '-c', WRITER, path, name, '100'], cwd=APP_DIR)
+        for name in ('x', 'y', 'z')
+    ]
+    for writer in writers:
+        assert writer.wait(timeout=60) == 0
+
+    assert len(MetadataStore(path).all()) == 300
+    assert not os.path.exists(f'{path}.tmp')
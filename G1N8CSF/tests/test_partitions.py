@@ -0,0 +1,38 @@
+import json
+
+from partitions import Partitions
+
+
+def test_references_count_records_and_variants_across_albums(tmp_path):
+    partitions = Partitions(str(tmp_path / 'photos.json'), str(tmp_path / 'albums'))
+    album = partitions.get('trip', create=True)
+    count = partitions.references.count
+
+    partitions.default.store.put([{
+        'id': 'a', 'storage_key': 'k1', 'sha256': 'h1',
+        'variants': [{'label': 'small', 'storage_key': 'k2', 'sha256': 'h2'}]
+    }])
+    album.store.put([{'id': 'b', 'storage_key': 'k1', 'sha256': 'h1'}])
+    assert (count('storage_key', 'k1'), count('sha256', 'h1'), count('storage_key', 'k2')) == (2, 2, 1)
+
+    partitions.default.store.remove(['a'])
+    assert (count('storage_key', 'k1'), count('storage_key', 'k2')) == (1, 0)
+
+    # A reload swaps out only the reloading album's share
+    partitions.default.store.put([{'id': 'c', 'storage_key': 'k3'}])
+    with open(album.store.journal_path, 'a') as f:
+        f.write(json.dumps({'op': 'del', 'id': 'b'}) + '\n')
+    album.store.refresh()
+    assert partitions.references.counts == {('storage_key', 'k3'): 1}
+
+
+def test_albums_are_found_on_disk(tmp_path):
+    partitions = Partitions(str(tmp_path / 'photos.json'), str(tmp_path / 'albums'))
+    assert partitions.get('trip') is None
+    assert partitions.get('../etc', create=True) is None
+    partitions.get('trip', create=True).store.put([{'id': 'a'}])
+
+    reopened = Partitions(str(tmp_path / 'photos.json'), str(tmp_path / 'albums'))
+    assert reopened.names() == ['trip']
+    assert [p.name for p in reopened.all()] == [None, 'trip']
+    assert reopened.get('trip').store.get('a') == {'id': 'a'}
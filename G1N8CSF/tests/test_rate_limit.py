@@ -0,0 +1,128 @@
+import time
+
+import pytest
+from flask import Flask
+
+from conftest import png, upload
+
+from rate_limit import MemoryBackend, SQLiteBackend, UploadLimiter
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBackend()
+    return SQLiteBackend(str(tmp_path / 'limits.db'))
+
+
+def limited_client(limiter):
+    app = Flask(__name__)
+
+    @app.route('/upload', methods=['POST'])
+    @limiter.limit
+    def upload():
+        return 'ok'
+
+    @app.route('/client')
+    def client():
+        return limiter.client_key()
+
+    return app.test_client()
+
+
+def test_bucket_admits_a_burst_then_rejects(backend):
+    limiter = UploadLimiter(backend, rate=0.01, burst=3, max_concurrent=5, max_inflight=5)
+    client = limited_client(limiter)
+
+    codes = [client.post('/upload').status_code for _ in range(4)]
+    assert codes == [200, 200, 200, 429]
+    assert int(client.post('/upload').headers['Retry-After']) >= 1
+    assert limiter.status()['admitted'] == 3
+
+
+def test_busy_rejections_spend_no_tokens(backend):
+    limiter = UploadLimiter(backend, rate=0.01, burst=2, max_concurrent=1, max_inflight=5)
+    client = limited_client(limiter)
+
+    held = backend.acquire('client:127.0.0.1', 1, 300)
+    assert [client.post('/upload').status_code for _ in range(5)] == [429] * 5
+    backend.release('client:127.0.0.1', held)
+
+    # The whole burst is still there
+    assert [client.post('/upload').status_code for _ in range(3)] == [200, 200, 429]
+    assert limiter.status() == {'admitted': 2, 'rate_limited': 1, 'client_busy': 5, 'server_busy': 0}
+
+
+def test_server_wide_limit(backend):
+    limiter = UploadLimiter(backend, rate=100, burst=100, max_concurrent=5, max_inflight=1)
+    client = limited_client(limiter)
+
+    held = backend.acquire('server', 1, 300)
+    assert client.post('/upload').status_code == 429
+    assert limiter.status()['server_busy'] == 1
+    backend.release('server', held)
+    assert client.post('/upload').status_code == 200
+
+
+def test_zero_rate_turns_the_bucket_off(backend):
+    limiter = UploadLimiter(backend, rate=0, burst=1, max_concurrent=5, max_inflight=5)
+    client = limited_client(limiter)
+
+    assert [client.post('/upload').status_code for _ in range(5)] == [200] * 5
+    assert backend.take('rate:x', 0, 1, 1) == 0
+    assert backend.take('rate:x', 0, 1, 1) == float('inf')
+
+
+def test_leases_expire(backend):
+    assert backend.acquire('client:a', 1, ttl=-1) is not None
+    assert backend.acquire('client:a', 1, ttl=300) is not None
+    assert backend.acquire('client:a', 1, ttl=300) is None
+
+
+@pytest.mark.parametrize('trust_proxy, forwarded, expected', [
+    (0, '1.1.1.1, 2.2.2.2', '127.0.0.1'),
+    # The client wrote 6.6.6.6 itself; the one proxy appended the address it saw
+    (1, '6.6.6.6, 2.2.2.2', '2.2.2.2'),
+    (2, '6.6.6.6, 1.1.1.1, 2.2.2.2', '1.1.1.1'),
+    # Fewer entries than proxies: something didn't come through them, so don't believe any
+    (2, '2.2.2.2', '127.0.0.1'),
+    (1, '', '127.0.0.1'),
+])
+def test_client_is_the_address_the_trusted_proxies_saw(trust_proxy, forwarded, expected):
+    limiter = UploadLimiter(MemoryBackend(), rate=1, burst=1, max_concurrent=1, max_inflight=1, trust_proxy=trust_proxy)
+    client = limited_client(limiter)
+    assert client.get('/client', headers={'X-Forwarded-For': forwarded}).get_data(as_text=True) == expected
+
+
+def test_refilled_buckets_and_lapsed_leases_are_pruned(backend):
+    backend.prune_interval = backend.next_prune = 0
+    assert backend.take('rate:idle', rate=1000, burst=1) == 0
+    assert backend.take('rate:drained', rate=0.001, burst=10, cost=10) == 0
+    backend.acquire('client:gone', 1, ttl=-1)
+    held = backend.acquire('client:busy', 1, ttl=300)
+
+    # The idle bucket refilled within a millisecond; the drained one needs hours
+    time.sleep(0.01)
+    backend.take('rate:other', rate=1, burst=1)
+    if isinstance(backend, MemoryBackend):
+        assert set(backend.buckets) == {'rate:drained', 'rate:other'}
+        assert set(backend.leases) == {'client:busy'}
+    else:
+        with backend._connect() as db:
+            assert {key for key, in db.execute('SELECT key FROM buckets')} == {'rate:drained', 'rate:other'}
+            assert {key for key, in db.execute('SELECT key FROM leases')} == {'client:busy'}
+    # Forgetting a bucket changes nothing: it comes back full
+    assert backend.take('rate:idle', rate=1000, burst=1) == 0
+    backend.release('client:busy', held)
+
+
+def test_upload_route_answers_429_with_retry_after(gallery, client, monkeypatch):
+    monkeypatch.setattr(gallery.upload_limiter, 'rate', 0.001)
+    monkeypatch.setattr(gallery.upload_limiter, 'burst', 2)
+
+    assert [upload(client, (f'{i}.png', png('red'))).status_code for i in range(3)] == [200, 200, 429]
+    response = upload(client, ('3.png', png('red')))
+    assert response.status_code == 429 and int(response.headers['Retry-After']) > 1
+    assert response.get_json()['success'] is False
+    assert len(gallery.store.all()) == 2
+    assert gallery.upload_limiter.status()['rate_limited'] == 2
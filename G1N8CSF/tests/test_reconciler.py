@@ -0,0 +1,184 @@
+import os
+import sys
+import time
+import threading
+import subprocess
+
+import pytest
+
+import reconciler as reconciler_module
+from reconciler import Reconciler
+from conftest import APP_DIR
+
+
+@pytest.fixture(autouse=True)
+def no_worker_thread(monkeypatch):
+    # The tests drive every batch themselves
+    monkeypatch.setattr(Reconciler, 'wake', lambda self: None)
+
+
+class Remote:
+    """delete_remote that fails the first ``failures`` calls for each id"""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = {}
+
+    def __call__(self, tombstone):
+        calls = self.calls[tombstone['id']] = self.calls.get(tombstone['id'], 0) + 1
+        if calls <= self.failures:
+            return False, 'HTTP 500'
+        return True, None
+
+
+def reconciler(tmp_path, remote, **kwargs):
+    return Reconciler(
+        str(tmp_path / 'tombstones.json'),
+        delete_remote=remote,
+        check_remote=lambda record: None,
+        load_records=list,
+        mark_out_of_sync=lambda keys: None,
+        rate=0,
+        **kwargs
+    )
+
+
+def make_due(worker):
+    tombstones = worker._load()
+    for tombstone in tombstones:
+        tombstone['next_attempt'] = 0
+    worker._save(tombstones)
+
+
+def test_retries_with_exponential_backoff(tmp_path):
+    remote = Remote(failures=2)
+    worker = reconciler(tmp_path, remote, backoff=30, max_attempts=5)
+    worker.enqueue([{'id': 'a'}])
+
+    before = time.time()
+    worker.drain()
+    [tombstone] = worker._load()
+    assert (tombstone['attempts'], tombstone['last_error']) == (1, 'HTTP 500')
+    assert tombstone['next_attempt'] >= before + 30
+    # Not due yet, so nothing to do
+    assert worker.run_once() == 0
+
+    make_due(worker)
+    before = time.time()
+    worker.drain()
+    [tombstone] = worker._load()
+    assert tombstone['attempts'] == 2
+    assert tombstone['next_attempt'] >= before + 60
+
+    make_due(worker)
+    worker.drain()
+    assert worker._load() == []
+    assert remote.calls == {'a': 3}
+
+
+def test_gives_up_after_max_attempts(tmp_path):
+    worker = reconciler(tmp_path, Remote(failures=10), backoff=0, max_attempts=3)
+    worker.enqueue([{'id': 'a'}, {'id': 'b'}])
+    worker.drain()
+
+    status = worker.status()
+    assert (status['pending'], status['failed']) == (0, 2)
+    assert sorted(status['failed_ids']) == ['a', 'b']
+
+
+def test_failed_tombstones_are_capped(tmp_path):
+    worker = reconciler(tmp_path, Remote(failures=10), backoff=0, max_attempts=1, max_failed=2)
+    for photo_id in ('a', 'b', 'c', 'd'):
+        worker.enqueue([{'id': photo_id}])
+        worker.drain()
+
+    status = worker.status()
+    assert status['failed_ids'] == ['c', 'd']
+    assert status['failed_dropped'] == 2
+
+
+def test_exceptions_count_as_failures(tmp_path):
+    def broken(tombstone):
+        raise ConnectionError('refused')
+
+    worker = reconciler(tmp_path, broken, backoff=0, max_attempts=2)
+    worker.enqueue([{'id': 'a'}])
+    worker.drain()
+    [tombstone] = worker._load()
+    assert (tombstone['status'], tombstone['last_error']) == ('failed', 'refused')
+
+
+def test_sweep_reports_missing_records(tmp_path):
+    flagged = []
+    records = [{'id': 'a', 'gone': False}, {'id': 'b', 'gone': True}, {'id': 'c'}]
+    worker = Reconciler(
+        str(tmp_path / 'tombstones.json'),
+        delete_remote=Remote(),
+        check_remote=lambda record: None if 'gone' not in record else not record['gone'],
+        load_records=lambda: records,
+        mark_out_of_sync=flagged.extend,
+        rate=0,
+    )
+    result = worker.sweep()
+    assert flagged == ['b']
+    assert (result['checked'], result['unknown']) == (3, 1)
+
+
+def test_deletes_run_while_a_sweep_is_in_progress(tmp_path):
+    checking = threading.Event()
+    release = threading.Event()
+
+    def check_remote(record):
+        checking.set()
+        release.wait(5)
+        return True
+
+    remote = Remote()
+    worker = Reconciler(
+        str(tmp_path / 'tombstones.json'),
+        delete_remote=remote,
+        check_remote=check_remote,
+        load_records=lambda: [{'id': 'live'}],
+        mark_out_of_sync=lambda keys: None,
+        rate=0,
+    )
+    assert worker.start_sweep()
+    assert checking.wait(5)
+    assert not worker.start_sweep()
+
+    worker.enqueue([{'id': 'a'}])
+    worker.drain()
+    assert remote.calls == {'a': 1}
+    assert worker._load() == []
+
+    release.set()
+    worker.sweep_thread.join(5)
+    assert worker.status()['last_sweep']['checked'] == 1
+    assert worker.start_sweep()
+    worker.sweep_thread.join(5)
+
+
+ENQUEUER = '''
+import sys
+from reconciler import Reconciler
+worker = Reconciler(sys.argv[1], None, None, list, None, rate=0)
+worker.wake = lambda: None
+for i in range(int(sys.argv[3])):
+    worker.enqueue([{"id": f"{sys.argv[2]}-{i}"}])
+'''
+
+
+@pytest.mark.skipif(reconciler_module.fcntl is None, reason='needs fcntl')
+def test_processes_enqueueing_at_once_keep_every_tombstone(tmp_path):
+    path = str(tmp_path / 'tombstones.json')
+    writers = [
+        subprocess.Popen([sys.executable, '-c', ENQUEUER, path, name, '50'], cwd=APP_DIR)
+        for name in ('w', 'x', 'y', 'z')
+    ]
+    for writer in writers:
+        assert writer.wait(timeout=60) == 0
+
+    worker = reconciler(tmp_path, Remote())
+    assert len(worker._load()) == 200
+    # Each save went through its own temp file, and none was left behind
+    assert sorted(os.listdir(tmp_path)) == ['tombstones.json', 'tombstones.json.lock']
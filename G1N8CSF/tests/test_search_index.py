@@ -0,0 +1,83 @@
+import random
+
+import pytest
+
+from search_index import PhotoIndex, numeric_value, tokenize
+
+MAKES = ('Sony', 'Canon', 'Nikon', 'Fujifilm')
+
+
+def make_record(i, rng):
+    return {
+        'id': f'p{i}',
+        'filename': f'IMG_{i:04d}.jpg',
+        'camera_make': rng.choice(MAKES),
+        'iso': rng.choice((100, 200, 400, 800, 1600, 3200)),
+        'width': rng.choice((1280, 1920, 4000, 6000)),
+        # Nearly unique per record, as in a real library
+        'size': rng.randrange(100_000, 10_000_000),
+        'timestamp': 1_600_000_000 + rng.randrange(0, 100_000_000),
+    }
+
+
+def brute_force(records, text=None, fields=None, ranges=None):
+    def matches(record):
+        for field, (low, high) in (ranges or {}).items():
+            value = numeric_value(record.get(field))
+            if value is None or (low is not None and value < low) or (high is not None and value > high):
+                return False
+        for field, query in (fields or {}).items():
+            tokens = tokenize(record.get(field) or '')
+            if not all(any(token.startswith(prefix) for token in tokens) for prefix in tokenize(query)):
+                return False
+        for prefix in tokenize(text or ''):
+            tokens = [token for field in ('filename', 'camera_make') for token in tokenize(record.get(field) or '')]
+            if not any(token.startswith(prefix) for token in tokens):
+                return False
+        return True
+    return {record['id'] for record in records.values() if matches(record)}
+
+
+@pytest.fixture
+def library():
+    rng = random.Random(0)
+    records = {record['id']: record for record in (make_record(i, rng) for i in range(3000))}
+    index = PhotoIndex()
+    index.build(list(records.values())[:2000])
+    for record in list(records.values())[2000:]:
+        index.add(record)
+    for photo_id in rng.sample(sorted(records), 800):
+        index.remove(photo_id)
+        del records[photo_id]
+    # Re-adding a record with changed values replaces every posting
+    for photo_id in rng.sample(sorted(records), 100):
+        records[photo_id] = {**records[photo_id], 'size': rng.randrange(100_000, 10_000_000), 'iso': 6400}
+        index.add(records[photo_id])
+    return index, records
+
+
+QUERIES = [
+    dict(ranges={'size': (None, 2_000_000)}),
+    dict(ranges={'size': (1_000_000, 9_000_000), 'iso': (200, 800)}),
+    dict(ranges={'iso': (400, 1600), 'width': (1920, None)}),
+    dict(fields={'camera_make': 'son'}, ranges={'timestamp': (1_650_000_000, None)}),
+    dict(text='img_00', ranges={'size': (None, 5_000_000), 'timestamp': (1_610_000_000, 1_620_000_000)}),
+    dict(ranges={'iso': (6400, 6400)}),
+    dict(ranges={'size': (5, 1)}),
+    dict(text='canon nik'),
+]
+
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_matches_a_full_scan(library, query):
+    index, records = library
+    assert set(index.match(**query)) == brute_force(records, **query)
+
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_pages_are_newest_first(library, query):
+    index, records = library
+    expected = sorted(brute_force(records, **query), key=lambda photo_id: records[photo_id]['timestamp'], reverse=True)
+    total, page = index.search(**query, limit=20, offset=5)
+    assert total == len(expected)
+    assert [record['id'] for record in page] == expected[5:25]
@@ -0,0 +1,47 @@
+import random
+
+from similarity import SimilarityIndex
+
+
+def flip(value, bits, rng):
+    for position in rng.sample(range(64), bits):
+        value ^= 1 << position
+    return value
+
+
+def brute_force(hashes, value, max_distance):
+    return sorted(
+        ((stored ^ value).bit_count(), photo_id)
+        for photo_id, stored in hashes.items()
+        if (stored ^ value).bit_count() <= max_distance
+    )
+
+
+def test_matches_a_full_scan():
+    rng = random.Random(0)
+    hashes = {}
+    for i in range(200):
+        base = rng.getrandbits(64)
+        hashes[f'p{i}'] = base
+        # Near-duplicates at every distance up to and past the radius
+        for j, bits in enumerate((1, 4, 8, 10, 11, 16)):
+            hashes[f'p{i}-{j}'] = flip(base, bits, rng)
+    index = SimilarityIndex()
+    index.build({'id': photo_id, 'phash': f'{value:016x}'} for photo_id, value in hashes.items())
+
+    for photo_id in rng.sample(sorted(hashes), 50):
+        found = index.search(f'{hashes[photo_id]:016x}', max_distance=10, limit=1000)
+        assert found == brute_force(hashes, hashes[photo_id], 10)
+
+
+def test_add_remove_and_exclude():
+    index = SimilarityIndex()
+    index.build([{'id': 'a', 'phash': '00000000000000ff'}, {'id': 'b', 'phash': 'not a hash'}])
+    index.add({'id': 'c', 'phash': '00000000000000fe'})
+
+    assert index.search('00000000000000ff', exclude='a') == [(1, 'c')]
+    index.add({'id': 'c', 'phash': 'ffffffffffffffff'})
+    assert index.search('00000000000000ff') == [(0, 'a')]
+    index.remove('a')
+    assert index.search('00000000000000ff') == []
+    assert index.search(None) == []
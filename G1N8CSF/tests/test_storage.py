@@ -0,0 +1,66 @@
+import hashlib
+from io import BytesIO
+
+from storage import ImgBBProvider, LocalProvider, S3Provider
+
+IMAGE = b'\x89PNG\r\n\x1a\n' + b'x' * 2048
+SHA256 = hashlib.sha256(IMAGE).hexdigest()
+
+
+def test_imgbb_put_then_delete_through_the_delete_page(fake_imgbb, http):
+    provider = ImgBBProvider('key', fake_imgbb.upload_url, http)
+    record, error = provider.put(BytesIO(IMAGE), len(IMAGE), 'a.png', SHA256)
+    assert error is None
+    assert provider.exists(record) is True
+    assert provider.open(record).read() == IMAGE
+
+    assert provider.delete(record) == (True, None)
+    assert provider.exists(record) is False
+    assert fake_imgbb.stats['deletes'] == 1
+    # Already gone counts as deleted
+    assert provider.delete(record) == (True, None)
+
+
+def test_imgbb_refuses_a_delete_without_the_page_token(fake_imgbb, http):
+    provider = ImgBBProvider('key', fake_imgbb.upload_url, http)
+    record, _ = provider.put(BytesIO(IMAGE), len(IMAGE), 'a.png', SHA256)
+    image_id, image_hash = record['delete_url'].rsplit('/', 2)[1:]
+
+    response = http.post(f'{fake_imgbb.base_url}/json', data={
+        'action': 'delete', 'delete': 'image', 'deleting[id]': image_id, 'deleting[hash]': image_hash
+    })
+    assert response.status_code == 400
+    assert provider.exists(record) is True
+
+
+def test_s3_round_trip(fake_s3, http):
+    provider = S3Provider(fake_s3.endpoint, 'gallery', fake_s3.access_key, fake_s3.secret_key, http)
+    record, error = provider.put(BytesIO(IMAGE), len(IMAGE), 'a.png', SHA256)
+    assert error is None
+    assert record['storage_key'] == f'{SHA256[:2]}/{SHA256}.png'
+    assert provider.exists(record) is True
+    assert provider.open(record).read() == IMAGE
+
+    assert provider.delete(record) == (True, None)
+    assert provider.exists(record) is False
+    assert provider.open(record) is None
+
+
+def test_s3_rejects_a_bad_signature(fake_s3, http):
+    provider = S3Provider(fake_s3.endpoint, 'gallery', fake_s3.access_key, 'wrong', http)
+    record, error = provider.put(BytesIO(IMAGE), len(IMAGE), 'a.png', SHA256)
+    assert record is None and '403' in error
+    assert fake_s3.stats['rejected'] == 1
+
+
+def test_local_round_trip(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    provider = LocalProvider('uploads')
+    record, error = provider.put(BytesIO(IMAGE), len(IMAGE), 'a.png', SHA256)
+    assert error is None
+    assert provider.local_path(record) == str(tmp_path / 'uploads' / SHA256[:2] / f'{SHA256}.png')
+    assert provider.open(record).read() == IMAGE
+
+    assert provider.delete(record) == (True, None)
+    assert provider.exists(record) is False
+    assert provider.delete({'storage_key': '../etc/passwd'})[0] is False
@@ -0,0 +1,114 @@
+import os
+from io import BytesIO
+
+import pytest
+from werkzeug.datastructures import MIMEAccept
+
+from transcode import transcode, choose_variant, variant_record, available_formats
+from conftest import png, upload
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def noise(size=(800, 600), fmt='PNG'):
+    """An image that doesn't compress, so every rendition comes out smaller"""
+    buffer = BytesIO()
+    Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3)).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def test_renditions_shrink_without_upscaling():
+    content = noise()
+    renditions = transcode(BytesIO(content), 'PNG', len(content), [200, 400, 1600], formats=('webp', 'jpeg'))
+
+    assert {(label, fmt) for label, fmt, *_ in renditions} == {
+        (label, fmt) for label in ('w200', 'w400', 'w800') for fmt in ('webp', 'jpeg')
+    }
+    for label, fmt, width, height, data in renditions:
+        assert width == int(label[1:]) and height == width * 3 // 4
+        assert len(data) <= len(content) * 0.9
+        with Image.open(BytesIO(data)) as img:
+            assert (img.format, img.size) == ({'webp': 'WEBP', 'jpeg': 'JPEG'}[fmt], (width, height))
+
+
+def test_rendition_that_saves_too_little_is_dropped():
+    content = noise((64, 48), 'JPEG')
+    assert transcode(BytesIO(content), 'JPEG', len(content), [64], formats=('jpeg',), min_saving=0.5) == []
+
+
+def variants():
+    return [
+        variant_record(f'w{width}', fmt, width, width, b'x' * size)
+        for width, fmt, size in ((480, 'jpeg', 40), (480, 'webp', 30), (480, 'avif', 20), (1600, 'jpeg', 400))
+    ]
+
+
+@pytest.mark.parametrize('accept, width, expected', [
+    ('image/avif,image/webp,*/*', 400, ('w480', 'avif')),
+    ('image/webp,image/*', 400, ('w480', 'webp')),
+    # Wildcards don't vouch for AVIF or WebP
+    ('image/*,*/*;q=0.8', 400, ('w480', 'jpeg')),
+    ('image/avif', 1000, ('w1600', 'jpeg')),
+    ('image/webp', 3000, ('w1600', 'jpeg')),
+    ('image/webp;q=0,*/*', 100, ('w480', 'jpeg')),
+    ('*/*', None, ('w1600', 'jpeg')),
+])
+def test_choose_variant(accept, width, expected):
+    accept = MIMEAccept([(value.split(';')[0], float(value.split('q=')[1]) if 'q=' in value else 1)
+                         for value in accept.split(',')])
+    variant = choose_variant(variants(), accept, width)
+    assert (variant['label'], variant['format']) == expected
+
+
+@pytest.fixture
+def transcoding(gallery, monkeypatch):
+    monkeypatch.setattr(gallery, 'TRANSCODE_ENABLED', True)
+    monkeypatch.setattr(gallery, 'TRANSCODE_WIDTHS', [200])
+    return gallery
+
+
+def test_image_route_redirects_to_the_best_rendition(transcoding, client):
+    upload(client, ('a.png', noise()))
+    transcoding.enricher.drain()
+    [record] = transcoding.store.all()
+    assert {variant['format'] for variant in record['variants']} == set(available_formats())
+    by_format = {variant['format']: variant for variant in record['variants']}
+
+    response = client.get(f"/photos/{record['id']}/image?w=200", headers={'Accept': 'image/webp,*/*'})
+    assert response.status_code == 302
+    # Fewest bytes among what the client named, which on noise isn't always WebP
+    assert response.headers['Location'] == min((by_format['webp'], by_format['jpeg']), key=lambda v: v['size'])['url']
+    assert response.headers['Vary'] == 'Accept'
+    response = client.get(f"/photos/{record['id']}/image", headers={'Accept': '*/*'})
+    assert response.headers['Location'] == by_format['jpeg']['url']
+    assert client.get(by_format['jpeg']['url']).status_code == 200
+    assert client.get(f"/photos/{record['id']}/image?w=wide").status_code == 400
+
+
+def test_image_route_falls_back_to_the_original(gallery, client):
+    upload(client, ('a.png', png('red')))
+    [record] = gallery.store.all()
+    response = client.get(f"/photos/{record['id']}/image", headers={'Accept': 'image/avif'})
+    assert (response.status_code, response.headers['Location']) == (302, record['url'])
+    assert client.get('/photos/missing/image').status_code == 404
+
+
+def test_variants_of_a_photo_deleted_while_transcoding_are_reclaimed(transcoding, client, monkeypatch):
+    upload(client, ('a.png', noise()))
+    [record] = transcoding.store.all()
+    real_transcode = transcoding.transcode
+
+    def transcode_during_delete(*args):
+        renditions = real_transcode(*args)
+        assert client.delete(f"/delete/{record['id']}").status_code == 200
+        return renditions
+    monkeypatch.setattr(transcoding, 'transcode', transcode_during_delete)
+    transcoding.enricher.drain()
+
+    local = transcoding.get_storage('local')
+    stored = [os.path.join(root, name) for root, _, names in os.walk(local.root) for name in names]
+    # The original plus a rendition per format, all tombstoned
+    assert len(stored) == 1 + len(available_formats())
+    assert transcoding.reconciler.status()['pending'] == len(stored)
+    transcoding.reconciler.drain()
+    assert not any(os.path.exists(path) for path in stored)
@@ -0,0 +1,53 @@
+import hashlib
+
+from conftest import png, upload
+
+
+def test_upload_stores_the_bytes_under_their_hash(gallery, client):
+    content = png('red')
+    response = upload(client, ('a.png', content), ('notes.txt', b'not an image'))
+    assert response.status_code == 200
+    assert response.get_json()['files'] == ['a.png']
+
+    [record] = gallery.store.all()
+    sha256 = hashlib.sha256(content).hexdigest()
+    assert (record['sha256'], record['size'], record['enriched']) == (sha256, len(content), False)
+    with open(gallery.get_storage('local').local_path(record), 'rb') as f:
+        assert f.read() == content
+    assert client.get(record['url']).data == content
+
+
+def test_upload_queues_enrichment(gallery, client):
+    upload(client, ('a.png', png('red', (64, 48))))
+    gallery.enricher.drain()
+
+    [record] = gallery.store.all()
+    assert (record['enriched'], record['width'], record['height'], record['format']) == (True, 64, 48, 'PNG')
+
+
+def test_upload_without_files_is_rejected(client):
+    assert client.post('/upload', data={}, content_type='multipart/form-data').status_code == 400
+    assert upload(client, ('notes.txt', b'text')).status_code == 400
+
+
+def test_reupload_survives_the_earlier_copys_tombstone(gallery, client, monkeypatch):
+    content = png('red')
+    upload(client, ('a.png', content))
+    [first] = gallery.store.all()
+    client.delete(f"/delete/{first['id']}")
+
+    # The same bytes come back, and the old tombstone runs between the put and the save
+    storage = gallery.get_storage('local')
+    put = storage.put
+
+    def put_then_reconcile(*args):
+        result = put(*args)
+        gallery.reconciler.drain()
+        return result
+    monkeypatch.setattr(storage, 'put', put_then_reconcile)
+    assert upload(client, ('a.png', content)).status_code == 200
+
+    [record] = gallery.store.all()
+    assert record['storage_key'] == first['storage_key']
+    assert client.get(record['url']).data == content
+    assert gallery.reconciler.status()['pending'] == 0
@@ -0,0 +1,120 @@
+import hashlib
+from io import BytesIO
+
+FORMAT_MIME = {'avif': 'image/avif', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+# Per-source encoder settings, each a list of candidates of which the
+# smallest wins. Photos tolerate lower quality than screenshots and
+# graphics, where ringing around text shows, and flat graphics often
+# come out smaller as lossless WebP. AVIF is skipped if Pillow was built
+# without it.
+PROFILES = {
+    'photo': {
+        'avif': [{'quality': 55}],
+        'webp': [{'quality': 80, 'method': 4}],
+        'jpeg': [{'quality': 82}],
+    },
+    'graphic': {
+        'avif': [{'quality': 75}],
+        'webp': [{'quality': 90, 'method': 4}, {'lossless': True, 'method': 4}],
+        'jpeg': [{'quality': 90}],
+    },
+    'alpha': {
+        'avif': [{'quality': 75}],
+        'webp': [{'quality': 90, 'method': 4}, {'lossless': True, 'method': 4}],
+    },
+}
+
+
+def available_formats():
+    from PIL import features
+
+    return tuple(fmt for fmt in FORMAT_MIME if fmt == 'jpeg' or features.check(fmt))
+
+
+def profile_for(img, source_format):
+    """'alpha' for images with real transparency, 'photo' for camera formats, else 'graphic'"""
+    if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+        alpha = img.convert('RGBA').getchannel('A')
+        if alpha.getextrema()[0] < 255:
+            return 'alpha'
+    return 'photo' if source_format in ('JPEG', 'WEBP', 'MPO', 'HEIF', 'AVIF') else 'graphic'
+
+
+def encode(img, fmt, settings):
+    buf = BytesIO()
+    if fmt == 'jpeg':
+        # Progressive so a partly loaded image is already a blurry preview
+        img.convert('RGB').save(buf, 'JPEG', progressive=True, optimize=True, **settings)
+    elif fmt == 'webp':
+        img.save(buf, 'WEBP', **settings)
+    else:
+        img.save(buf, 'AVIF', **settings)
+    return buf.getvalue()
+
+
+def transcode(stream, source_format, original_size, widths, formats=None, min_saving=0.1):
+    """Encode smaller renditions of an image and return ``(label, fmt, width, height, bytes)`` tuples.
+
+    Each width in ``widths`` is produced in every format the profile and
+    Pillow allow, with no upscaling. A rendition is kept only if it is at
+    least ``min_saving`` smaller than the original. Animated images are
+    left alone.
+    """
+    from PIL import Image, ImageOps
+
+    formats = formats or available_formats()
+    renditions = []
+    with Image.open(stream) as img:
+        if getattr(img, 'is_animated', False):
+            return renditions
+        img = ImageOps.exif_transpose(img)
+        profile = PROFILES[profile_for(img, source_format)]
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if profile is PROFILES['alpha'] else 'RGB')
+
+        seen = set()
+        for width in sorted(widths):
+            target = min(width, img.width)
+            if target in seen:
+                continue
+            seen.add(target)
+            scaled = img if target == img.width else img.resize(
+                (target, max(1, round(img.height * target / img.width))), Image.Resampling.LANCZOS, reducing_gap=3.0
+            )
+            for fmt, candidates in profile.items():
+                if fmt not in formats:
+                    continue
+                data = min((encode(scaled, fmt, settings) for settings in candidates), key=len)
+                if len(data) <= original_size * (1 - min_saving):
+                    renditions.append((f'w{target}', fmt, scaled.width, scaled.height, data))
+    return renditions
+
+
+def variant_record(label, fmt, width, height, data):
+    return {
+        'label': label,
+        'format': fmt,
+        'mime': FORMAT_MIME[fmt],
+        'width': width,
+        'height': height,
+        'size': len(data),
+        'sha256': hashlib.sha256(data).hexdigest(),
+    }
+
+
+def choose_variant(variants, accept_mimetypes, width=None):
+    """Best rendition for a request: the smallest width covering ``width`` (else the largest), then the
+    fewest bytes among formats the client accepts. AVIF and WebP count only if named explicitly, since
+    browsers that can't decode them still send image/* and */*."""
+    explicit = {value for value, quality in accept_mimetypes if quality > 0}
+    usable = [v for v in variants if v['format'] == 'jpeg' or v['mime'] in explicit]
+    if not usable:
+        return None
+    widths = sorted({v['width'] for v in usable})
+    if width:
+        covering = [w for w in widths if w >= width]
+        chosen = covering[0] if covering else widths[-1]
+    else:
+        chosen = widths[-1]
+    return min((v for v in usable if v['width'] == chosen), key=lambda v: v['size'])
@@ -0,0 +1,93 @@
+import time
+import threading
+
+
+class Pacer:
+    """Spaces calls from any number of threads to at most ``rate`` a second (0 means no limit)"""
+
+    def __init__(self, rate=0):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_call = 0.0
+
+    def wait(self):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next_call)
+            self.next_call = start + 1.0 / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+
+class BackgroundWorker:
+    """Daemon thread that works through batches, shared by the enricher and the reconciler.
+
+    Subclasses implement ``run_once``, which processes one batch and
+    returns how many items it took (0 when there is nothing to do). The
+    thread runs batches until one comes back empty, calls ``_idle``, then
+    sleeps until ``wake`` is called or ``_seconds_until_due`` passes.
+    ``process_lock`` keeps a ``drain`` in the caller's thread from running
+    a batch alongside the worker's, and ``_pace`` spaces remote calls to at
+    most ``rate`` a second (0 means no limit).
+    """
+
+    name = 'worker'
+
+    def __init__(self, rate=0):
+        self.pacer = Pacer(rate)
+        self.lock = threading.Lock()
+        self.process_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    @property
+    def rate(self):
+        return self.pacer.rate
+
+    @rate.setter
+    def rate(self, rate):
+        self.pacer.rate = rate
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self.thread.start()
+
+    def wake(self):
+        """Start the thread if needed and have it look for work now"""
+        self.start()
+        self.wakeup.set()
+
+    def _pace(self):
+        self.pacer.wait()
+
+    def run_once(self):
+        raise NotImplementedError
+
+    def drain(self, timeout=None):
+        """Run batches in the calling thread until none is left, or ``timeout`` seconds have passed"""
+        deadline = time.time() + timeout if timeout else None
+        while self.run_once():
+            if deadline and time.time() > deadline:
+                break
+
+    def _idle(self):
+        """Runs on the worker thread each time the batches run out"""
+
+    def _seconds_until_due(self):
+        """How long the thread may sleep before there is work again; None waits for ``wake``"""
+        return None
+
+    def _run(self):
+        while True:
+            try:
+                while self.run_once():
+                    pass
+                self._idle()
+            except Exception as e:
+                print(f"{self.name.capitalize()} error: {str(e)}")
+            self.wakeup.wait(self._seconds_until_due())
+            self.wakeup.clear()